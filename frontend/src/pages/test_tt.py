@@ -0,0 +1,804 @@
+"""Golden-corpus regression and timing-budget tests for tt.py detection helpers.
+
+A corpus of cruise numbers, manifest names and workbooks (xls/xlsx; detailed, summary
+and mixed sheets; title rows, accented/odd headers, zero-padded numbers) is generated
+in a temporary folder. Outputs are compared with test_tt_golden.json and each stage
+must also stay within its time budget. File operations (sheet filtering, post-detection
+plans, journal/undo, locked-file retries) are checked for their behaviour on small folders.
+
+Usage: python -m pytest -q test_tt.py
+  TT_UPDATE_GOLDEN=1   rewrite test_tt_golden.json from the current outputs
+  TT_BUDGET_SCALE=2.0  multiply every time budget (slow machines, coverage runs)
+"""
+import json
+import math
+import os
+import random
+import time
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+xlwt = pytest.importorskip("xlwt")
+pytest.importorskip("xlrd")
+openpyxl = pytest.importorskip("openpyxl")
+
+import tt
+
+GOLDEN_FILE = Path(__file__).with_name("test_tt_golden.json")
+UPDATE_GOLDEN = os.environ.get("TT_UPDATE_GOLDEN") == "1"
+BUDGET_SCALE = float(os.environ.get("TT_BUDGET_SCALE", "1.0"))
+
+# Seconds per stage for the workloads below (about 5x the time on a single-core dev VM)
+BUDGETS = {
+    "normalize_cruise_number": 0.25,
+    "find_manifests_for_cruise": 2.0,
+    "detect_sheet_type": 1.0,
+    "find_col": 0.5,
+    "read_with_best_header": 2.5,
+}
+
+DETAILED_HEADER = ["Last Name", "First Name", "Passport No", "Nationality", "Date of Birth", "Gender"]
+ODD_HEADER = ["Nom", "Prénom", "N° Passeport", "Nationalité", "Date_de_naissance", "Sexe"]
+SUMMARY_HEADER = ["Nationality", "Female", "Male", "Total"]
+
+NORMALIZE_INPUTS = [
+    1, 42, 1.0, 42.0, 7.5, "42", " 42 ", "0042", "42.0", "42,0", "1 234", "ab-12", "AB 12",
+    "A/B-12", "N° 42", "x", "", "   ", None, float("nan"),
+]
+
+MANIFEST_NAMES = [
+    "42-Ship.xlsx", "0042_Ship.xls", "042 Manifest.pdf", "42.PDF", "42A.xlsx", "420-Other.xlsx",
+    "142-Ship.xlsx", "107 Summary.xlsx", "107-Mixed.xls", "0007-Mixed.xlsx", "7.xlsx",
+    "AB-12_manifest.xlsx", "ab-12.pdf", "AB-123.xlsx", "notes.txt", "42-Ship.docx",
+]
+CRUISES = ["42", "7", "107", "42A", "AB-12", "12", "999", ""]
+
+FIND_COL_CASES = [
+    (DETAILED_HEADER, ["first name", "given name", "prenom"]),
+    (DETAILED_HEADER, ["last name", "surname", "nom"]),
+    (ODD_HEADER, ["first name", "given name", "prenom"]),
+    (ODD_HEADER, ["passport", "passeport", "n passeport"]),
+    (ODD_HEADER, ["date of birth", "date de naissance"]),
+    (ODD_HEADER, ["gender", "sex", "sexe"]),
+    (["PASSENGER_NAME", "DOC  NUMBER", "Citizenship"], ["passenger name", "full name"]),
+    (["PASSENGER_NAME", "DOC  NUMBER", "Citizenship"], ["doc number", "passport"]),
+    (["PASSENGER_NAME", "DOC  NUMBER", "Citizenship"], ["nationality", "citizenship"]),
+    (["Name of ship", "Date"], ["date of birth", "dob"]),
+    ([], ["gender"]),
+]
+
+
+def _detailed_rows(rng: random.Random, n: int):
+    return [
+        [f"NAME{i}", f"First{i}", f"P{rng.randrange(10**6):06d}", rng.choice(["FRA", "ITA", "Maroc", "DEU"]),
+         f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1940, 2015)}", rng.choice(["M", "F"])]
+        for i in range(n)
+    ]
+
+
+def _sheets(rng: random.Random):
+    detailed = [DETAILED_HEADER] + _detailed_rows(rng, 40)
+    body = _detailed_rows(rng, 40)
+    # Title rows above the header, a repeated header and a blank row inside the data
+    detailed_titled = [["MANIFEST PASSAGERS"], ["Navire: Ocean Star"], []] + [ODD_HEADER] + body[:20] \
+        + [ODD_HEADER, []] + body[20:]
+    summary = [SUMMARY_HEADER] + [[c, rng.randint(0, 50), rng.randint(0, 50), 0] for c in ("FRA", "ITA", "DEU")]
+    summary_titled = [["Récapitulatif"], []] + summary
+    return {"detailed": detailed, "detailed_titled": detailed_titled,
+            "summary": summary, "summary_titled": summary_titled}
+
+
+def _write_xlsx(path: Path, sheets):
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(title=name)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+
+
+def _write_xls(path: Path, sheets):
+    wb = xlwt.Workbook()
+    for name, rows in sheets.items():
+        ws = wb.add_sheet(name)
+        for r, row in enumerate(rows):
+            for c, v in enumerate(row):
+                ws.write(r, c, v)
+    wb.save(str(path))
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    root = tmp_path_factory.mktemp("corpus")
+    rng = random.Random(20240501)
+    s = _sheets(rng)
+    workbooks = {
+        "42-Ship.xlsx": {"Passengers": s["detailed"]},
+        "0042_Ship.xls": {"Pax": s["detailed_titled"]},
+        "107 Summary.xlsx": {"Summary": s["summary"]},
+        "107-Mixed.xls": {"Crew": s["detailed"], "Stats": s["summary_titled"]},
+        "0007-Mixed.xlsx": {"Liste": s["detailed_titled"], "Résumé": s["summary"]},
+        "AB-12_manifest.xlsx": {"Feuil1": s["summary_titled"], "Feuil2": s["detailed"]},
+    }
+    manifests = root / "manifests"
+    manifests.mkdir()
+    for name in MANIFEST_NAMES:
+        if name in workbooks:
+            (_write_xls if name.endswith(".xls") else _write_xlsx)(manifests / name, workbooks[name])
+        else:
+            (manifests / name).write_bytes(b"")
+    # Large folder for the lookup budget: 2000 manifests of 500 cruises, zero-padded half of the time
+    crowded = root / "crowded"
+    crowded.mkdir()
+    for i in range(2000):
+        n = i % 500
+        (crowded / (f"{n:04d}_M{i}.xlsx" if i % 2 else f"{n}-M{i}.xlsx")).write_bytes(b"")
+    passenger_sheets = [(n, sheet) for n, sheets in workbooks.items() for sheet, rows in sheets.items()
+                        if rows is s["detailed"] or rows is s["detailed_titled"]]
+    return {"manifests": manifests, "crowded": crowded, "workbooks": workbooks, "passenger_sheets": passenger_sheets}
+
+
+@pytest.fixture(scope="module")
+def gui():
+    g = tt.CruiseDetectorGUI.__new__(tt.CruiseDetectorGUI)
+    g._init_state(tt.DetachedVar, tt.DetachedVar)
+    g.status_var = tt.DetachedVar()
+    g.root = tt.DetachedWidget()
+    return g
+
+
+@pytest.fixture(scope="module")
+def golden():
+    data = {} if UPDATE_GOLDEN or not GOLDEN_FILE.exists() else json.loads(GOLDEN_FILE.read_text(encoding="utf-8"))
+    yield data
+    if UPDATE_GOLDEN:
+        GOLDEN_FILE.write_text(json.dumps(data, ensure_ascii=False, indent=1, sort_keys=True) + "\n", encoding="utf-8")
+
+
+def check_golden(golden, key, actual):
+    """Compare with the golden output (or record it when TT_UPDATE_GOLDEN=1)."""
+    actual = json.loads(json.dumps(actual, ensure_ascii=False, default=str))
+    if UPDATE_GOLDEN:
+        golden[key] = actual
+        return
+    assert key in golden, f"no golden output for {key}: run with TT_UPDATE_GOLDEN=1"
+    assert actual == golden[key]
+
+
+def timed(stage, fn, repeat=1):
+    """Run fn repeat times, assert the stage budget, and return the last result."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = time.perf_counter() - start
+    budget = BUDGETS[stage] * BUDGET_SCALE
+    assert elapsed <= budget, f"{stage}: {elapsed:.3f}s > budget {budget:.3f}s"
+    return result
+
+
+def _key(value) -> str:
+    if isinstance(value, float) and math.isnan(value):
+        return "float:nan"
+    return f"{type(value).__name__}:{value!r}"
+
+
+def test_normalize_cruise_number(gui, golden):
+    check_golden(golden, "normalize_cruise_number",
+                 {_key(v): gui.normalize_cruise_number(v) for v in NORMALIZE_INPUTS})
+    workload = NORMALIZE_INPUTS * 1000
+    timed("normalize_cruise_number", lambda: [gui.normalize_cruise_number(v) for v in workload])
+
+
+def test_normalize_cruise_number_basics(gui):
+    assert gui.normalize_cruise_number(42.0) == "42"
+    assert gui.normalize_cruise_number("0042") == "42"
+    assert gui.normalize_cruise_number(" ab-12 ") == "AB-12"
+    assert gui.normalize_cruise_number(None) == ""
+
+
+def test_find_manifests_for_cruise(gui, golden, corpus):
+    check_golden(golden, "find_manifests_for_cruise",
+                 {c: gui.find_manifests_for_cruise(c, corpus["manifests"]) for c in CRUISES})
+    found = timed("find_manifests_for_cruise",
+                  lambda: {str(n): gui.find_manifests_for_cruise(str(n), corpus["crowded"]) for n in range(0, 500, 25)})
+    assert all(len(names) == 4 for names in found.values())
+
+
+def test_find_manifests_prefix_rules(gui, corpus):
+    names = gui.find_manifests_for_cruise("42", corpus["manifests"])
+    assert "0042_Ship.xls" in names and "42.PDF" in names
+    assert "420-Other.xlsx" not in names and "142-Ship.xlsx" not in names and "42A.xlsx" not in names
+    assert "42-Ship.docx" not in names
+
+
+def _excel_sheets(corpus):
+    for name, sheets in sorted(corpus["workbooks"].items()):
+        for sheet in sheets:
+            yield name, corpus["manifests"] / name, sheet
+
+
+def test_detect_sheet_type(gui, golden, corpus):
+    types = {f"{name}/{sheet}": gui._detect_sheet_type(path, sheet) for name, path, sheet in _excel_sheets(corpus)}
+    check_golden(golden, "detect_sheet_type", types)
+    assert types["42-Ship.xlsx/Passengers"] == "detailed"
+    # French headers under title rows
+    assert types["0042_Ship.xls/Pax"] == types["0007-Mixed.xlsx/Liste"] == "detailed"
+    assert types["107 Summary.xlsx/Summary"] == "summary"
+    assert types["AB-12_manifest.xlsx/Feuil2"] == "detailed"
+    timed("detect_sheet_type",
+          lambda: [gui._detect_sheet_type(path, sheet) for _, path, sheet in _excel_sheets(corpus)], repeat=5)
+
+
+def test_sheet_rules_score_each_french_header_once():
+    detailed, _ = tt.SHEET_RULES.scan(["Prénom", "Cabin"])
+    assert detailed == {"prenom", "cabin"}
+    assert len(tt.SHEET_RULES.scan(["Prénom", "Nom", "Cabine"])[0]) < tt.SHEET_RULES.detailed_threshold
+    assert tt.SHEET_RULES.scan(["Nationalité", "Date_de_naissance", "Sexe"])[0] == {"nationalite", "date de naissance", "sex"}
+
+
+def test_find_col(gui, golden):
+    check_golden(golden, "find_col", [gui._find_col(cols, cands) for cols, cands in FIND_COL_CASES])
+    timed("find_col", lambda: [gui._find_col(cols, cands) for cols, cands in FIND_COL_CASES], repeat=500)
+
+
+def _frame_digest(df: pd.DataFrame):
+    return {
+        "columns": [str(c) for c in df.columns],
+        "rows": len(df),
+        "first": [None if pd.isna(v) else str(v) for v in df.iloc[0].tolist()] if len(df) else [],
+        "last": [None if pd.isna(v) else str(v) for v in df.iloc[-1].tolist()] if len(df) else [],
+    }
+
+
+def test_read_with_best_header(gui, golden, corpus):
+    detailed = [(n, corpus["manifests"] / n, s) for n, s in sorted(corpus["passenger_sheets"])]
+    digests = {f"{n}/{s}": _frame_digest(gui._read_with_best_header(p, s)) for n, p, s in detailed}
+    check_golden(golden, "read_with_best_header", digests)
+    # Title rows and the repeated header are skipped, so every sheet yields its 40 passengers
+    assert all(d["rows"] == 40 for d in digests.values())
+    projected = {f"{n}/{s}": _frame_digest(gui._read_with_best_header(p, s, project=True)) for n, p, s in detailed}
+    check_golden(golden, "read_with_best_header_projected", projected)
+    timed("read_with_best_header",
+          lambda: [gui._read_with_best_header(p, s, project=True) for _, p, s in detailed], repeat=3)
+
+
+def test_projected_read_types_columns_by_position(gui, tmp_path):
+    path = tmp_path / "dup.xlsx"
+    header = ["Passport", "Remarks", "Passport", "Date of birth", "Nationality", 2024]
+    _write_xlsx(path, {"Pax": [header, [12345, "x", 678, pd.Timestamp(1980, 5, 17), "FRA", 1]]})
+    df = gui._read_with_best_header(path, "Pax", project=True)
+    # The duplicate 'Passport' (read as 'Passport.1') and the numeric header are not projected
+    assert list(df.columns) == ["Passport", "Date of birth", "Nationality"]
+    assert df.iloc[0, 0] == "12345" and str(df.dtypes.iloc[0]) == "string"
+    assert df.iloc[0, 1] == pd.Timestamp(1980, 5, 17)
+
+
+def test_parse_date_column_eight_digit_text(gui):
+    # ddmmyyyy text must go through format inference, not the Excel serial fast path
+    parsed = gui._parse_date_column(pd.Series(["15011990", "01051985", "02121970", "23041975"]), "ddmmyyyy")
+    assert [d.date().isoformat() for d in parsed] == ["1990-01-15", "1985-05-01", "1970-12-02", "1975-04-23"]
+
+
+def test_parse_date_column_serials_and_out_of_range(gui):
+    from datetime import date, datetime
+    values = [32874, 32874.0, "32874", None, datetime(2990, 1, 1), date(1980, 5, 2)]
+    parsed = gui._parse_date_column(pd.Series(values, dtype=object), "serials")
+    assert str(parsed.dtype) == "datetime64[ns]"
+    assert [None if pd.isna(d) else d.date().isoformat() for d in parsed] == \
+        ["1990-01-01", "1990-01-01", "1990-01-01", None, None, "1980-05-02"]
+    text = gui._parse_date_column(pd.Series(["01/02/1980", "12/11/2990"]), "typo")
+    assert text.iloc[0].date().isoformat() == "1980-02-01" and pd.isna(text.iloc[1])
+
+
+class _FakeRoot(tt.DetachedWidget):
+    def title(self, *args):
+        pass
+
+    def geometry(self, *args):
+        pass
+
+    def mainloop(self):
+        pass
+
+
+def _fake_setup_ui(self):
+    # Widgets and variables restore_session/detection use, without a display
+    self.status_var = tt.DetachedVar()
+    self.number_column = tt.DetachedVar(value="N")
+    self.dashboard_path = tt.DetachedVar()
+    self.tree = tt.DetachedWidget()
+    for name in ("detect_button", "btn_move_processed", "btn_move_pdfs", "btn_move_summary_excel",
+                 "btn_move_correct_excel"):
+        setattr(self, name, tt.DetachedWidget())
+
+
+@pytest.fixture
+def windowless(monkeypatch, tmp_path):
+    """CruiseDetectorGUI() without a display; the session and PDF probe cache files live in tmp_path."""
+    monkeypatch.setattr(tt.tk, "Tk", _FakeRoot)
+    monkeypatch.setattr(tt.tk, "StringVar", tt.DetachedVar)
+    monkeypatch.setattr(tt.tk, "BooleanVar", tt.DetachedVar)
+    monkeypatch.setattr(tt.CruiseDetectorGUI, "setup_ui", _fake_setup_ui)
+    monkeypatch.setattr(tt, "SESSION_FILE", tmp_path / "session.pickle")
+    monkeypatch.setattr(tt, "PDF_PROBE_CACHE_FILE", tmp_path / "probe_cache.json")
+    return tmp_path
+
+
+def test_session_restored_at_construction(windowless):
+    cruise_list = windowless / "cruises.xlsx"
+    pd.DataFrame({"N": [42, 7], "Nom": ["Ocean", "Star"]}).to_excel(cruise_list, index=False)
+    manifests = windowless / "manifests"
+    manifests.mkdir()
+    _write_xlsx(manifests / "42-Ship.xlsx", {"Passengers": [DETAILED_HEADER] + _detailed_rows(random.Random(1), 3)})
+
+    first = tt.CruiseDetectorGUI()
+    assert first.matches == []
+    first.cruise_list_path.set(str(cruise_list))
+    first.manifests_dir_path.set(str(manifests))
+    first.dry_run_var.set(True)
+    first._show_plan_preview = lambda plan: None
+    assert not first.load_cruise_list(silent=True).get("error")
+    assert first.detect_manifests(silent=True)["with_manifests"] == 1
+    assert first.save_session()
+
+    restored = tt.CruiseDetectorGUI()
+    assert restored.manifests_dir_path.get() == str(manifests)
+    assert restored.cruise_df["N"].tolist() == [42, 7]
+    assert [(m.cruise_number, m.manifests) for m in restored.matches if m.manifests] == [("42", ["42-Ship.xlsx"])]
+    assert len(restored.tree.get_children()) == 2
+    assert restored.status_var.get().startswith("Session du")
+    assert restored.file_cruise_numbers == {str((manifests / "42-Ship.xlsx").resolve()): "42"}
+
+
+def test_detection_saves_the_session_once(windowless, monkeypatch):
+    cruise_list = windowless / "cruises.xlsx"
+    pd.DataFrame({"N": [42], "Nom": ["Ocean"]}).to_excel(cruise_list, index=False)
+    manifests = windowless / "manifests"
+    manifests.mkdir()
+    _write_xlsx(manifests / "42-Ship.xlsx", {"Passengers": [DETAILED_HEADER] + _detailed_rows(random.Random(1), 3)})
+    for name in ("showinfo", "showwarning", "showerror"):
+        monkeypatch.setattr(tt.messagebox, name, lambda *args, **kwargs: None)
+    app = tt.CruiseDetectorGUI()
+    app.cruise_list_path.set(str(cruise_list))
+    app.manifests_dir_path.set(str(manifests))
+    app._show_plan_preview = lambda plan: None
+    assert not app.load_cruise_list(silent=True).get("error")
+    saves = []
+    real_save = app.save_session
+    app.save_session = lambda: saves.append(1) or real_save()
+    for dry_run in (True, False):
+        saves.clear()
+        app.dry_run_var.set(dry_run)
+        app.detect_manifests()
+        assert len(saves) == 1
+    assert tt.SESSION_FILE.exists()
+
+
+def test_cruise_number_is_kept_per_path(fresh_gui, tmp_path):
+    # Agents name their files alike: the number found for one folder must not leak to the other
+    a, b = tmp_path / "agentA" / "manifest.xlsx", tmp_path / "agentB" / "manifest.xlsx"
+    fresh_gui.file_cruise_numbers = {fresh_gui._file_key(a): "42", fresh_gui._file_key(b): "7"}
+    assert fresh_gui._cruise_number_for_file(a) == "42"
+    assert fresh_gui._cruise_number_for_file(tmp_path / "agentB" / ".." / "agentB" / "manifest.xlsx") == "7"
+
+
+def _stuck_pdf_worker(path: str, max_pages: int):
+    # Stands in for pypdf hanging on a malformed file; leaves its pid behind for the test
+    Path(path).with_suffix(".pid").write_text(str(os.getpid()))
+    if "stuck" in path:
+        time.sleep(600)
+    return {"text": "Cruise no 4711\nName Surname Nationality Gender", "error": ""}
+
+
+def test_probe_pdfs_one_deadline_and_terminates_stuck_workers(gui, monkeypatch, tmp_path):
+    monkeypatch.setattr(tt, "_pdf_probe_worker", _stuck_pdf_worker)
+    monkeypatch.setattr(tt, "PDF_PROBE_TIMEOUT", 1)
+    monkeypatch.setattr(tt, "PDF_PROBE_CACHE_FILE", tmp_path / "probe_cache.json")
+    monkeypatch.setattr(gui, "pdf_probe_cache", {})
+    pdfs = [tmp_path / "ok.pdf", tmp_path / "stuck-1.pdf", tmp_path / "stuck-2.pdf"]
+    for pdf in pdfs:
+        pdf.write_bytes(b"%PDF-1.4")
+    start = time.perf_counter()
+    results = gui._probe_pdfs(pdfs)
+    # 3 files on at most 1-4 workers: the deadline is a few rounds, never one timeout per file
+    assert time.perf_counter() - start < 1 * len(pdfs) + 2
+    assert results[str(pdfs[0])]["cruise_numbers"] == ["4711"]
+    assert [results[str(p)]["error"] for p in pdfs[1:]] == ["timeout", "timeout"]
+    for pid_file in tmp_path.glob("stuck-*.pid"):
+        with pytest.raises(ProcessLookupError):
+            os.kill(int(pid_file.read_text()), 0)
+    assert set(gui.pdf_probe_cache) == {gui._pdf_fingerprint(pdfs[0])}
+    assert set(json.loads((tmp_path / "probe_cache.json").read_text())) == set(gui.pdf_probe_cache)
+
+
+def test_pdf_fingerprint_keys_on_the_resolved_path(gui, tmp_path):
+    a, b = tmp_path / "agentA" / "manifest.pdf", tmp_path / "agentB" / "manifest.pdf"
+    for pdf in (a, b):
+        pdf.parent.mkdir()
+        pdf.write_bytes(b"%PDF-1.4")
+        os.utime(pdf, ns=(0, 0))
+    assert gui._pdf_fingerprint(a) != gui._pdf_fingerprint(b)
+    assert gui._pdf_fingerprint(tmp_path / "agentA" / ".." / "agentA" / "manifest.pdf") == gui._pdf_fingerprint(a)
+
+
+def test_analyze_pdf_text_needs_a_cruise_label(gui):
+    labelled = gui._analyze_pdf_text("Passenger Manifest\nCroisière n° 0123\nPage 1 of 4")
+    assert labelled["cruise_numbers"] == ["123"]
+    # Title-area tokens (dates, page counts, ship codes) are not cruise numbers on their own
+    unlabelled = gui._analyze_pdf_text("Passenger Manifest 2024\nPage 1 of 4\nMSC 12")
+    assert unlabelled["cruise_numbers"] == []
+
+
+def test_is_lock_error_needs_a_sharing_violation(monkeypatch, tmp_path):
+    import errno
+    path = tmp_path / "a.xlsx"
+    sharing = PermissionError(13, "in use")
+    sharing.winerror = 32
+    assert tt.is_lock_error(sharing)
+    assert tt.is_lock_error(OSError(errno.EBUSY, "busy"))
+    assert not tt.is_lock_error(FileNotFoundError(2, "missing"), path)
+    # Denied ACL / read-only file: a failure unless the file is confirmed to be held open
+    denied = PermissionError(13, "denied")
+    assert not tt.is_lock_error(denied)
+    monkeypatch.setattr(tt, "file_is_locked", lambda p: False)
+    assert not tt.is_lock_error(denied, path)
+    monkeypatch.setattr(tt, "file_is_locked", lambda p: True)
+    assert tt.is_lock_error(denied, path)
+
+
+@pytest.fixture
+def fresh_gui(tmp_path):
+    """Headless instance with its own journal and undo folder under tmp_path."""
+    g = tt.CruiseDetectorGUI.__new__(tt.CruiseDetectorGUI)
+    g._init_state(tt.DetachedVar, tt.DetachedVar)
+    g.status_var = tt.DetachedVar()
+    g.root = tt.DetachedWidget()
+    g.journal = tt.OperationJournal(tmp_path / "journal.jsonl", tmp_path / "undo")
+    return g
+
+
+@pytest.fixture
+def fake_locks(monkeypatch):
+    """Names in the returned set are 'open in another program': moves fail with a sharing violation."""
+    locked = set()
+    real_move = tt.shutil.move
+
+    def move(src, dst):
+        if Path(src).name in locked:
+            err = PermissionError(13, "in use", src)
+            err.winerror = 32
+            raise err
+        return real_move(src, dst)
+
+    monkeypatch.setattr(tt.shutil, "move", move)
+    monkeypatch.setattr(tt, "file_is_locked", lambda p: Path(p).name in locked)
+    monkeypatch.setattr(tt, "LOCK_RETRY_BASE_DELAY", 0.01)
+    return locked
+
+
+class _EventLoopRoot(tt.DetachedWidget):
+    """Root whose after() callbacks wait for pump(), like Tk's event loop; update() must not be called."""
+
+    def after(self, ms, func=None, *args):
+        self._after.append((ms, func, args))
+
+    def update(self):
+        raise AssertionError("the Tk event loop was re-entered")
+
+    def pump(self, limit: float = 5.0):
+        deadline = time.monotonic() + limit
+        while self._after and time.monotonic() < deadline:
+            ms, func, args = self._after.pop(0)
+            time.sleep(ms / 1000)
+            func(*args)
+
+
+def test_locked_files_drain_from_the_event_loop(fresh_gui, fake_locks, tmp_path):
+    fresh_gui.root = _EventLoopRoot()
+    src = tmp_path / "in"
+    src.mkdir()
+    target = src / "pdf"
+    fresh_gui.last_manifests_dir = src
+    files = [src / "a.pdf", src / "b.pdf"]
+    for f in files:
+        f.write_bytes(b"%PDF")
+    fake_locks.add("b.pdf")
+    settled = []
+    with fresh_gui._journal_run("pdf") as run_id:
+        counts = fresh_gui._move_files(files, "pdf", on_done=settled.append)
+    # The batch returns at once; the locked file waits for the event loop
+    assert (counts["moved"], counts["locked_pending"], settled) == (1, 1, [])
+    fake_locks.clear()
+    fresh_gui.root.pump()
+    assert settled == [counts]
+    assert (counts["moved"], counts["locked_retried_ok"], counts["locked_still"], counts["locked_pending"]) == (2, 1, 0, 0)
+    assert sorted(p.name for p in target.iterdir()) == ["a.pdf", "b.pdf"]
+    # The late move is journaled in the run that parked it
+    assert sorted(Path(e["src"]).name for e in fresh_gui.journal.query(run=run_id)) == ["a.pdf", "b.pdf"]
+
+
+def test_manual_moves_use_each_files_output_folder(fresh_gui, tmp_path):
+    base = tmp_path / "manifests"
+    (base / "ShipA").mkdir(parents=True)
+    nested, top = base / "ShipA" / "42.pdf", base / "7.pdf"
+    for f in (nested, top):
+        f.write_bytes(b"%PDF")
+    fresh_gui.manifests_dir_path.set(str(base))
+    fresh_gui.last_manifests_dir = base
+    fresh_gui.include_all_pdfs_var.set(True)
+    fresh_gui.all_pdfs = [nested, top]
+    fresh_gui.update_pdf_action_button = lambda: None
+    assert fresh_gui.move_unmatched_pdfs(silent=True)["moved"] == 2
+    # Same layout as the automatic plan: next to the file when it sits in a subfolder
+    assert (base / "ShipA" / "pdf" / "42.pdf").exists() and (base / "pdf" / "7.pdf").exists()
+    assert fresh_gui._output_dest(base / "ShipA" / "x.xlsx", "excel resume") == "ShipA/excel resume"
+
+
+def test_pdf_rescan_after_folder_change_keeps_subfolders(fresh_gui, tmp_path):
+    base = tmp_path / "manifests"
+    (base / "ShipA").mkdir(parents=True)
+    nested, top = base / "ShipA" / "42.pdf", base / "7.pdf"
+    for f in (nested, top):
+        f.write_bytes(b"%PDF")
+    fresh_gui.manifests_dir_path.set(str(base))
+    fresh_gui.last_manifests_dir = tmp_path  # detection ran on another folder
+    fresh_gui.include_all_pdfs_var.set(True)
+    fresh_gui.recursive_scan_var.set(True)
+    fresh_gui.update_pdf_action_button = lambda: None
+    assert fresh_gui.move_unmatched_pdfs(silent=True)["moved"] == 2
+    assert (base / "ShipA" / "pdf" / "42.pdf").exists() and (base / "pdf" / "7.pdf").exists()
+    # Nothing to move: no empty output folder is left behind
+    fresh_gui.detailed_excel_files, fresh_gui.mixed_excel_files = [], {}
+    assert fresh_gui.move_correct_excel_files(silent=True) == {"moved": 0, "failed": 0}
+    assert not (base / "excel correct").exists()
+
+
+# --- Behaviour of the file operations (sheet filtering, plans, journal/undo, lock retries) ---
+
+def _sheet_states(path: Path):
+    wb = openpyxl.load_workbook(path)
+    try:
+        return {ws.title: ws.sheet_state for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+
+def _mixed_workbook(path: Path):
+    rows = [DETAILED_HEADER] + _detailed_rows(random.Random(3), 4)
+    _write_xlsx(path, {"Crew": rows, "Stats": [SUMMARY_HEADER, ["FRA", 3, 4, 7]], "Notes": [["Remark"], ["ok"]]})
+    return rows
+
+
+def test_xlsx_filter_package_keep_drop_hide(fresh_gui, tmp_path):
+    src = tmp_path / "mixed.xlsx"
+    rows = _mixed_workbook(src)
+    kept = tmp_path / "kept.xlsx"
+    assert fresh_gui._xlsx_filter_package(src, kept, keep=["Crew"])
+    assert _sheet_states(kept) == {"Crew": "visible"}
+    # Cells go through untouched
+    assert pd.read_excel(kept, sheet_name="Crew", header=None).astype(str).values.tolist() == \
+        pd.read_excel(src, sheet_name="Crew", header=None).astype(str).values.tolist()
+    assert len(pd.read_excel(kept, sheet_name="Crew")) == len(rows) - 1
+
+    edited = tmp_path / "edited.xlsx"
+    assert fresh_gui._xlsx_filter_package(src, edited, drop=["Notes"], hide=["Stats"])
+    states = _sheet_states(edited)
+    assert list(states) == ["Crew", "Stats"] and states["Crew"] == "visible" and states["Stats"] != "visible"
+
+    # Nothing left visible, or no listed sheet: dst is not written
+    nothing = tmp_path / "nothing.xlsx"
+    assert not fresh_gui._xlsx_filter_package(src, nothing, hide=["Crew", "Stats", "Notes"])
+    assert not fresh_gui._xlsx_filter_package(src, nothing, drop=["Missing"])
+    assert not nothing.exists()
+
+
+def test_xlsx_patch_in_place(fresh_gui, tmp_path):
+    path = tmp_path / "mixed.xlsx"
+    _mixed_workbook(path)
+    assert fresh_gui._xlsx_patch_in_place(path, drop=["Notes"], hide=["Stats"]) is True
+    assert _sheet_states(path)["Stats"] != "visible" and "Notes" not in _sheet_states(path)
+    assert fresh_gui._xlsx_patch_in_place(path, hide=["Crew"]) is False
+    assert _sheet_states(path)["Crew"] == "visible"
+    # The temporary package is gone whatever the outcome
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["mixed.xlsx"]
+    broken = tmp_path / "broken.xlsx"
+    broken.write_bytes(b"not a zip")
+    assert fresh_gui._xlsx_patch_in_place(broken, hide=["Crew"]) is None
+
+
+@pytest.fixture
+def detected_folder(fresh_gui, tmp_path):
+    """Manifests folder as left by a detection: one file of each kind, classified."""
+    base = tmp_path / "manifests"
+    base.mkdir()
+    detailed = [DETAILED_HEADER] + _detailed_rows(random.Random(4), 3)
+    _mixed_workbook(base / "1-Mixed.xlsx")
+    _write_xlsx(base / "2-Sum.xlsx", {"Stats": [SUMMARY_HEADER, ["ITA", 1, 2, 3]]})
+    _write_xlsx(base / "3-Ship.xlsx", {"Crew": detailed})
+    _write_xlsx(base / "9-Old.xlsx", {"Crew": detailed})
+    (base / "x.pdf").write_bytes(b"%PDF")
+    fresh_gui.manifests_dir_path.set(str(base))
+    fresh_gui.last_manifests_dir = base
+    fresh_gui.include_all_pdfs_var.set(True)
+    fresh_gui.ignored_files = [base / "9-Old.xlsx"]
+    fresh_gui.all_pdfs = [base / "x.pdf"]
+    fresh_gui.classify_excel_files()
+    return base
+
+
+def _tree(base: Path):
+    return sorted(p.relative_to(base).as_posix() for p in base.rglob("*") if p.is_file() and not p.name.startswith("."))
+
+
+def test_post_detection_plan_build_and_execute(fresh_gui, detected_folder):
+    base = detected_folder
+    before = _tree(base)
+    plan = fresh_gui._build_post_detection_plan()
+    assert _tree(base) == before
+    assert [(a.kind, a.category, Path(a.src).name, a.dest_dir) for a in plan.actions] == [
+        ("move", "processed", "9-Old.xlsx", "deja traite"),
+        ("move", "pdf", "x.pdf", "pdf"),
+        ("move", "resume", "2-Sum.xlsx", "excel resume"),
+        ("split_mixed", "resume", "1-Mixed.xlsx", "excel correct"),
+        ("move", "correct", "3-Ship.xlsx", "excel correct"),
+    ]
+    assert tt.PostDetectionPlan.from_dict(json.loads(plan.to_json())) == plan
+
+    summary = fresh_gui._execute_post_detection_plan(plan)
+    assert (summary["processed_moved"], summary["pdf_moved"], summary["resume_moved_whole"],
+            summary["resume_copied_mixed"], summary["resume_modified_original"], summary["correct_moved"]) == (1, 1, 1, 1, 1, 2)
+    assert _tree(base) == [
+        "deja traite/9-Old.xlsx", "excel correct/1-Mixed.xlsx", "excel correct/3-Ship.xlsx",
+        "excel resume/1-Mixed_resume.xlsx", "excel resume/2-Sum.xlsx", "pdf/x.pdf",
+    ]
+    # 'Notes' has no header row, so it counts as a summary sheet too
+    assert _sheet_states(base / "excel resume" / "1-Mixed_resume.xlsx") == {"Stats": "visible", "Notes": "visible"}
+    states = _sheet_states(base / "excel correct" / "1-Mixed.xlsx")
+    assert states["Crew"] == "visible" and states["Stats"] != "visible" and states["Notes"] != "visible"
+
+
+def test_journal_and_undo_restore_the_folder(fresh_gui, detected_folder):
+    base = detected_folder
+    before = _tree(base)
+    mixed_states = _sheet_states(base / "1-Mixed.xlsx")
+    fresh_gui._execute_post_detection_plan(fresh_gui._build_post_detection_plan())
+    run = fresh_gui.journal.last_undoable_run()
+    assert run["kind"] == "plan" and run["ended"]
+    ops = [e["op"] for e in fresh_gui.journal.query(run=run["run"])]
+    assert ops.count("move") == 5 and ops.count("create") == 1 and ops.count("hide_sheets") == 1
+    assert [Path(e["src"]).name for e in fresh_gui.journal.query(text="2-Sum")] == ["2-Sum.xlsx"]
+
+    result = fresh_gui.undo_last_run(silent=True)
+    assert (result["restored"], result["failed"]) == (7, 0)
+    assert _tree(base) == before
+    assert _sheet_states(base / "1-Mixed.xlsx") == mixed_states
+    runs = fresh_gui.journal.runs()
+    assert [r["kind"] for r in runs] == ["plan", "undo"] and runs[0]["undone"]
+    assert fresh_gui.journal.last_undoable_run() is None
+
+
+def test_operation_journal_skips_torn_lines(tmp_path):
+    journal = tt.OperationJournal(tmp_path / "journal.jsonl", tmp_path / "undo")
+    run = journal.begin_run("pdf", str(tmp_path))
+    journal.record("move", run, src="a.pdf", dst="pdf/a.pdf")
+    journal.end_run(run)
+    # A crash in the middle of a write leaves a partial last line
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"op":"move","run":"' + run + '","src":"b.p')
+    assert [e["src"] for e in journal.query(run=run)] == ["a.pdf"]
+    assert journal.runs()[0]["ops"] == 2 and journal.runs()[0]["ended"]
+
+
+def test_locked_file_retry_queue(monkeypatch, tmp_path):
+    locked = {"a.xlsx", "b.xlsx"}
+    probes = []
+
+    def is_locked(p):
+        probes.append((Path(p).name, time.monotonic()))
+        return Path(p).name in locked
+
+    monkeypatch.setattr(tt, "file_is_locked", is_locked)
+    queue = tt.LockedFileRetryQueue(attempts=3, base_delay=0.02, max_delay=0.05)
+    start = time.monotonic()
+    assert queue.park(tmp_path / "a.xlsx", "A") and queue.park(tmp_path / "b.xlsx", "B")
+    assert queue.pending() == 2
+    assert queue.take_ready(0.01) == []
+    locked.discard("a.xlsx")
+    assert [payload for payload, _ in queue.take_ready(2.0)] == ["A"]
+    # b stays locked: it is given up after its attempts, with growing delays
+    assert queue.take_ready(2.0) == []
+    assert queue.pending() == 0
+    b_probes = [t - start for name, t in probes if name == "b.xlsx"]
+    assert len(b_probes) == 3 and b_probes[1] - b_probes[0] >= 0.035
+    assert queue.close() == ["B"]
+    # Exhausted or closed queues refuse new files
+    assert not queue.park(tmp_path / "c.xlsx", "C")
+    assert not tt.LockedFileRetryQueue(attempts=2).park(tmp_path / "c.xlsx", "C", attempt=2)
+
+
+def test_normalize_nationality_folds_like_the_lookup(fresh_gui):
+    values = pd.Series(["Kényan", " nigerian ", "fra", "Côte d'Ivoire", "Martian", None])
+    codes = fresh_gui._normalize_nationality(values, "a.xlsx").tolist()
+    assert codes[:4] == ["KEN", "NGA", "FRA", tt.NATIONALITY_LOOKUP[tt._nationality_key("Côte d'Ivoire")]]
+    assert codes[4] == "Martian" and pd.isna(codes[5])
+    assert fresh_gui.unknown_nationalities["a.xlsx"] == {"Martian"}
+
+
+def test_validation_reports_the_sheet_row(fresh_gui, tmp_path):
+    path = tmp_path / "42-Ship.xlsx"
+    rows = _detailed_rows(random.Random(5), 4)
+    rows[2][2] = None  # passport missing on the 3rd passenger
+    # Title and blank rows above the header, a blank separator between passengers
+    _write_xlsx(path, {"Passengers": [["MSC Ocean - passenger list"], [], DETAILED_HEADER] + rows[:2] + [[]] + rows[2:]})
+    mapped = fresh_gui._map_source_to_dashboard(fresh_gui._read_with_best_header(path, "Passengers", project=True),
+                                                path, "Passengers")
+    issues = fresh_gui._validate_passenger_rows(mapped)
+    missing = issues[issues["Issue"] == "Passeport manquant"]
+    # Header on Excel row 3, passengers on rows 4-5 and 7-8
+    assert missing["Row"].tolist() == [7]
+    assert openpyxl.load_workbook(path)["Passengers"].cell(row=7, column=1).value == rows[2][0]
+
+
+def test_parallel_merge_keeps_order_and_cruise_numbers_by_path(fresh_gui, monkeypatch, tmp_path):
+    monkeypatch.setattr(tt.os, "cpu_count", lambda: 2)
+    fresh_gui.root = _EventLoopRoot()
+    files = []
+    for i, agent in enumerate(["agentA", "agentB", "agentC", "agentD"]):
+        path = tmp_path / agent / "manifest.xlsx"
+        path.parent.mkdir()
+        _write_xlsx(path, {"Passengers": [DETAILED_HEADER] + _detailed_rows(random.Random(10 + i), 2)})
+        fresh_gui.file_cruise_numbers[fresh_gui._file_key(path)] = str(100 + i)
+        files.append(path)
+    results = fresh_gui._merge_files(files)
+    assert [r["error"] for r in results] == [""] * 4
+    assert [r["frames"][0]["CruiseNumber"].unique().tolist() for r in results] == [["100"], ["101"], ["102"], ["103"]]
+    # Date formats inferred by the workers come back to the instance's per-layout cache
+    assert "%d/%m/%Y" in fresh_gui._date_format_cache.values()
+    assert all("date_formats" not in r for r in results)
+    # Progress is posted to the event loop rather than pumped from inside the merge
+    assert len(fresh_gui.root._after) == 4
+    fresh_gui.root.pump()
+    assert fresh_gui.status_var.get() == "Merge en cours: 4/4 fichier(s)..."
+
+
+def _passenger(passport, first, cruise="42"):
+    row = dict.fromkeys(tt.DASHBOARD_COLUMNS, None)
+    row.update({"CruiseNumber": cruise, "LastName": "DOE", "FirstName": first, "Passport": passport,
+                "DateOfBirth": pd.Timestamp("1980-02-01"), "SourceFile": "42-Ship.xlsx", "SourceSheet": "Pax"})
+    return row
+
+
+def test_merge_same_passenger_twice_in_one_batch(fresh_gui, tmp_path):
+    dashboard = tmp_path / "dashboard.xlsx"
+    batch = pd.DataFrame([_passenger("X123", "Jon"), _passenger("Y456", "Ann"), _passenger("x-123", "John")],
+                         columns=tt.DASHBOARD_COLUMNS)
+    counts = fresh_gui._merge_rows_into_dashboard(batch, dashboard, update_existing=True)
+    assert (counts["appended"], counts["updated"], counts["total"]) == (2, 1, 2)
+    store = tt.DashboardStore(dashboard)
+    try:
+        # The later row of the batch wins
+        assert store.frame(["Passport", "FirstName"]).values.tolist() == [["x-123", "John"], ["Y456", "Ann"]]
+    finally:
+        store.close(commit=False)
+    counts = fresh_gui._merge_rows_into_dashboard(batch, tmp_path / "other.xlsx", update_existing=False)
+    assert (counts["appended"], counts["skipped"]) == (2, 1)
+    store = tt.DashboardStore(tmp_path / "other.xlsx")
+    try:
+        assert store.frame(["FirstName"])["FirstName"].tolist() == ["Jon", "Ann"]
+    finally:
+        store.close(commit=False)
+
+
+def test_merge_worker_uses_the_seeded_date_formats(tmp_path):
+    path = tmp_path / "42-Ship.xlsx"
+    _write_xlsx(path, {"Passengers": [DETAILED_HEADER, ["DOE", "Jon", "X12345", "FRA", "03/04/1980", "M"]]})
+    first = tt._merge_file_worker(str(path), "42", {})
+    assert first["error"] == "" and list(first["date_formats"].values()) == ["%d/%m/%Y"]
+    # A layout already in the cache is not inferred again: month-first is kept as given
+    seeded = {k: "%m/%d/%Y" for k in first["date_formats"]}
+    again = tt._merge_file_worker(str(path), "42", seeded)
+    assert again["date_formats"] == {}
+    assert again["frames"][0]["DateOfBirth"].iloc[0] == pd.Timestamp("1980-03-04")
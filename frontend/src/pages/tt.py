@@ -4,40 +4,1141 @@ import pandas as pd
 from pathlib import Path
 from datetime import datetime, date
 import re
-from typing import List, Dict, Optional, Tuple
+import os
+import sys
+import posixpath
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape as xml_escape, unescape as xml_unescape
+from typing import Callable, List, Dict, Optional, Tuple
 import unicodedata
-from dataclasses import dataclass
+from dataclasses import dataclass, field, asdict
+import json
+import pickle
+from contextlib import contextmanager
 import shutil
+import hashlib
+import heapq
+import sqlite3
+import threading
+import time
+import atexit
+import errno
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 try:
     from openpyxl import load_workbook  # for reading cell fill colors
 except Exception:
     load_workbook = None
 
+try:
+    from openpyxl import Workbook  # for writing converted .xls -> .xlsx copies
+except Exception:
+    Workbook = None
+
+try:
+    import xlrd  # legacy .xls (BIFF) reader with on-demand sheet loading
+except Exception:
+    xlrd = None
+
+try:
+    from pypdf import PdfReader  # text probe of PDF manifests
+except Exception:
+    PdfReader = None
+
+
+PDF_PROBE_MAX_PAGES = 2
+PDF_PROBE_TIMEOUT = 15  # seconds per file, scaled by the number of pool rounds into one batch deadline
+PDF_PROBE_CACHE_FILE = Path.home() / ".cruise_detector_pdf_probe_cache.json"
+
+# Sheet classification keywords; tt_sheet_rules.json next to this file overrides them
+SHEET_RULES_FILE = Path(__file__).with_name("tt_sheet_rules.json")
+DEFAULT_SHEET_RULES = {
+    "detailed_indicators": [
+        "last name", "first name", "name", "firstname", "surname",
+        "passport", "passport #", "passport number", "document", "document type",
+        "nationality", "nationality code", "nationality 3-letter code",
+        "date of birth", "dob", "d.o.b", "gender", "sex", "expiry", "expires",
+        "issue date", "embark", "debark", "cabin", "function",
+        # French manifests (matched without accents: 'Prénom', 'Nationalité', 'Date_de_naissance';
+        # 'Sexe' is already found by 'sex'). No bare 'nom': as a substring it would also match
+        # inside 'prenom' and score one 'Prénom' cell twice
+        "prenom", "passeport", "nationalite", "date de naissance",
+    ],
+    "summary_keywords": ["female", "male"],
+    "detailed_threshold": 3,
+}
+
+
+class SheetRuleEngine:
+    """Summary/detailed header rules compiled into one regex.
+
+    A row is scanned once: its cells are folded (lower case, no accents, '_' as a space) and
+    joined with a separator that no keyword contains, and a lookahead alternation factored
+    as a character trie finds the longest keyword starting at each position. Keywords
+    contained in a matched keyword are added from a precomputed table, so the matched set
+    equals the former "keyword in any cell" substring test.
+    """
+    _SEP = "\x1f"
+
+    def __init__(self, detailed_indicators: List[str], summary_keywords: List[str], detailed_threshold: int = 3):
+        self.detailed_indicators = [self._fold(k.strip()) for k in detailed_indicators if k.strip()]
+        self.summary_keywords = [self._fold(k.strip()) for k in summary_keywords if k.strip()]
+        self.detailed_threshold = int(detailed_threshold)
+        keywords = sorted(set(self.detailed_indicators) | set(self.summary_keywords), key=lambda k: (-len(k), k))
+        self._contained = {k: frozenset(o for o in keywords if o in k) for k in keywords}
+        self._detailed = frozenset(self.detailed_indicators)
+        self._summary = frozenset(self.summary_keywords)
+        self._regex = re.compile("(?=(" + self._trie_pattern(keywords) + "))") if keywords else None
+
+    @staticmethod
+    def _fold(text: str) -> str:
+        text = text.lower().replace("_", " ")
+        if text.isascii():
+            return text
+        return "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+
+    @staticmethod
+    def _trie_pattern(keywords: List[str]) -> str:
+        """Alternation factored as a character trie: each position is tested against one
+        branch per distinct next character, and greedy optional tails keep the longest match."""
+        trie: Dict = {}
+        for k in keywords:
+            node = trie
+            for ch in k:
+                node = node.setdefault(ch, {})
+            node[""] = {}
+
+        def _pattern(node: Dict) -> str:
+            branches = [re.escape(ch) + _pattern(child) for ch, child in sorted(node.items()) if ch]
+            if not branches:
+                return ""
+            body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+            if "" in node:
+                return ("(?:" + body + ")?") if len(branches) == 1 else body + "?"
+            return body
+
+        return _pattern(trie)
+
+    @classmethod
+    def load(cls, path: Path = SHEET_RULES_FILE) -> "SheetRuleEngine":
+        """Rules from a JSON config file; missing keys (or a missing/invalid file) use the defaults."""
+        rules = dict(DEFAULT_SHEET_RULES)
+        try:
+            if path.exists():
+                rules.update(json.loads(path.read_text(encoding="utf-8")))
+        except Exception:
+            pass
+        return cls(rules["detailed_indicators"], rules["summary_keywords"], rules["detailed_threshold"])
+
+    def scan(self, cells) -> Tuple[frozenset, frozenset]:
+        """(detailed indicators, summary keywords) found in a row of header-like cells."""
+        if self._regex is None:
+            return frozenset(), frozenset()
+        text = self._fold(self._SEP.join(str(x).strip() for x in cells))
+        found = set()
+        for m in self._regex.finditer(text):
+            found |= self._contained[m.group(1)]
+        return frozenset(found & self._detailed), frozenset(found & self._summary)
+
+    def classify(self, cells) -> Optional[str]:
+        """'summary' if a summary keyword is present (it takes precedence), 'detailed' if
+        enough indicators are, else None (the row is not a header)."""
+        detailed, summary = self.scan(cells)
+        if summary:
+            return "summary"
+        if len(detailed) >= self.detailed_threshold:
+            return "detailed"
+        return None
+
+
+SHEET_RULES = SheetRuleEngine.load()
+
+MANIFEST_EXTENSIONS = (".xlsx", ".xls", ".pdf")
+# Folders the tool creates next to the manifests: never scanned as input
+OUTPUT_FOLDER_NAMES = ("pdf", "deja traite", "excel resume", "excel correct", "excel echoues", "doublons")
+# Concurrent os.scandir calls of a recursive scan (network shares are latency bound)
+MANIFEST_SCAN_WORKERS = 8
+
+# Parallel merge: below this many files the pool start-up costs more than it saves
+MERGE_PARALLEL_MIN_FILES = 4
+
+# Detection session saved after each detection and restored at startup
+SESSION_FILE = Path.home() / ".cruise_detector_session.pickle"
+SESSION_VERSION = 2
+
+# Operation journal: one JSON line per file change, for audit and "undo last run".
+# Lines are written and fsync'ed in batches (group commit) rather than one by one.
+JOURNAL_FILE = Path.home() / ".cruise_detector_journal.jsonl"
+# Copies of workbooks taken before their sheets are hidden/removed in place (one folder per run)
+JOURNAL_BACKUP_DIR = Path.home() / ".cruise_detector_undo"
+JOURNAL_BATCH_SIZE = 256
+JOURNAL_FLUSH_INTERVAL = 1.0  # seconds
+JOURNAL_KEEP_BACKUP_RUNS = 20
+
+# Files locked by another program (typically open in Excel on another workstation) are parked
+# and probed again in the background, with the delay doubling after each attempt
+LOCK_RETRY_ATTEMPTS = 7
+LOCK_RETRY_BASE_DELAY = 0.5  # seconds
+LOCK_RETRY_MAX_DELAY = 30.0
+LOCK_RETRY_MAX_WAIT = 120.0  # seconds a batch waits for its parked files once everything else is done
+LOCK_RETRY_POLL_MS = 250  # root.after() interval at which freed files are handed back to the batch
+
+
+def _pdf_probe_worker(path: str, max_pages: int) -> Dict:
+    """Extract the text of the first pages of a PDF (runs in a worker process)."""
+    try:
+        reader = PdfReader(path)
+        parts = []
+        for page in reader.pages[:max_pages]:
+            parts.append(page.extract_text() or "")
+        return {"text": "\n".join(parts)[:50000], "error": ""}
+    except Exception as e:
+        return {"text": "", "error": str(e)[:200]}
+
+
+def _merge_file_worker(path: str, cruise_number: Optional[str], date_formats: Dict) -> Dict:
+    """Read, map and validate the detailed sheets of one manifest (runs in a worker process).
+    date_formats seeds the per-layout date format cache; the formats inferred here come back
+    in the result under "date_formats"."""
+    gui = CruiseDetectorGUI.__new__(CruiseDetectorGUI)
+    gui._init_state(DetachedVar, DetachedVar)
+    gui.root = DetachedWidget()
+    gui.status_var = DetachedVar()
+    if cruise_number:
+        gui.file_cruise_numbers[gui._file_key(Path(path))] = cruise_number
+    gui._date_format_cache.update(date_formats)
+    result = gui._merge_file(Path(path))
+    result["date_formats"] = {k: v for k, v in gui._date_format_cache.items() if k not in date_formats}
+    return result
+
+
+class FileNameTable:
+    """Interned manifest file names of one detection: each name is stored once and
+    referenced by a small integer id; the matching Path is built once per name."""
+    __slots__ = ("base_dir", "names", "_ids", "_paths")
+
+    def __init__(self, base_dir: Optional[Path] = None):
+        self.base_dir = base_dir
+        self.names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._paths: List[Optional[Path]] = []
+
+    def intern(self, name: str) -> int:
+        fid = self._ids.get(name)
+        if fid is None:
+            fid = len(self.names)
+            self._ids[name] = fid
+            self.names.append(sys.intern(name))
+            self._paths.append(None)
+        return fid
+
+    def path(self, fid: int) -> Path:
+        p = self._paths[fid]
+        if p is None:
+            p = self.base_dir / self.names[fid]
+            self._paths[fid] = p
+        return p
+
+    def __len__(self) -> int:
+        return len(self.names)
+
 
-@dataclass
 class CruiseMatch:
-    """Represents a cruise with its Excel row and found manifests"""
-    excel_row: int
-    cruise_number: str
-    cruise_name: str
-    manifests: List[str]
-    excel_data: Dict
+    """Represents a cruise with its Excel row and found manifests.
+    Compact layout: the row is referenced by its index in cruise_df (no copied dict)
+    and manifests by their id in the detection's FileNameTable.
+    """
+    __slots__ = ("row_index", "cruise_number", "cruise_name", "manifest_ids", "_names", "_df")
+
+    def __init__(self, row_index, cruise_number: str, cruise_name: str,
+                 manifest_ids: Tuple[int, ...], names: FileNameTable, df: Optional[pd.DataFrame] = None):
+        self.row_index = row_index
+        self.cruise_number = cruise_number
+        self.cruise_name = cruise_name
+        self.manifest_ids = manifest_ids
+        self._names = names
+        self._df = df
+
+    @property
+    def excel_row(self) -> int:
+        # Excel row (1-indexed + header)
+        return int(self.row_index) + 2
+
+    @property
+    def manifests(self) -> List[str]:
+        return [self._names.names[i] for i in self.manifest_ids]
+
+    @property
+    def excel_data(self) -> Dict:
+        if self._df is None:
+            return {}
+        return self._df.loc[self.row_index].to_dict()
+
+
+@dataclass
+class PlannedAction:
+    """One file operation planned after detection.
+    kind: 'move' (src -> dest_dir), 'split_mixed' (resume copy + hide summary sheets, then
+    move to dest_dir) or 'fail' (move aside to 'excel echoues').
+    """
+    kind: str
+    category: str  # 'processed' | 'pdf' | 'resume' | 'correct' | 'failed'
+    src: str
+    dest_dir: str
+    summary_sheets: List[str] = field(default_factory=list)
+    detailed_sheets: List[str] = field(default_factory=list)
+    reason: str = ""
+
+
+@dataclass
+class PostDetectionPlan:
+    """Full set of post-detection actions built from a single detection pass."""
+    manifests_dir: str
+    pdf_mode: str
+    actions: List[PlannedAction] = field(default_factory=list)
+    created_at: str = ""
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PostDetectionPlan":
+        actions = [PlannedAction(**a) for a in data.get("actions", [])]
+        return cls(
+            manifests_dir=data.get("manifests_dir", ""),
+            pdf_mode=data.get("pdf_mode", "tous"),
+            actions=actions,
+            created_at=data.get("created_at", ""),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        for a in self.actions:
+            key = f"{a.category}:{a.kind}"
+            out[key] = out.get(key, 0) + 1
+        return out
+
+
+DASHBOARD_COLUMNS = [
+    "CruiseNumber", "LastName", "FirstName", "Passport", "Nationality",
+    "DateOfBirth", "Gender", "DateEntree", "DateSortie", "SourceFile", "SourceSheet",
+]
+
+
+DASHBOARD_DATE_COLUMNS = ("DateOfBirth", "DateEntree", "DateSortie")
+
+# Columns of the per-file validation report written next to the dashboard
+VALIDATION_COLUMNS = ["SourceFile", "SourceSheet", "Row", "CruiseNumber", "Field", "Issue", "Value"]
+
+# Summary sheets: header words of the per-gender count columns (first match wins, so 'female'
+# is tested before 'male'), and row labels of total lines
+SUMMARY_GENDER_COLUMNS = (
+    ("F", ("female", "femme", "women", "woman", "feminin")),
+    ("M", ("male", "homme", "men", "man", "masculin")),
+)
+SUMMARY_TOTAL_LABELS = {"TOTAL", "TOTAUX", "GRAND TOTAL", "TOTAL GENERAL", "SUM", "SOUS TOTAL"}
+STATS_COLUMNS = ["CruiseNumber", "Nationality", "Gender", "Count", "SourceFile", "SourceSheet"]
+
+# Excel date serials above this (year 2173) are not dates: 8-digit numbers are ddmmyyyy/yyyymmdd
+EXCEL_SERIAL_MAX = 100000
+
+# Text date layouts seen in manifests, tried in order (day-first wins ties, as in our manifests)
+MANIFEST_DATE_FORMATS = [
+    "%d/%m/%Y", "%m/%d/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d",
+    "%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%y", "%m/%d/%y",
+    "%d-%b-%Y", "%d %b %Y", "%d-%b-%y", "%d%m%Y", "%Y%m%d",
+]
+
+# ISO-3 code -> ISO-2 code, then names/demonyms seen in manifests (EN, FR, ES/IT/DE/PT where common)
+NATIONALITY_TABLE = {
+    "AFG": ["AF", "Afghanistan", "Afghan", "Afghane"],
+    "ALB": ["AL", "Albania", "Albanian", "Albanie", "Albanais"],
+    "DZA": ["DZ", "Algeria", "Algerian", "Algerie", "Algerien", "Algerienne"],
+    "AND": ["AD", "Andorra", "Andorran", "Andorre"],
+    "AGO": ["AO", "Angola", "Angolan", "Angolais"],
+    "ARG": ["AR", "Argentina", "Argentine", "Argentinian", "Argentin"],
+    "ARM": ["AM", "Armenia", "Armenian", "Armenie", "Armenien"],
+    "AUS": ["AU", "Australia", "Australian", "Australie", "Australien", "Australienne"],
+    "AUT": ["AT", "Austria", "Austrian", "Autriche", "Autrichien", "Osterreich", "Oesterreich"],
+    "AZE": ["AZ", "Azerbaijan", "Azerbaijani", "Azerbaidjan"],
+    "BHS": ["BS", "Bahamas", "Bahamian"],
+    "BHR": ["BH", "Bahrain", "Bahraini", "Bahrein"],
+    "BGD": ["BD", "Bangladesh", "Bangladeshi"],
+    "BRB": ["BB", "Barbados", "Barbadian", "Barbade"],
+    "BLR": ["BY", "Belarus", "Belarusian", "Bielorussie"],
+    "BEL": ["BE", "Belgium", "Belgian", "Belgique", "Belge", "Belgien", "Belgica"],
+    "BLZ": ["BZ", "Belize", "Belizean"],
+    "BEN": ["BJ", "Benin", "Beninese", "Beninois"],
+    "BOL": ["BO", "Bolivia", "Bolivian", "Bolivie", "Bolivien"],
+    "BIH": ["BA", "Bosnia and Herzegovina", "Bosnia", "Bosnian", "Bosnie Herzegovine", "Bosnie"],
+    "BRA": ["BR", "Brazil", "Brazilian", "Bresil", "Bresilien", "Bresilienne", "Brasil", "Brasileiro"],
+    "BGR": ["BG", "Bulgaria", "Bulgarian", "Bulgarie", "Bulgare"],
+    "BFA": ["BF", "Burkina Faso", "Burkinabe"],
+    "KHM": ["KH", "Cambodia", "Cambodian", "Cambodge"],
+    "CMR": ["CM", "Cameroon", "Cameroonian", "Cameroun", "Camerounais"],
+    "CAN": ["CA", "Canada", "Canadian", "Canadien", "Canadienne"],
+    "CPV": ["CV", "Cape Verde", "Cabo Verde", "Cape Verdean", "Cap Vert"],
+    "CHL": ["CL", "Chile", "Chilean", "Chili", "Chilien"],
+    "CHN": ["CN", "China", "Chinese", "Chine", "Chinois", "Chinoise"],
+    "COL": ["CO", "Colombia", "Colombian", "Colombie", "Colombien"],
+    "COG": ["CG", "Congo", "Congolese", "Congolais", "Republic of the Congo"],
+    "COD": ["CD", "Democratic Republic of the Congo", "DR Congo", "RDC", "RD Congo"],
+    "CRI": ["CR", "Costa Rica", "Costa Rican"],
+    "CIV": ["CI", "Cote d Ivoire", "Ivory Coast", "Ivorian", "Ivoirien", "Ivoirienne"],
+    "HRV": ["HR", "Croatia", "Croatian", "Croatie", "Croate", "Hrvatska"],
+    "CUB": ["CU", "Cuba", "Cuban", "Cubain"],
+    "CYP": ["CY", "Cyprus", "Cypriot", "Chypre", "Chypriote"],
+    "CZE": ["CZ", "Czech Republic", "Czechia", "Czech", "Republique Tcheque", "Tcheque", "Tchequie"],
+    "DNK": ["DK", "Denmark", "Danish", "Dane", "Danemark", "Danois", "Danoise"],
+    "DOM": ["DO", "Dominican Republic", "Dominican", "Republique Dominicaine"],
+    "ECU": ["EC", "Ecuador", "Ecuadorian", "Equateur", "Equatorien"],
+    "EGY": ["EG", "Egypt", "Egyptian", "Egypte", "Egyptien", "Egyptienne"],
+    "SLV": ["SV", "El Salvador", "Salvadoran"],
+    "EST": ["EE", "Estonia", "Estonian", "Estonie", "Estonien"],
+    "ETH": ["ET", "Ethiopia", "Ethiopian", "Ethiopie", "Ethiopien"],
+    "FIN": ["FI", "Finland", "Finnish", "Finn", "Finlande", "Finlandais", "Suomi"],
+    "FRA": ["FR", "France", "French", "Francais", "Francaise", "Francia", "Frankreich", "Frances"],
+    "GAB": ["GA", "Gabon", "Gabonese", "Gabonais"],
+    "GMB": ["GM", "Gambia", "Gambian", "Gambie"],
+    "GEO": ["GE", "Georgia", "Georgian", "Georgie", "Georgien"],
+    "DEU": ["DE", "Germany", "German", "Allemagne", "Allemand", "Allemande", "Deutschland", "Deutsch",
+            "Alemania", "Aleman", "Germania", "Tedesco", "GER"],
+    "GHA": ["GH", "Ghana", "Ghanaian", "Ghaneen"],
+    "GRC": ["GR", "Greece", "Greek", "Grece", "Grec", "Grecque", "Hellenic", "Ellada"],
+    "GTM": ["GT", "Guatemala", "Guatemalan"],
+    "GIN": ["GN", "Guinea", "Guinean", "Guinee", "Guineen"],
+    "HTI": ["HT", "Haiti", "Haitian", "Haitien"],
+    "HND": ["HN", "Honduras", "Honduran"],
+    "HKG": ["HK", "Hong Kong", "Hong Konger"],
+    "HUN": ["HU", "Hungary", "Hungarian", "Hongrie", "Hongrois", "Magyar"],
+    "ISL": ["IS", "Iceland", "Icelandic", "Islande", "Islandais"],
+    "IND": ["IN", "India", "Indian", "Inde", "Indien", "Indienne"],
+    "IDN": ["ID", "Indonesia", "Indonesian", "Indonesie", "Indonesien"],
+    "IRN": ["IR", "Iran", "Iranian", "Iranien", "Islamic Republic of Iran"],
+    "IRQ": ["IQ", "Iraq", "Iraqi", "Irak", "Irakien"],
+    "IRL": ["IE", "Ireland", "Irish", "Irlande", "Irlandais", "Irlandaise", "Eire"],
+    "ISR": ["IL", "Israel", "Israeli", "Israelien"],
+    "ITA": ["IT", "Italy", "Italian", "Italie", "Italien", "Italienne", "Italia", "Italiano", "Italiana", "Italienisch"],
+    "JAM": ["JM", "Jamaica", "Jamaican", "Jamaique", "Jamaicain"],
+    "JPN": ["JP", "Japan", "Japanese", "Japon", "Japonais", "Japonaise"],
+    "JOR": ["JO", "Jordan", "Jordanian", "Jordanie", "Jordanien"],
+    "KAZ": ["KZ", "Kazakhstan", "Kazakh", "Kazakhstani"],
+    "KEN": ["KE", "Kenya", "Kenyan"],
+    "KOR": ["KR", "South Korea", "Korea", "Republic of Korea", "Korean", "Coree du Sud", "Coreen", "Coree"],
+    "KWT": ["KW", "Kuwait", "Kuwaiti", "Koweit"],
+    "LVA": ["LV", "Latvia", "Latvian", "Lettonie", "Letton"],
+    "LBN": ["LB", "Lebanon", "Lebanese", "Liban", "Libanais", "Libanaise"],
+    "LBY": ["LY", "Libya", "Libyan", "Libye", "Libyen"],
+    "LTU": ["LT", "Lithuania", "Lithuanian", "Lituanie", "Lituanien"],
+    "LUX": ["LU", "Luxembourg", "Luxembourgish", "Luxembourgeois"],
+    "MDG": ["MG", "Madagascar", "Malagasy", "Malgache"],
+    "MYS": ["MY", "Malaysia", "Malaysian", "Malaisie", "Malaisien"],
+    "MLI": ["ML", "Mali", "Malian", "Malien", "Malienne"],
+    "MLT": ["MT", "Malta", "Maltese", "Malte", "Maltais"],
+    "MRT": ["MR", "Mauritania", "Mauritanian", "Mauritanie", "Mauritanien"],
+    "MUS": ["MU", "Mauritius", "Mauritian", "Maurice", "Mauricien"],
+    "MEX": ["MX", "Mexico", "Mexican", "Mexique", "Mexicain", "Mexicaine", "Mexicano"],
+    "MDA": ["MD", "Moldova", "Moldovan", "Moldavie", "Moldave"],
+    "MCO": ["MC", "Monaco", "Monegasque"],
+    "MNE": ["ME", "Montenegro", "Montenegrin"],
+    "MAR": ["MA", "Morocco", "Moroccan", "Maroc", "Marocain", "Marocaine", "Marruecos", "Marocco"],
+    "MMR": ["MM", "Myanmar", "Burma", "Burmese", "Birmanie"],
+    "NPL": ["NP", "Nepal", "Nepalese", "Nepali"],
+    "NLD": ["NL", "Netherlands", "The Netherlands", "Holland", "Dutch", "Pays Bas", "Neerlandais",
+            "Hollandais", "Nederland", "Niederlande", "Paises Bajos", "Olanda"],
+    "NZL": ["NZ", "New Zealand", "New Zealander", "Nouvelle Zelande", "Neo Zelandais"],
+    "NIC": ["NI", "Nicaragua", "Nicaraguan"],
+    "NER": ["NE", "Niger", "Nigerien"],
+    "NGA": ["NG", "Nigeria", "Nigerian"],
+    "MKD": ["MK", "North Macedonia", "Macedonia", "Macedonian", "Macedoine"],
+    "NOR": ["NO", "Norway", "Norwegian", "Norvege", "Norvegien", "Norge"],
+    "OMN": ["OM", "Oman", "Omani"],
+    "PAK": ["PK", "Pakistan", "Pakistani", "Pakistanais"],
+    "PSE": ["PS", "Palestine", "Palestinian", "Palestinien"],
+    "PAN": ["PA", "Panama", "Panamanian", "Panameen"],
+    "PRY": ["PY", "Paraguay", "Paraguayan"],
+    "PER": ["PE", "Peru", "Peruvian", "Perou", "Peruvien"],
+    "PHL": ["PH", "Philippines", "Filipino", "Filipina", "Philippine", "Philippin"],
+    "POL": ["PL", "Poland", "Polish", "Pologne", "Polonais", "Polonaise", "Polska", "Polen"],
+    "PRT": ["PT", "Portugal", "Portuguese", "Portugais", "Portugaise", "Portugues", "Portoghese"],
+    "QAT": ["QA", "Qatar", "Qatari"],
+    "ROU": ["RO", "Romania", "Romanian", "Roumanie", "Roumain", "Roumaine", "Rumania"],
+    "RUS": ["RU", "Russia", "Russian Federation", "Russian", "Russie", "Russe", "Rossiya"],
+    "SAU": ["SA", "Saudi Arabia", "Saudi", "Arabie Saoudite", "Saoudien"],
+    "SEN": ["SN", "Senegal", "Senegalese", "Senegalais", "Senegalaise"],
+    "SRB": ["RS", "Serbia", "Serbian", "Serbie", "Serbe"],
+    "SGP": ["SG", "Singapore", "Singaporean", "Singapour"],
+    "SVK": ["SK", "Slovakia", "Slovak", "Slovaquie", "Slovaque"],
+    "SVN": ["SI", "Slovenia", "Slovenian", "Slovene", "Slovenie"],
+    "ZAF": ["ZA", "South Africa", "South African", "Afrique du Sud", "Sud Africain"],
+    "ESP": ["ES", "Spain", "Spanish", "Espagne", "Espagnol", "Espagnole", "Espana", "Espanol",
+            "Spanien", "Spagna", "Spagnolo"],
+    "LKA": ["LK", "Sri Lanka", "Sri Lankan"],
+    "SDN": ["SD", "Sudan", "Sudanese", "Soudan", "Soudanais"],
+    "SWE": ["SE", "Sweden", "Swedish", "Swede", "Suede", "Suedois", "Sverige", "Schweden"],
+    "CHE": ["CH", "Switzerland", "Swiss", "Suisse", "Schweiz", "Svizzera", "Suiza"],
+    "SYR": ["SY", "Syria", "Syrian", "Syrie", "Syrien"],
+    "TWN": ["TW", "Taiwan", "Taiwanese"],
+    "THA": ["TH", "Thailand", "Thai", "Thailande", "Thailandais"],
+    "TTO": ["TT", "Trinidad and Tobago", "Trinidadian"],
+    "TUN": ["TN", "Tunisia", "Tunisian", "Tunisie", "Tunisien", "Tunisienne"],
+    "TUR": ["TR", "Turkey", "Turkiye", "Turkish", "Turquie", "Turc", "Turque"],
+    "UKR": ["UA", "Ukraine", "Ukrainian", "Ukrainien", "Ukrainienne"],
+    "ARE": ["AE", "United Arab Emirates", "UAE", "Emirati", "Emirats Arabes Unis", "EAU"],
+    "GBR": ["GB", "UK", "United Kingdom", "Great Britain", "British", "England", "English", "Scotland",
+            "Scottish", "Wales", "Welsh", "Northern Ireland", "Royaume Uni", "Britannique", "Anglais",
+            "Angleterre", "Regno Unito", "Reino Unido", "Grossbritannien"],
+    "USA": ["US", "United States", "United States of America", "America", "American", "Etats Unis",
+            "Americain", "Americaine", "Estados Unidos", "Stati Uniti", "Vereinigte Staaten", "U S A", "U S"],
+    "URY": ["UY", "Uruguay", "Uruguayan"],
+    "UZB": ["UZ", "Uzbekistan", "Uzbek"],
+    "VEN": ["VE", "Venezuela", "Venezuelan", "Venezuelien"],
+    "VNM": ["VN", "Vietnam", "Viet Nam", "Vietnamese", "Vietnamien"],
+    "YEM": ["YE", "Yemen", "Yemeni", "Yemenite"],
+    "ZMB": ["ZM", "Zambia", "Zambian"],
+    "ZWE": ["ZW", "Zimbabwe", "Zimbabwean"],
+}
+
+
+def _nationality_key(value: str) -> str:
+    """Normalization used on both sides of the nationality lookup (accents, case, punctuation)."""
+    value = unicodedata.normalize("NFKD", str(value))
+    value = "".join(c for c in value if not unicodedata.combining(c)).upper()
+    return " ".join(re.sub(r"[^A-Z0-9]+", " ", value).split())
+
+
+def _compile_nationality_lookup() -> Dict[str, str]:
+    lookup: Dict[str, str] = {}
+    for iso3, aliases in NATIONALITY_TABLE.items():
+        lookup[iso3] = iso3
+        for alias in aliases:
+            lookup.setdefault(_nationality_key(alias), iso3)
+    return lookup
+
+
+# Compiled once at import: normalized alias -> ISO-3
+NATIONALITY_LOOKUP = _compile_nationality_lookup()
+
+
+class PassengerKeyIndex:
+    """Persistent passenger key -> dashboard row id, kept in the dashboard store database.
+    Key = normalized passport + date of birth + cruise number.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.conn.execute("CREATE TABLE IF NOT EXISTS passenger_keys (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+
+    def get(self, key: str) -> Optional[int]:
+        cur = self.conn.execute("SELECT row FROM passenger_keys WHERE key = ?", (key,))
+        hit = cur.fetchone()
+        return hit[0] if hit else None
+
+    def put(self, key: str, row: int):
+        self.conn.execute("INSERT OR REPLACE INTO passenger_keys (key, row) VALUES (?, ?)", (key, row))
+
+    def rebuild(self, keyed_rows: List[Tuple[Optional[str], int]]):
+        """Replace the index with (key, row id) pairs; the first occurrence of a key wins."""
+        self.conn.execute("DELETE FROM passenger_keys")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO passenger_keys (key, row) VALUES (?, ?)",
+            ((k, r) for k, r in keyed_rows if k),
+        )
+
+
+class DashboardStore:
+    """Append-only SQLite store behind the dashboard (<dashboard>.store.sqlite).
+    Rows are clustered by partition (cruise number / month of DateEntree); the Excel dashboard
+    is only generated from the store on demand, with a streaming writer.
+    """
+
+    def __init__(self, dashboard_path: Path):
+        self.dashboard_path = dashboard_path
+        self.path = dashboard_path.with_name(dashboard_path.stem + ".store.sqlite")
+        self.conn = sqlite3.connect(str(self.path))
+        cols = ", ".join(f'"{c}" TEXT' for c in DASHBOARD_COLUMNS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS passengers (id INTEGER PRIMARY KEY, partition TEXT NOT NULL, {cols})")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS passengers_partition ON passengers (partition, id)")
+        self.index = PassengerKeyIndex(self.conn)
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM passengers").fetchone()[0]
+
+    def next_id(self) -> int:
+        return (self.conn.execute("SELECT MAX(id) FROM passengers").fetchone()[0] or 0) + 1
+
+    @staticmethod
+    def _cell(v):
+        """DataFrame value -> SQLite text (dates as ISO, missing as NULL)."""
+        if v is None or (not isinstance(v, (list, tuple)) and pd.isna(v)):
+            return None
+        if isinstance(v, (datetime, date, pd.Timestamp)):
+            return v.strftime("%Y-%m-%d")
+        return str(v)
+
+    @staticmethod
+    def partition_of(cruise, date_entree) -> str:
+        return f"{cruise or ''}/{(date_entree or '')[:7]}"
+
+    def append(self, ids: List[int], rows: pd.DataFrame):
+        """Insert rows with the given ids (same order)."""
+        records = []
+        for row_id, values in zip(ids, rows[DASHBOARD_COLUMNS].itertuples(index=False, name=None)):
+            cells = [self._cell(v) for v in values]
+            part = self.partition_of(cells[DASHBOARD_COLUMNS.index("CruiseNumber")],
+                                     cells[DASHBOARD_COLUMNS.index("DateEntree")])
+            records.append((row_id, part, *cells))
+        marks = ", ".join("?" * (len(DASHBOARD_COLUMNS) + 2))
+        self.conn.executemany(f"INSERT INTO passengers VALUES ({marks})", records)
+
+    def update(self, row_id: int, values: pd.Series):
+        """Overwrite the non-missing fields of an existing row."""
+        sets, params = [], []
+        for c in DASHBOARD_COLUMNS:
+            cell = self._cell(values.get(c))
+            if cell is not None:
+                sets.append(f'"{c}" = ?')
+                params.append(cell)
+        if sets:
+            self.conn.execute(f"UPDATE passengers SET {', '.join(sets)} WHERE id = ?", (*params, row_id))
+
+    def iter_rows(self, chunk_size: int = 5000):
+        """Yield dashboard rows in insertion order, chunk by chunk."""
+        cols = ", ".join(f'"{c}"' for c in DASHBOARD_COLUMNS)
+        cur = self.conn.execute(f"SELECT {cols} FROM passengers ORDER BY id")
+        while True:
+            chunk = cur.fetchmany(chunk_size)
+            if not chunk:
+                break
+            yield from chunk
+
+    def frame(self, columns: List[str]) -> pd.DataFrame:
+        """Selected dashboard columns of every row, as one DataFrame."""
+        cols = ", ".join(f'"{c}"' for c in columns)
+        return pd.read_sql_query(f"SELECT {cols} FROM passengers ORDER BY id", self.conn)
+
+    def export_excel(self, out_path: Path) -> int:
+        """Write the dashboard Excel from the store with a constant-memory (write-only) writer."""
+        if Workbook is None:
+            raise RuntimeError("openpyxl n'est pas disponible")
+        date_idx = [DASHBOARD_COLUMNS.index(c) for c in DASHBOARD_DATE_COLUMNS]
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title="Dashboard")
+        ws.append(DASHBOARD_COLUMNS)
+        n = 0
+        for row in self.iter_rows():
+            row = list(row)
+            for i in date_idx:
+                if row[i]:
+                    try:
+                        row[i] = datetime.strptime(row[i], "%Y-%m-%d")
+                    except ValueError:
+                        pass
+            ws.append(row)
+            n += 1
+        wb.save(out_path)
+        return n
+
+    def close(self, commit: bool = True):
+        try:
+            if commit:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.close()
+
+
+class DetachedVar:
+    """Stand-in for tkinter variables on headless instances: no Tk root, usable from any thread."""
+
+    def __init__(self, master=None, value=None):
+        self._value = "" if value is None else value
+
+    def get(self):
+        return self._value
+
+    def set(self, value):
+        self._value = value
+
+
+class DetachedWidget:
+    """No-op stand-in for the root, buttons and results tree of a headless instance.
+    Tree rows are kept so detection can read back and update the rows it inserted."""
+
+    def __init__(self):
+        self._rows: Dict[int, list] = {}
+        self._after: List[Tuple[int, Callable, tuple]] = []
+        self._after_running = False
+
+    def config(self, **kwargs):
+        pass
+
+    configure = config
+
+    def update(self):
+        pass
+
+    def after(self, ms, func=None, *args):
+        """Run func after ms on the calling thread, before returning: there is no event loop.
+        Callbacks scheduled by a callback are queued and run once it returns."""
+        self._after.append((ms, func, args))
+        if self._after_running:
+            return None
+        self._after_running = True
+        try:
+            while self._after:
+                ms, func, args = self._after.pop(0)
+                time.sleep(ms / 1000)
+                if func is not None:
+                    func(*args)
+        finally:
+            self._after_running = False
+        return None
+
+    def after_idle(self, func, *args):
+        return self.after(0, func, *args)
+
+    def update_idletasks(self):
+        pass
+
+    def insert(self, parent, index, values=()):
+        iid = len(self._rows)
+        self._rows[iid] = list(values)
+        return iid
+
+    def item(self, iid, option=None, values=None):
+        if values is not None:
+            self._rows[iid] = list(values)
+            return None
+        return tuple(self._rows[iid]) if option == "values" else {"values": tuple(self._rows[iid])}
+
+    def get_children(self, item=""):
+        return list(self._rows)
+
+    def delete(self, *items):
+        for iid in items:
+            self._rows.pop(iid, None)
+
+
+def share_key(path: str) -> str:
+    """Share (or volume) a path lives on: '\\\\server\\share' or the drive letter on Windows,
+    the mounted device elsewhere. Jobs on the same share count against the same limit."""
+    p = Path(path)
+    if p.drive:
+        return p.drive.lower()
+    try:
+        return f"dev:{os.stat(p).st_dev}"
+    except OSError:
+        return p.anchor or str(p)
+
+
+@dataclass
+class DetectionJob:
+    """One (cruise list, manifests folder, dashboard) run of the job queue.
+    Options are copied from the window when the job is added."""
+    cruise_list: str
+    manifests_dir: str
+    dashboard: str = ""
+    priority: int = 0  # higher runs first
+    number_column: str = "N"
+    ignore_green: bool = True
+    recursive: bool = False
+    token_match: bool = False
+    dry_run: bool = False
+    merge: bool = True
+    merge_update_existing: bool = False
+    share: str = ""
+    state: str = "en attente"  # 'en attente' | 'en cours' | 'terminé' | 'échec'
+    progress: DetachedVar = field(default_factory=DetachedVar, repr=False)
+    result: Dict = field(default_factory=dict)
+    seq: int = -1
+
+
+class JobScheduler:
+    """Run DetectionJobs on a thread pool: highest priority first (then submission order),
+    at most max_workers jobs at once and at most per_share_limit jobs per share.
+    A job that would exceed its share's limit waits without blocking jobs on other shares.
+    """
+
+    def __init__(self, runner, max_workers: int = 4, per_share_limit: int = 1):
+        self.runner = runner
+        self.max_workers = max(1, int(max_workers))
+        self.per_share_limit = max(1, int(per_share_limit))
+        self.jobs: List[DetectionJob] = []
+        self._pending: List[Tuple[int, int, DetectionJob]] = []  # heap of (-priority, seq, job)
+        self._running = 0
+        self._running_by_share: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+
+    def submit(self, job: DetectionJob) -> DetectionJob:
+        with self._lock:
+            if not job.share:
+                job.share = share_key(job.manifests_dir)
+            job.seq = len(self.jobs)
+            job.state = "en attente"
+            self.jobs.append(job)
+            heapq.heappush(self._pending, (-job.priority, job.seq, job))
+            self._idle.clear()
+            self._dispatch_locked()
+        return job
+
+    def _dispatch_locked(self):
+        """Start every pending job that fits, in priority order; jobs held back keep their place."""
+        held = []
+        while self._pending and self._running < self.max_workers:
+            item = heapq.heappop(self._pending)
+            job = item[2]
+            if self._running_by_share.get(job.share, 0) >= self.per_share_limit:
+                held.append(item)
+                continue
+            self._running += 1
+            self._running_by_share[job.share] = self._running_by_share.get(job.share, 0) + 1
+            job.state = "en cours"
+            self._pool.submit(self._run, job)
+        for item in held:
+            heapq.heappush(self._pending, item)
+
+    def _run(self, job: DetectionJob):
+        try:
+            job.result = self.runner(job) or {}
+            job.state = "échec" if job.result.get("error") else "terminé"
+        except Exception as e:
+            job.result = {"error": str(e)}
+            job.state = "échec"
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._running_by_share[job.share] -= 1
+                self._dispatch_locked()
+                if not self._pending and self._running == 0:
+                    self._idle.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until every submitted job has finished (True) or the timeout expires."""
+        return self._idle.wait(timeout)
+
+    def is_idle(self) -> bool:
+        return self._idle.is_set()
+
+    def counts(self) -> Dict[str, int]:
+        out = {"en attente": 0, "en cours": 0, "terminé": 0, "échec": 0}
+        for job in list(self.jobs):
+            out[job.state] = out.get(job.state, 0) + 1
+        return out
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class OperationJournal:
+    """Append-only JSONL journal of file operations, grouped in runs.
+    Records are buffered in memory and written with a single write + fsync once
+    JOURNAL_BATCH_SIZE records are pending, JOURNAL_FLUSH_INTERVAL has elapsed, or a run ends.
+    Each line starts with its "op" and "run" keys so queries can skip lines without parsing them.
+    """
+
+    _shared: Dict[str, "OperationJournal"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: Path, backup_dir: Optional[Path] = None):
+        self.path = Path(path)
+        self.backup_dir = Path(backup_dir) if backup_dir else JOURNAL_BACKUP_DIR
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def shared(cls, path: Path = JOURNAL_FILE) -> "OperationJournal":
+        """One journal per file for the whole process (GUI and job queue instances)."""
+        key = str(path)
+        with cls._shared_lock:
+            journal = cls._shared.get(key)
+            if journal is None:
+                journal = cls._shared[key] = cls(path)
+                atexit.register(journal.flush)
+            return journal
+
+    @staticmethod
+    def new_run_id() -> str:
+        return datetime.now().strftime("%Y%m%dT%H%M%S") + "-" + os.urandom(3).hex()
+
+    def record(self, op: str, run: Optional[str], **fields):
+        entry = {"op": op, "run": run, "ts": datetime.now().isoformat(timespec="milliseconds"), **fields}
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._buffer.append(line)
+            due = len(self._buffer) >= JOURNAL_BATCH_SIZE or \
+                time.monotonic() - self._last_flush >= JOURNAL_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write and fsync every pending record. Records added meanwhile by other threads join
+        the next batch, so concurrent writers share the cost of one fsync."""
+        with self._io_lock:
+            with self._lock:
+                lines, self._buffer = self._buffer, []
+                self._last_flush = time.monotonic()
+            if not lines:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def begin_run(self, kind: str, manifests_dir: str = "", **fields) -> str:
+        run_id = self.new_run_id()
+        self.record("begin", run_id, kind=kind, dir=manifests_dir, **fields)
+        self._prune_backups()
+        return run_id
+
+    def end_run(self, run_id: str, **fields):
+        self.record("end", run_id, **fields)
+        self.flush()
+
+    def backup(self, run_id: Optional[str], path: Path) -> Optional[Path]:
+        """Copy a file before it is modified in place; None if the copy failed."""
+        try:
+            folder = self.backup_dir / (run_id or "hors-execution")
+            folder.mkdir(parents=True, exist_ok=True)
+            dst = folder / f"{os.urandom(4).hex()}-{path.name}"
+            shutil.copy2(str(path), str(dst))
+            return dst
+        except Exception:
+            return None
+
+    def _prune_backups(self):
+        try:
+            runs = sorted((d for d in self.backup_dir.iterdir() if d.is_dir()), key=lambda d: d.name)
+        except OSError:
+            return
+        for d in runs[:-JOURNAL_KEEP_BACKUP_RUNS]:
+            shutil.rmtree(d, ignore_errors=True)
+
+    @staticmethod
+    def _parse(line: str) -> Optional[Dict]:
+        """Parsed journal line, or None for a line cut short by a crash."""
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def _lines(self):
+        self.flush()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                yield from f
+        except FileNotFoundError:
+            return
+
+    def runs(self) -> List[Dict]:
+        """Runs in journal order: kind, folder, start/end times, operation count and whether
+        a later 'undo' run reverted them. Only begin/end lines are parsed."""
+        runs: Dict[str, Dict] = {}
+        for line in self._lines():
+            if line.startswith('{"op":"begin"'):
+                e = self._parse(line)
+                if e is None:
+                    continue
+                runs[e["run"]] = {"run": e["run"], "kind": e.get("kind"), "dir": e.get("dir", ""),
+                                  "target": e.get("target"), "started": e["ts"], "ended": None,
+                                  "ops": 0, "undone": False}
+            elif line.startswith('{"op":"end"'):
+                e = self._parse(line)
+                if e is not None and e["run"] in runs:
+                    runs[e["run"]]["ended"] = e["ts"]
+            else:
+                m = re.match(r'\{"op":"[^"]*","run":"([^"]+)"', line)
+                if m and m.group(1) in runs:
+                    runs[m.group(1)]["ops"] += 1
+        for r in runs.values():
+            if r["kind"] == "undo" and r["ended"] and r["target"] in runs:
+                runs[r["target"]]["undone"] = True
+        return list(runs.values())
+
+    def query(self, text: Optional[str] = None, run: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+        """File operations (not begin/end) matching a file name/path fragment, a run id and an
+        ISO time range. Lines are filtered on their raw text before being parsed."""
+        needle = json.dumps(text, ensure_ascii=False)[1:-1].casefold() if text else None
+        run_key = f'"run":"{run}"' if run else None
+        out = []
+        for line in self._lines():
+            if line.startswith(('{"op":"begin"', '{"op":"end"')):
+                continue
+            if run_key and run_key not in line:
+                continue
+            if needle and needle not in line.casefold():
+                continue
+            e = self._parse(line)
+            if e is None or (since and e["ts"] < since) or (until and e["ts"] > until):
+                continue
+            out.append(e)
+        return out
+
+    def last_undoable_run(self) -> Optional[Dict]:
+        for r in reversed(self.runs()):
+            if r["kind"] != "undo" and not r["undone"] and r["ops"]:
+                return r
+        return None
+
+
+def journaled_run(kind: str):
+    """Method decorator: the file operations of one call form one journal run
+    (calls made inside an already journaled call join the outer run)."""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._journal_run(kind):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def is_lock_error(exc: BaseException, path: Optional[Path] = None) -> bool:
+    """True for errors raised on files in use by another process (Windows sharing/lock
+    violations, EBUSY/ETXTBSY). A bare PermissionError only counts when path is given and
+    file_is_locked() confirms it: denied ACLs and read-only files are real failures."""
+    if getattr(exc, "winerror", None) in (32, 33):
+        return True
+    if getattr(exc, "errno", None) in (errno.EBUSY, errno.ETXTBSY):
+        return True
+    return isinstance(exc, PermissionError) and path is not None and file_is_locked(path)
+
+
+def file_is_locked(path: Path) -> bool:
+    """True if the file exists but another process keeps it from being opened for writing."""
+    try:
+        with open(path, "r+b"):
+            return False
+    except OSError as e:
+        return is_lock_error(e)
+
+
+class LockedFileRetryQueue:
+    """Locked files parked by a batch and probed again on a background thread, with
+    exponential backoff (LOCK_RETRY_BASE_DELAY doubled per attempt, up to LOCK_RETRY_MAX_DELAY).
+    The thread only probes: files that became free are handed back by take_ready() so the
+    batch performs the operation itself, on its own thread. Payloads are opaque to the queue.
+    """
+
+    def __init__(self, attempts: Optional[int] = None, base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None):
+        self.attempts = LOCK_RETRY_ATTEMPTS if attempts is None else attempts
+        self.base_delay = LOCK_RETRY_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = LOCK_RETRY_MAX_DELAY if max_delay is None else max_delay
+        self._heap: List[Tuple[float, int, Tuple[Path, object, int]]] = []
+        self._ready: List[Tuple[object, int]] = []
+        self._given_up: List[object] = []
+        self._probing = 0
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def park(self, path: Path, payload, attempt: int = 0) -> bool:
+        """Schedule a new probe of path after attempt failed ones; False once attempts are exhausted."""
+        with self._cond:
+            if attempt >= self.attempts or self._closed:
+                return False
+            self._push_locked(path, payload, attempt)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="lock-retry", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return True
+
+    def _push_locked(self, path: Path, payload, attempt: int):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        self._seq += 1
+        heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, (path, payload, attempt + 1)))
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed or not self._heap:
+                        self._thread = None
+                        self._cond.notify_all()
+                        return
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                _, _, (path, payload, attempt) = heapq.heappop(self._heap)
+                self._probing += 1
+            locked = file_is_locked(path)
+            with self._cond:
+                self._probing -= 1
+                if not locked:
+                    self._ready.append((payload, attempt))
+                elif attempt >= self.attempts:
+                    self._given_up.append(payload)
+                else:
+                    self._push_locked(path, payload, attempt)
+                self._cond.notify_all()
+
+    def pending(self) -> int:
+        """Parked files not handed back yet (waiting, being probed or ready)."""
+        with self._cond:
+            return len(self._heap) + self._probing + len(self._ready)
+
+    def take_ready(self, timeout: float) -> List[Tuple[object, int]]:
+        """Wait up to timeout for parked files to become free; returns (payload, attempts)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._ready and (self._heap or self._probing):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            ready, self._ready = self._ready, []
+            return ready
+
+    def close(self) -> List[object]:
+        """Stop probing; returns the payloads given up or still parked."""
+        with self._cond:
+            self._closed = True
+            left = self._given_up + [item[2][1] for item in self._heap] + [p for p, _ in self._ready]
+            self._heap, self._ready, self._given_up = [], [], []
+            self._cond.notify_all()
+            return left
 
 
 class CruiseDetectorGUI:
-    def _init_(self):
+    def __init__(self):
         self.root = tk.Tk()
         self.root.title("Détecteur de Manifestes - Croisières")
         self.root.geometry("900x750")
+        self._init_state(tk.StringVar, tk.BooleanVar)
+
+        self.setup_ui()
+        self.restore_session()
 
+    def _init_state(self, string_var, bool_var):
+        """Detection state. Variables are built with the given factories: tkinter variables
+        for the window, DetachedVar for headless instances (see headless())."""
         # Variables
-        self.cruise_list_path = tk.StringVar()
-        self.manifests_dir_path = tk.StringVar()
+        self.cruise_list_path = string_var()
+        self.manifests_dir_path = string_var()
         self.cruise_df = None
         self.matches = []
+        # File names of the last detection, shared by matches and file lists
+        self.file_names = FileNameTable()
         # Ignore rows with green background in N
-        self.ignore_green_var = tk.BooleanVar(value=True)
+        self.ignore_green_var = bool_var(value=True)
         self.ignored_row_idxs = set()  # indexes in DataFrame to ignore
 
         # Post-detection state
@@ -51,10 +1152,64 @@ class CruiseDetectorGUI:
         self.summary_excel_files = []
         self.detailed_excel_files = []
         self.mixed_excel_files = {}
+        # .xls originals rewritten as .xlsx when hiding/removing sheets (old path -> new path)
+        self.converted_xls_files = {}
+        # Byte-identical copies of another manifest (duplicate path -> kept original)
+        self.duplicate_files = {}
+        # Content hashes cached by (path, size, mtime) across detections
+        self._file_hash_cache = {}
         # Option to include all PDFs for separation (default to True since actions are automatic)
-        self.include_all_pdfs_var = tk.BooleanVar(value=True)
+        self.include_all_pdfs_var = bool_var(value=True)
+        # Dry-run: build the post-detection plan and preview it instead of executing it
+        self.dry_run_var = bool_var(value=False)
+        self.last_plan = None
+        # Match cruise numbers anywhere in file names (token index) instead of as a prefix
+        self.token_match_var = bool_var(value=False)
+        self.ambiguous_files = {}
+        # Scan subfolders (port/date/agent/...) too; each folder gets its own output folders
+        self.recursive_scan_var = bool_var(value=False)
+        # PDF text probe: results by file fingerprint, and PDFs matched by their content
+        self.pdf_probe_cache = {}
+        self.pdf_content_matches = {}
+        # Merge: update passengers already in the dashboard store (otherwise they are skipped)
+        self.merge_update_existing_var = bool_var(value=False)
+        # Cruise number of each matched manifest (file name -> normalized number)
+        self.file_cruise_numbers = {}
+        # Inferred text date format per (source layout headers, column)
+        self._date_format_cache = {}
+        # Nationality values not found in NATIONALITY_TABLE during the last merge (file name -> values)
+        self.unknown_nationalities = {}
+        # Job queue: jobs added in the queue window, the scheduler running them, and one lock
+        # per dashboard so concurrent jobs merge into the same store one at a time
+        self.queued_jobs = []
+        self.job_scheduler = None
+        self.job_window = None
+        self._dashboard_locks = {}
+        # Operation journal (shared by every instance) and the run currently being journaled
+        self.journal = OperationJournal.shared()
+        self._journal_run_id = None
 
-        self.setup_ui()
+    @classmethod
+    def headless(cls, job: "DetectionJob") -> "CruiseDetectorGUI":
+        """Instance without window for the job queue: detached variables and no-op widgets."""
+        gui = cls.__new__(cls)
+        gui._init_state(DetachedVar, DetachedVar)
+        gui.root = DetachedWidget()
+        gui.tree = DetachedWidget()
+        for name in ("detect_button", "merge_button", "export_dashboard_button", "btn_move_processed",
+                     "btn_move_pdfs", "btn_move_summary_excel", "btn_move_correct_excel"):
+            setattr(gui, name, DetachedWidget())
+        gui.status_var = job.progress
+        gui.number_column = DetachedVar(value=job.number_column)
+        gui.dashboard_path = DetachedVar(value=job.dashboard)
+        gui.cruise_list_path.set(job.cruise_list)
+        gui.manifests_dir_path.set(job.manifests_dir)
+        gui.ignore_green_var.set(job.ignore_green)
+        gui.recursive_scan_var.set(job.recursive)
+        gui.token_match_var.set(job.token_match)
+        gui.dry_run_var.set(job.dry_run)
+        gui.merge_update_existing_var.set(job.merge_update_existing)
+        return gui
         
     # (removed corrupted duplicate setup_ui)
     def setup_ui(self):
@@ -112,6 +1267,35 @@ class CruiseDetectorGUI:
         )
         self.chk_ignore_green.grid(row=1, column=0, columnspan=4, sticky=tk.W, padx=5, pady=2)
 
+        # Dry-run option: preview the planned moves/copies/hides without touching files
+        self.chk_dry_run = ttk.Checkbutton(
+            step3_frame,
+            text="Simulation (aperçu du plan sans déplacer les fichiers)",
+            variable=self.dry_run_var,
+        )
+        self.chk_dry_run.grid(row=2, column=0, columnspan=4, sticky=tk.W, padx=5, pady=2)
+
+        self.chk_merge_update = ttk.Checkbutton(
+            step3_frame,
+            text="Merge: mettre à jour les passagers déjà présents (sinon ignorés)",
+            variable=self.merge_update_existing_var,
+        )
+        self.chk_merge_update.grid(row=3, column=0, columnspan=4, sticky=tk.W, padx=5, pady=2)
+
+        self.chk_token_match = ttk.Checkbutton(
+            step3_frame,
+            text="Numéro n'importe où dans le nom (ex: MSC_Manifest_0123.xlsx)",
+            variable=self.token_match_var,
+        )
+        self.chk_token_match.grid(row=4, column=0, columnspan=4, sticky=tk.W, padx=5, pady=2)
+
+        self.chk_recursive_scan = ttk.Checkbutton(
+            step3_frame,
+            text="Parcourir les sous-dossiers (ex: port/date/agent/)",
+            variable=self.recursive_scan_var,
+        )
+        self.chk_recursive_scan.grid(row=5, column=0, columnspan=4, sticky=tk.W, padx=5, pady=2)
+
         # Step 4: Detection and merge buttons
         self.detect_button = ttk.Button(
             main_frame,
@@ -120,13 +1304,41 @@ class CruiseDetectorGUI:
             state="disabled",
         )
         self.detect_button.grid(row=3, column=0, pady=10, sticky=tk.W)
+        merge_frame = ttk.Frame(main_frame)
+        merge_frame.grid(row=3, column=1, pady=10, sticky=tk.E)
         self.merge_button = ttk.Button(
-            main_frame,
+            merge_frame,
             text="🔗 Merger (dashboard)",
             command=self.merge_to_dashboard,
             state="normal",
         )
-        self.merge_button.grid(row=3, column=1, pady=10, sticky=tk.E)
+        self.merge_button.grid(row=0, column=0, padx=5)
+        self.export_dashboard_button = ttk.Button(
+            merge_frame,
+            text="📤 Exporter dashboard",
+            command=self.export_dashboard,
+            state="normal",
+        )
+        self.export_dashboard_button.grid(row=0, column=1, padx=5)
+        self.reconcile_button = ttk.Button(
+            merge_frame,
+            text="📈 Rapprocher résumés",
+            command=self.reconcile_summaries,
+            state="normal",
+        )
+        self.reconcile_button.grid(row=0, column=2, padx=5)
+        self.job_queue_button = ttk.Button(
+            merge_frame,
+            text="🗓 File de traitement",
+            command=self.open_job_queue,
+        )
+        self.job_queue_button.grid(row=0, column=3, padx=5)
+        self.journal_button = ttk.Button(
+            merge_frame,
+            text="📜 Journal",
+            command=self.open_journal_history,
+        )
+        self.journal_button.grid(row=0, column=4, padx=5)
 
         # Post-detection action buttons (hidden; created but not gridded)
         actions_frame = ttk.Frame(main_frame)
@@ -218,13 +1430,12 @@ class CruiseDetectorGUI:
         if filename:
             self.dashboard_path.set(filename)
 
-    def load_cruise_list(self):
-        """Load and preview cruise list"""
+    def load_cruise_list(self, silent: bool = False) -> Optional[dict]:
+        """Load and preview cruise list (silent=True: no dialogs, returns counts or 'error')"""
         try:
             path = self.cruise_list_path.get()
             if not path:
-                messagebox.showerror("Erreur", "Veuillez sélectionner un fichier Excel")
-                return
+                return self._report_error("Veuillez sélectionner un fichier Excel", silent)
 
             self.status_var.set("Chargement en cours...")
             self.root.update()
@@ -236,7 +1447,9 @@ class CruiseDetectorGUI:
             # Check if N column exists
             n_col = self.number_column.get()
             if n_col not in cols:
-                available_cols = ", ".join(cols)
+                available_cols = ", ".join(str(c) for c in cols)
+                if silent:
+                    return {"error": f"Colonne '{n_col}' non trouvée. Colonnes disponibles: {available_cols}"}
                 messagebox.showwarning("Attention",
                                        f"Colonne '{n_col}' non trouvée.\n"
                                        f"Colonnes disponibles: {available_cols}")
@@ -247,12 +1460,15 @@ class CruiseDetectorGUI:
                 try:
                     self.ignored_row_idxs = self._compute_ignored_rows_by_color(Path(path), n_col)
                 except Exception as e:
-                    messagebox.showwarning("Info", f"Ignorer par couleur non appliqué: {e}")
+                    if not silent:
+                        messagebox.showwarning("Info", f"Ignorer par couleur non appliqué: {e}")
                     self.ignored_row_idxs = set()
 
             ignored_info = f" | Ignorés (fond vert): {len(self.ignored_row_idxs)}" if self.ignored_row_idxs else ""
             self.status_var.set(f"✅ Liste chargée: {num_rows} croisières - Colonnes: {', '.join(cols[:5])}...{ignored_info}")
             self.detect_button.config(state="normal")
+            if silent:
+                return {"rows": num_rows, "ignored": len(self.ignored_row_idxs)}
             messagebox.showinfo(
                 "Succès",
                 f"Liste chargée avec succès!\n{num_rows} lignes trouvées.\n\n"
@@ -264,7 +1480,7 @@ class CruiseDetectorGUI:
             self.cruise_df = None
             self.detect_button.config(state="disabled")
             self.status_var.set("❌ Erreur lors du chargement")
-            messagebox.showerror("Erreur", f"Impossible de charger le fichier:\n{str(e)}")
+            return self._report_error(f"Impossible de charger le fichier:\n{str(e)}", silent)
 
     def _compute_ignored_rows_by_color(self, excel_path: Path, number_header: str):
         """Return a set of DataFrame indexes to ignore where the N cell has fill color 00B050.
@@ -389,66 +1605,249 @@ class CruiseDetectorGUI:
         if not cruise_number:
             return []
 
+        try:
+            names = [fp.name for fp in manifests_dir.iterdir()
+                     if fp.is_file() and fp.suffix.lower() in MANIFEST_EXTENSIONS]
+        except Exception as e:
+            print(f"Erreur lors de la recherche dans {manifests_dir}: {e}")
+            return []
+        return self._filter_names_for_cruise(cruise_number, names)
+
+    def _filter_names_for_cruise(self, cruise_number: str, names: List[str]) -> List[str]:
+        """Names (or relative paths) whose file name starts with the cruise number, sorted.
+        Same prefix rules as find_manifests_for_cruise."""
+        if not cruise_number:
+            return []
+
         # Build candidate prefixes (case-insensitive comparison)
-        prefixes = [cruise_number]
+        prefixes = [cruise_number.upper()]
         if cruise_number.isdigit():
             for width in (2, 3, 4):
                 p = cruise_number.zfill(width)
                 if p not in prefixes:
                     prefixes.append(p)
 
-        exts = {".xlsx", ".xls", ".pdf"}
-        results: List[str] = []
+        results = set()
+        for name in names:
+            base_upper = posixpath.basename(name).upper()
+            suffix_upper = posixpath.splitext(base_upper)[1]
+            for pref_u in prefixes:
+                if base_upper.startswith(pref_u + ".") or \
+                   base_upper.startswith(pref_u + "-") or \
+                   base_upper.startswith(pref_u + "_") or \
+                   base_upper.startswith(pref_u + " ") or \
+                   base_upper == pref_u + suffix_upper:
+                    results.add(name)
+                    break
+        return sorted(results)
+
+    def _scan_manifest_tree(self, root: Path, recursive: bool = False) -> Tuple[Dict[str, Tuple[int, int]], List[Path]]:
+        """Manifest files under root as {relative posix path: (size, mtime_ns)} (sorted), plus
+        the folders scanned. With recursive=True subfolders are walked concurrently: one
+        os.scandir per folder on a thread pool, submitted as folders are discovered. The
+        tool's output folders, hidden folders and unreadable subfolders are skipped.
+        """
+        def _scan_one(directory: Path, prefix: str):
+            files, subdirs = [], []
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_file():
+                                if entry.name.lower().endswith(MANIFEST_EXTENSIONS):
+                                    st = entry.stat()
+                                    files.append((prefix + entry.name, (st.st_size, st.st_mtime_ns)))
+                            elif recursive and entry.is_dir(follow_symlinks=False):
+                                if not entry.name.startswith(".") and entry.name.lower() not in OUTPUT_FOLDER_NAMES:
+                                    subdirs.append((Path(entry.path), prefix + entry.name + "/"))
+                        except OSError:
+                            continue
+            except OSError:
+                if not prefix:
+                    raise
+            return files, subdirs
+
+        found: Dict[str, Tuple[int, int]] = {}
+        dirs: List[Path] = [root]
+        if not recursive:
+            found.update(_scan_one(root, "")[0])
+        else:
+            with ThreadPoolExecutor(max_workers=MANIFEST_SCAN_WORKERS) as pool:
+                pending = {pool.submit(_scan_one, root, "")}
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        files, subdirs = fut.result()
+                        found.update(files)
+                        for d, prefix in subdirs:
+                            dirs.append(d)
+                            pending.add(pool.submit(_scan_one, d, prefix))
+        return dict(sorted(found.items())), dirs
+
+    def _pdf_fingerprint(self, path: Path) -> Optional[str]:
         try:
-            for fp in manifests_dir.iterdir():
-                if not fp.is_file() or fp.suffix.lower() not in exts:
+            st = path.stat()
+        except OSError:
+            return None
+        return f"{self._file_key(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+    def _probe_pdfs(self, pdfs: List[Path]) -> Dict[str, Dict]:
+        """Probe PDF text (first pages) for cruise numbers and summary/detailed layout.
+        Text extraction runs in a process pool with a page limit and one deadline for the batch
+        (the pool is terminated if workers are still running when it expires);
+        results are cached by file fingerprint (resolved path, size, mtime) in memory and in
+        PDF_PROBE_CACHE_FILE. Returns {str(path): result}.
+        """
+        cache_path = PDF_PROBE_CACHE_FILE
+        if not self.pdf_probe_cache and cache_path.exists():
+            try:
+                self.pdf_probe_cache = json.loads(cache_path.read_text(encoding="utf-8"))
+            except Exception:
+                self.pdf_probe_cache = {}
+        results: Dict[str, Dict] = {}
+        todo: List[Tuple[Path, str]] = []
+        for pdf in pdfs:
+            fp = self._pdf_fingerprint(pdf)
+            if fp is None:
+                continue
+            if fp in self.pdf_probe_cache:
+                results[str(pdf)] = self.pdf_probe_cache[fp]
+            else:
+                todo.append((pdf, fp))
+        if todo:
+            workers = min(len(todo), os.cpu_count() or 2, 4)
+            pool = multiprocessing.Pool(workers)
+            try:
+                pending = [(pool.apply_async(_pdf_probe_worker, (str(pdf), PDF_PROBE_MAX_PAGES)), pdf, fp)
+                           for pdf, fp in todo]
+                # One deadline for the whole batch: the per-file budget times the number of rounds
+                deadline = time.monotonic() + PDF_PROBE_TIMEOUT * -(-len(todo) // workers)
+                stuck = False
+                for async_result, pdf, fp in pending:
+                    async_result.wait(max(0.0, deadline - time.monotonic()))
+                    if async_result.ready():
+                        try:
+                            raw = async_result.get()
+                        except Exception as e:
+                            raw = {"text": "", "error": str(e)[:200]}
+                    else:
+                        stuck = True
+                        raw = {"text": "", "error": "timeout"}
+                    result = self._analyze_pdf_text(raw.get("text", ""))
+                    result["error"] = raw.get("error", "")
+                    results[str(pdf)] = result
+                    # Timeouts are retried on the next run; everything else is cached
+                    if result["error"] != "timeout":
+                        self.pdf_probe_cache[fp] = result
+                if stuck:
+                    # A worker stuck inside pypdf never returns: kill the whole pool
+                    pool.terminate()
+                else:
+                    pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+            try:
+                cache_path.write_text(json.dumps(self.pdf_probe_cache, ensure_ascii=False), encoding="utf-8")
+            except Exception:
+                pass
+        return results
+
+    def _analyze_pdf_text(self, text: str) -> Dict:
+        """Find cruise numbers and the layout ('summary'/'detailed') in extracted PDF text.
+        Numbers only come from labelled mentions (cruise/voyage/croisière n°...): bare tokens
+        of a title line (dates, page counts, ship codes) would match unrelated cruises.
+        """
+        lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+        if not lines:
+            return {"cruise_numbers": [], "layout": ""}
+        labelled = re.findall(
+            r"(?:cruise|voyage|croisi[eè]re|trip|escale|call)\s*(?:no\.?|n°|nr\.?|number|num[eé]ro|#|:)?\s*[:#]?\s*([A-Za-z]*\d[A-Za-z0-9]*)",
+            text, flags=re.I,
+        )
+        numbers: List[str] = []
+        for tok in labelled:
+            n = self.normalize_cruise_number(tok)
+            if n and n not in numbers:
+                numbers.append(n)
+        layout = self._sheet_type_from_rows([[ln] for ln in lines[:40]])
+        return {"cruise_numbers": numbers, "layout": layout}
+
+    def _token_key(self, token: str) -> Optional[str]:
+        """Lookup key of a file-name token or cruise number: digits without leading zeros, codes upper-cased.
+        Returns None for values that cannot be a single token (empty, or containing separators).
+        """
+        if not token or not token.isalnum():
+            return None
+        if token.isdigit():
+            return str(int(token))
+        return token.upper()
+
+    def _resolve_token_matches(self, cruise_numbers: List[str], file_names: List[str]) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+        """Match cruise numbers appearing anywhere in file names, in one pass over all names.
+        Each stem is tokenized once (separators and letter/digit boundaries) into a hash map
+        token -> files, so the cost is linear in the total file-name length.
+        Returns ({cruise number: [files]}, {ambiguous file: [cruise numbers]}).
+        """
+        index: Dict[str, List[str]] = {}
+        for name in file_names:
+            stem = Path(name).stem
+            tokens = set()
+            for part in re.split(r"[^A-Za-z0-9]+", stem):
+                if not part:
                     continue
-                name = fp.name
-                name_upper = name.upper()
-                for pref in prefixes:
-                    pref_u = pref.upper()
-                    if name_upper.startswith(pref_u + ".") or \
-                       name_upper.startswith(pref_u + "-") or \
-                       name_upper.startswith(pref_u + "_") or \
-                       name_upper.startswith(pref_u + " ") or \
-                       name_upper == pref_u + fp.suffix.upper():
-                        results.append(name)
-                        break
-        except Exception as e:
-            print(f"Erreur lors de la recherche dans {manifests_dir}: {e}")
+                tokens.add(part)
+                # 'Manifest123' / '123ABC' also yield '123'
+                tokens.update(re.findall(r"\d+|[A-Za-z]+", part))
+            for tok in tokens:
+                key = self._token_key(tok)
+                if key is not None:
+                    index.setdefault(key, []).append(name)
 
-        # Deduplicate and sort
-        seen = set()
-        ordered: List[str] = []
-        for n in results:
-            if n not in seen:
-                seen.add(n)
-                ordered.append(n)
-        return sorted(ordered)
-        
-    def detect_manifests(self):
-        """Detect manifests for all cruises"""
+        matches: Dict[str, List[str]] = {}
+        hits: Dict[str, List[str]] = {}
+        for number in dict.fromkeys(cruise_numbers):
+            key = self._token_key(number)
+            if key is None:
+                continue
+            found = sorted(set(index.get(key, [])))
+            if found:
+                matches[number] = found
+                for fn in found:
+                    hits.setdefault(fn, []).append(number)
+        ambiguous = {fn: nums for fn, nums in hits.items() if len(nums) > 1}
+        return matches, ambiguous
+
+    def _report_error(self, message: str, silent: bool) -> Optional[dict]:
+        """Show an error dialog, or return it as {'error': message} for silent (headless) runs."""
+        if silent:
+            return {"error": message}
+        messagebox.showerror("Erreur", message)
+        return None
+
+    def detect_manifests(self, silent: bool = False) -> Optional[dict]:
+        """Detect manifests for all cruises.
+        With silent=True no dialog is shown and the counts are returned instead ('error' on failure).
+        """
         try:
             # Validate inputs
             if self.cruise_df is None or len(self.cruise_df) == 0:
-                messagebox.showerror("Erreur", "Veuillez d'abord charger la liste des croisières.\nUtilisez le bouton 'Charger' après avoir sélectionné le fichier Excel.")
-                return
+                return self._report_error("Veuillez d'abord charger la liste des croisières.\nUtilisez le bouton 'Charger' après avoir sélectionné le fichier Excel.", silent)
                 
             manifests_dir = self.manifests_dir_path.get()
             if not manifests_dir:
-                messagebox.showerror("Erreur", "Veuillez sélectionner le dossier des manifestes")
-                return
+                return self._report_error("Veuillez sélectionner le dossier des manifestes", silent)
                 
             manifests_path = Path(manifests_dir)
             if not manifests_path.exists():
-                messagebox.showerror("Erreur", "Le dossier des manifestes n'existe pas")
-                return
+                return self._report_error("Le dossier des manifestes n'existe pas", silent)
             self.last_manifests_dir = manifests_path
                 
             n_col = self.number_column.get()
             if n_col not in self.cruise_df.columns:
-                messagebox.showerror("Erreur", f"Colonne '{n_col}' non trouvée dans le fichier Excel")
-                return
+                return self._report_error(f"Colonne '{n_col}' non trouvée dans le fichier Excel", silent)
                 
             # Clear previous results
             for item in self.tree.get_children():
@@ -464,6 +1863,37 @@ class CruiseDetectorGUI:
             self.unmatched_pdfs = []
             self.summary_excel_files = []
             self.detailed_excel_files = []
+            self.file_names = FileNameTable(manifests_path)
+
+            # List the folder (or the whole tree) once and flag byte-identical copies before matching.
+            # Files are known by their path relative to the manifests folder (the name at top level).
+            recursive = bool(self.recursive_scan_var.get())
+            if recursive:
+                self.status_var.set("Parcours des sous-dossiers...")
+                self.root.update()
+            scanned, _ = self._scan_manifest_tree(manifests_path, recursive)
+            rel_names = list(scanned)
+            all_files = [self.file_names.path(self.file_names.intern(rel)) for rel in rel_names]
+            self.duplicate_files = self._find_duplicate_files(all_files)
+            duplicate_names = {p.relative_to(manifests_path).as_posix() for p in self.duplicate_files}
+            duplicates_found = len(self.duplicate_files)
+            duplicates_total = 0
+
+            # Optional: resolve every cruise number against every file name in one pass
+            token_matches: Dict[str, List[str]] = {}
+            self.ambiguous_files = {}
+            token_mode = bool(self.token_match_var.get())
+            if token_mode:
+                numbers = [self.normalize_cruise_number(v) for v in self.cruise_df[n_col].tolist()]
+                token_matches, self.ambiguous_files = self._resolve_token_matches(numbers, rel_names)
+
+            # Tree row and match per cruise number, to attach PDFs matched by content later
+            tree_items: Dict[str, tuple] = {}
+
+            def _find(number: str) -> List[str]:
+                if token_mode and self._token_key(number) is not None:
+                    return token_matches.get(number, [])
+                return self._filter_names_for_cruise(number, rel_names)
             
             # Process each cruise
             for index, row in self.cruise_df.iterrows():
@@ -483,23 +1913,32 @@ class CruiseDetectorGUI:
                     if cruise_number_norm:
                         self.ignored_cruise_numbers.append(cruise_number_norm)
                         # Collect files belonging to ignored cruises
-                        for fn in self.find_manifests_for_cruise(cruise_number_norm, manifests_path):
-                            self.ignored_files.append(manifests_path / fn)
+                        for fn in _find(cruise_number_norm):
+                            self.ignored_files.append(self.file_names.path(self.file_names.intern(fn)))
                     continue
                 
                 cruise_number = self.normalize_cruise_number(row.get(n_col, ""))
                 cruise_name = str(row.get("Nom", row.get("Name", row.get("nom", ""))))
                 
-                # Find manifests
-                manifests = self.find_manifests_for_cruise(cruise_number, manifests_path)
-                # Add matched absolute paths
-                for fn in manifests:
-                    self.matched_files.append(manifests_path / fn)
+                # Find manifests (copies of another file are not counted)
+                found = _find(cruise_number)
+                duplicates = [fn for fn in found if fn in duplicate_names]
+                manifests = [fn for fn in found if fn not in duplicate_names]
+                duplicates_total += len(duplicates)
+                # Add matched absolute paths (one shared Path per interned name)
+                manifest_ids = tuple(self.file_names.intern(fn) for fn in manifests)
+                for fid in manifest_ids:
+                    self.matched_files.append(self.file_names.path(fid))
+                    self.file_cruise_numbers[self._file_key(self.file_names.path(fid))] = cruise_number
                 total_manifests += len(manifests)
                 
                 # Determine status
                 if manifests:
                     status = f"✅ {len(manifests)} trouvé(s)"
+                    if duplicates:
+                        status += f" (+{len(duplicates)} doublon(s))"
+                    if any(fn in self.ambiguous_files for fn in manifests):
+                        status += " ⚠ ambigu"
                 elif cruise_number:
                     status = "❌ Aucun"
                 else:
@@ -507,27 +1946,29 @@ class CruiseDetectorGUI:
                 
                 # Create match object
                 match = CruiseMatch(
-                    excel_row=index + 2,  # Excel row (1-indexed + header)
+                    row_index=index,
                     cruise_number=cruise_number,
                     cruise_name=cruise_name,
-                    manifests=manifests,
-                    excel_data=row.to_dict()
+                    manifest_ids=manifest_ids,
+                    names=self.file_names,
+                    df=self.cruise_df,
                 )
                 self.matches.append(match)
                 
                 # Add to tree
                 manifests_str = ", ".join(manifests) if manifests else "Aucun"
-                self.tree.insert("", "end", values=(
+                if duplicates:
+                    manifests_str += " | Doublons: " + ", ".join(duplicates)
+                tree_items[cruise_number] = (self.tree.insert("", "end", values=(
                     match.excel_row,
                     cruise_number or "(vide)",
                     cruise_name or "(pas de nom)",
                     manifests_str,
                     status
-                ))
+                )), match)
                 
-            # Compute unmatched PDFs in the manifests directory
-            exts = {".xlsx", ".xls", ".pdf"}
-            all_files = [p for p in self.last_manifests_dir.iterdir() if p.is_file() and p.suffix.lower() in exts]
+            # Compute unmatched PDFs in the manifests directory (duplicates are routed separately)
+            all_files = [p for p in all_files if p not in self.duplicate_files]
             matched_set = {p.resolve() for p in self.matched_files}
             ignored_set = {p.resolve() for p in self.ignored_files}
             # Compute all PDFs and unmatched PDFs
@@ -537,39 +1978,73 @@ class CruiseDetectorGUI:
                 if p.resolve() not in matched_set and p.resolve() not in ignored_set
             ]
 
+            # PDFs without a usable name: look for a cruise number in their first pages
+            self.pdf_content_matches = {}
+            if PdfReader is not None and self.unmatched_pdfs:
+                self.status_var.set(f"Analyse du contenu de {len(self.unmatched_pdfs)} PDF...")
+                self.root.update()
+                probes = self._probe_pdfs(self.unmatched_pdfs)
+                ignored_numbers = set(self.ignored_cruise_numbers)
+                for pdf in list(self.unmatched_pdfs):
+                    probe = probes.get(str(pdf)) or {}
+                    numbers = [n for n in probe.get("cruise_numbers", []) if n in tree_items or n in ignored_numbers]
+                    if len(numbers) != 1:
+                        continue
+                    number = numbers[0]
+                    self.pdf_content_matches[pdf.name] = {"cruise": number, "layout": probe.get("layout", "")}
+                    self.unmatched_pdfs.remove(pdf)
+                    if number in tree_items:
+                        self.matched_files.append(pdf)
+                        self.file_cruise_numbers[self._file_key(pdf)] = number
+                        iid, match = tree_items[number]
+                        match.manifest_ids = match.manifest_ids + (self.file_names.intern(pdf.relative_to(manifests_path).as_posix()),)
+                        total_manifests += 1
+                        if iid is not None:
+                            vals = list(self.tree.item(iid, "values"))
+                            vals[3] = ", ".join(match.manifests) + " (PDF par contenu)"
+                            vals[4] = f"✅ {len(match.manifest_ids)} trouvé(s)"
+                            self.tree.item(iid, values=vals)
+                    else:
+                        self.ignored_files.append(pdf)
+
             # Update status
-            found_count = sum(1 for m in self.matches if m.manifests)
+            found_count = sum(1 for m in self.matches if m.manifest_ids)
             total_count = len(self.matches) + ignored_count
             
             # Classify Excel files as detailed or summary
-            self.classify_excel_files()
+            self.classify_excel_files([p for p in all_files if p.suffix.lower() in ('.xlsx', '.xls')])
             
             extra = f" | Ignorés: {ignored_count}" if ignored_count else ""
+            if duplicates_found:
+                extra += f" | Doublons: {duplicates_found}"
             self.status_var.set(f"Détection terminée: {found_count}/{total_count} croisières avec manifestes ({total_manifests} fichiers){extra}")
 
-            # Enable post-detection actions with counts
-            self.btn_move_processed.config(
-                state=("normal" if self.ignored_files else "disabled"),
-                text=f"📦 Déplacer 'déjà traités' ({len(self.ignored_files)})"
-            )
-            self.update_pdf_action_button()
-            
-            # Update summary Excel button (count includes summary-only files and mixed files)
-            resume_count = len(self.summary_excel_files) + len(self.mixed_excel_files)
-            self.btn_move_summary_excel.config(
-                state=("normal" if resume_count > 0 else "disabled"),
-                text=f"📊 Séparer Excel résumés ({resume_count})"
-            )
+            self._refresh_action_buttons()
+
+            results = {
+                "cruises": total_count, "with_manifests": found_count, "manifest_files": total_manifests,
+                "ignored": ignored_count, "duplicates": duplicates_found,
+                "ambiguous": len(self.ambiguous_files), "pdf_by_content": len(self.pdf_content_matches),
+            }
+
+            # Dry-run: show the plan built from this detection pass and stop there
+            if self.dry_run_var.get():
+                self.include_all_pdfs_var.set(True)
+                plan = self._build_post_detection_plan()
+                if silent:
+                    results["planned"] = plan.counts()
+                    return results
+                self.save_session()
+                self._show_plan_preview(plan)
+                return None
 
-            # Update correct Excel button (detailed-only files)
-            correct_count = len(self.detailed_excel_files)
-            self.btn_move_correct_excel.config(
-                state=("normal" if correct_count > 0 else "disabled"),
-                text=f"📁 Déplacer Excel corrects ({correct_count})"
-            )
-            
             # Auto-process after detection: move 'déjà traités', PDFs, Excel résumés/échoués, and corrects
             auto_results = self._auto_post_detection()
+            results.update(auto_results)
+            if silent:
+                return results
+            # Saved once, after the plan has run, so the session holds the post-move lists
+            self.save_session()
 
             # Combined summary popup
             combined = (
@@ -578,18 +2053,656 @@ class CruiseDetectorGUI:
                 f"• Avec manifestes: {found_count}\n"
                 f"• Fichiers manifestes: {total_manifests}\n"
                 f"• Ignorées (fond vert): {ignored_count}\n"
+                f"• Doublons (contenu identique): {duplicates_found} (dont {duplicates_total} dans les croisières)\n"
+                + (f"• Correspondances ambiguës: {len(self.ambiguous_files)}\n" + "".join(
+                    f"    - {fn}: {', '.join(nums)}\n" for fn, nums in sorted(self.ambiguous_files.items())
+                ) if self.ambiguous_files else "") +
+                f"• PDF identifiés par leur contenu: {len(self.pdf_content_matches)}\n"
                 f"• PDF à traiter (avant séparation): {auto_results.get('pdf_before', 0)}\n"
                 f"\nActions automatiques:\n"
                 f"• 'Déjà traités' déplacés: {auto_results.get('processed_moved', 0)} (échecs: {auto_results.get('processed_failed', 0)})\n"
                 f"• PDF déplacés: {auto_results.get('pdf_moved', 0)} (mode: {auto_results.get('pdf_mode', 'non traités')}, échecs: {auto_results.get('pdf_failed', 0)})\n"
                 f"• Excel résumés déplacés: {auto_results.get('resume_moved_whole', 0)}, copies (mixtes): {auto_results.get('resume_copied_mixed', 0)}, originaux nettoyés: {auto_results.get('resume_modified_original', 0)}, échecs: {auto_results.get('resume_failed', 0)}, vers 'excel echoues': {auto_results.get('resume_moved_to_failed', 0)}\n"
                 f"• Excel corrects déplacés: {auto_results.get('correct_moved', 0)} (échecs: {auto_results.get('correct_failed', 0)})\n"
+                f"• Doublons déplacés vers 'doublons': {auto_results.get('duplicate_moved', 0)} (échecs: {auto_results.get('duplicate_failed', 0)})\n"
+                + (f"• Fichiers verrouillés (ouverts ailleurs): {auto_results.get('locked_retried_ok', 0)} traités après attente, {auto_results.get('locked_still', 0)} toujours ouverts"
+                   + (f", {auto_results['locked_pending']} en attente (nouvel essai en arrière-plan)" if auto_results.get('locked_pending') else "") + "\n"
+                   if auto_results.get('locked_retried_ok') or auto_results.get('locked_still') or auto_results.get('locked_pending') else "")
             )
             messagebox.showinfo("Détection et séparation terminées", combined)
+            return results
                               
         except Exception as e:
-            messagebox.showerror("Erreur", f"Erreur lors de la détection:\n{str(e)}")
+            return self._report_error(f"Erreur lors de la détection:\n{str(e)}", silent)
     
+    def _refresh_action_buttons(self):
+        """Enable post-detection actions with counts"""
+        self.btn_move_processed.config(
+            state=("normal" if self.ignored_files else "disabled"),
+            text=f"📦 Déplacer 'déjà traités' ({len(self.ignored_files)})"
+        )
+        self.update_pdf_action_button()
+
+        # Update summary Excel button (count includes summary-only files and mixed files)
+        resume_count = len(self.summary_excel_files) + len(self.mixed_excel_files)
+        self.btn_move_summary_excel.config(
+            state=("normal" if resume_count > 0 else "disabled"),
+            text=f"📊 Séparer Excel résumés ({resume_count})"
+        )
+
+        # Update correct Excel button (detailed-only files)
+        correct_count = len(self.detailed_excel_files)
+        self.btn_move_correct_excel.config(
+            state=("normal" if correct_count > 0 else "disabled"),
+            text=f"📁 Déplacer Excel corrects ({correct_count})"
+        )
+
+    # --------- Session persistence ---------
+    def _dir_snapshot(self, directory: Path, recursive: bool = False) -> Dict[str, Tuple[int, int]]:
+        """(size, mtime_ns) of every manifest file under directory, by relative path."""
+        return self._scan_manifest_tree(directory, recursive)[0]
+
+    def save_session(self, session_file: Optional[Path] = None) -> bool:
+        """Pickle the detection state (file names as interned ids) with the folder snapshot."""
+        manifests = self.last_manifests_dir
+        if manifests is None or self.cruise_df is None:
+            return False
+        session_file = session_file or SESSION_FILE
+        try:
+            names = self.file_names
+            root = manifests.resolve()  # file_cruise_numbers is keyed by resolved path
+
+            def _id(p: Path) -> int:
+                return names.intern(p.relative_to(manifests).as_posix())
+
+            def _ids(paths) -> List[int]:
+                return [_id(p) for p in paths]
+
+            cruise_list = Path(self.cruise_list_path.get())
+            try:
+                st = cruise_list.stat()
+                cruise_list_sig = (str(cruise_list), st.st_size, st.st_mtime_ns)
+            except OSError:
+                cruise_list_sig = None
+            state = {
+                "version": SESSION_VERSION,
+                "saved_at": datetime.now().isoformat(timespec="seconds"),
+                "cruise_list": cruise_list_sig,
+                "manifests_dir": str(manifests),
+                "number_column": self.number_column.get(),
+                "cruise_df": self.cruise_df,
+                "ignored_row_idxs": sorted(self.ignored_row_idxs),
+                "recursive": bool(self.recursive_scan_var.get()),
+                "snapshot": self._dir_snapshot(manifests, bool(self.recursive_scan_var.get())),
+                "matches": [(m.row_index, m.cruise_number, m.cruise_name, m.manifest_ids) for m in self.matches],
+                "matched_files": _ids(self.matched_files),
+                "ignored_cruise_numbers": list(self.ignored_cruise_numbers),
+                "ignored_files": _ids(self.ignored_files),
+                "unmatched_pdfs": _ids(self.unmatched_pdfs),
+                "all_pdfs": _ids(self.all_pdfs),
+                "summary_excel_files": _ids(self.summary_excel_files),
+                "detailed_excel_files": _ids(self.detailed_excel_files),
+                "mixed_excel_files": {_id(p): v for p, v in self.mixed_excel_files.items()},
+                "duplicate_files": {_id(d): _id(o) for d, o in self.duplicate_files.items()},
+                "file_cruise_numbers": {
+                    names.intern(Path(k).relative_to(root).as_posix()): c
+                    for k, c in self.file_cruise_numbers.items() if Path(k).is_relative_to(root)
+                },
+                "ambiguous_files": dict(self.ambiguous_files),
+                "pdf_content_matches": dict(self.pdf_content_matches),
+                "tree": [tuple(self.tree.item(iid, "values")) for iid in self.tree.get_children()],
+            }
+            # Taken last: every name above is interned by now
+            state["names"] = list(names.names)
+            fd, tmp_name = tempfile.mkstemp(prefix=".session_", dir=str(session_file.parent))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_name, session_file)
+            except Exception:
+                if os.path.exists(tmp_name):
+                    os.remove(tmp_name)
+                raise
+            return True
+        except Exception:
+            return False
+
+    def restore_session(self, session_file: Optional[Path] = None) -> Optional[Dict[str, int]]:
+        """Reload the last detection if its cruise list is unchanged.
+
+        Files whose size or mtime differ from the saved snapshot (or that are gone) are
+        dropped from every list; returns valid/stale/new counts, or None if nothing was restored.
+        """
+        session_file = session_file or SESSION_FILE
+        try:
+            if not session_file.exists():
+                return None
+            with open(session_file, "rb") as f:
+                state = pickle.load(f)
+            if state.get("version") != SESSION_VERSION:
+                return None
+            manifests = Path(state["manifests_dir"])
+            if not manifests.is_dir():
+                return None
+            # A changed cruise list invalidates row indexes and matches
+            if state["cruise_list"]:
+                path, size, mtime_ns = state["cruise_list"]
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    return None
+                if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                    return None
+
+            saved = state["snapshot"]
+            recursive = bool(state.get("recursive"))
+            current = self._dir_snapshot(manifests, recursive)
+            names = FileNameTable(manifests)
+            for n in state["names"]:
+                names.intern(n)
+            valid_ids = {i for i, n in enumerate(names.names) if n in saved and current.get(n) == saved[n]}
+            valid_names = {names.names[i] for i in valid_ids}
+            # Some maps are keyed by bare file name rather than relative path
+            valid_names |= {posixpath.basename(n) for n in valid_names}
+            stale_names = {n for n in saved if current.get(n) != saved[n]}
+
+            def _paths(ids) -> List[Path]:
+                return [names.path(i) for i in ids if i in valid_ids]
+
+            self.cruise_list_path.set(state["cruise_list"][0] if state["cruise_list"] else "")
+            self.manifests_dir_path.set(str(manifests))
+            self.number_column.set(state["number_column"])
+            self.recursive_scan_var.set(recursive)
+            self.cruise_df = state["cruise_df"]
+            self.ignored_row_idxs = set(state["ignored_row_idxs"])
+            self.last_manifests_dir = manifests
+            self.file_names = names
+            self.matches = []
+            stale_numbers = set()
+            for row_index, number, name, ids in state["matches"]:
+                kept = tuple(i for i in ids if i in valid_ids)
+                if len(kept) != len(ids):
+                    stale_numbers.add(number)
+                self.matches.append(CruiseMatch(row_index, number, name, kept, names, self.cruise_df))
+            self.matched_files = _paths(state["matched_files"])
+            self.ignored_cruise_numbers = list(state["ignored_cruise_numbers"])
+            self.ignored_files = _paths(state["ignored_files"])
+            self.unmatched_pdfs = _paths(state["unmatched_pdfs"])
+            self.all_pdfs = _paths(state["all_pdfs"])
+            self.summary_excel_files = _paths(state["summary_excel_files"])
+            self.detailed_excel_files = _paths(state["detailed_excel_files"])
+            self.mixed_excel_files = {names.path(i): v for i, v in state["mixed_excel_files"].items() if i in valid_ids}
+            self.duplicate_files = {
+                names.path(d): names.path(o) for d, o in state["duplicate_files"].items() if d in valid_ids
+            }
+            self.file_cruise_numbers = {
+                self._file_key(names.path(i)): c for i, c in state["file_cruise_numbers"].items() if i in valid_ids
+            }
+            self.ambiguous_files = {n: v for n, v in state["ambiguous_files"].items() if n in valid_names}
+            self.pdf_content_matches = {n: v for n, v in state["pdf_content_matches"].items() if n in valid_names}
+
+            for item in self.tree.get_children():
+                self.tree.delete(item)
+            for values in state["tree"]:
+                values = list(values)
+                if len(values) > 4 and values[1] in stale_numbers:
+                    values[4] = f"{values[4]} ⚠ modifié depuis"
+                self.tree.insert("", "end", values=values)
+
+            counts = {
+                "valid": len(valid_ids),
+                "stale": len(stale_names),
+                "new": sum(1 for n in current if n not in saved),
+            }
+            self.detect_button.config(state="normal")
+            self._refresh_action_buttons()
+            note = f"Session du {state['saved_at']} restaurée: {counts['valid']} fichier(s) valides"
+            if counts["stale"] or counts["new"]:
+                note += f", {counts['stale']} modifié(s)/disparu(s), {counts['new']} nouveau(x) - relancez la détection"
+            self.status_var.set(note)
+            return counts
+        except Exception:
+            return None
+
+    # --------- Job queue (several manifests folders) ---------
+    def _run_job(self, job: DetectionJob) -> Dict:
+        """Load, detect, separate and merge one job on a headless instance (worker thread)."""
+        gui = CruiseDetectorGUI.headless(job)
+        job.progress.set("Chargement de la liste...")
+        loaded = gui.load_cruise_list(silent=True) or {}
+        if loaded.get("error"):
+            return loaded
+        result = gui.detect_manifests(silent=True) or {}
+        if result.get("error") or job.dry_run or not job.merge:
+            return result
+        dashboard = str(gui._dashboard_file().resolve())
+        lock = self._dashboard_locks.setdefault(dashboard, threading.Lock())
+        job.progress.set("En attente du dashboard...")
+        with lock:
+            merged = gui.merge_to_dashboard(silent=True) or {}
+        result["merge"] = merged
+        if merged.get("error"):
+            result["error"] = merged["error"]
+        return result
+
+    def _new_job(self, manifests_dir: str, priority: int) -> DetectionJob:
+        """Job for a manifests folder with the cruise list, dashboard and options of the window."""
+        return DetectionJob(
+            cruise_list=self.cruise_list_path.get(),
+            manifests_dir=manifests_dir,
+            dashboard=self.dashboard_path.get(),
+            priority=priority,
+            number_column=self.number_column.get(),
+            ignore_green=bool(self.ignore_green_var.get()),
+            recursive=bool(self.recursive_scan_var.get()),
+            token_match=bool(self.token_match_var.get()),
+            dry_run=bool(self.dry_run_var.get()),
+            merge_update_existing=bool(self.merge_update_existing_var.get()),
+        )
+
+    def _job_summary(self, job: DetectionJob) -> str:
+        """One-line progress or outcome of a job for the queue window."""
+        r = job.result
+        if job.state == "échec":
+            return f"❌ {r.get('error', '')}".replace("\n", " ")
+        if job.state != "terminé":
+            return job.progress.get()
+        text = f"{r.get('with_manifests', 0)}/{r.get('cruises', 0)} croisières, {r.get('manifest_files', 0)} fichier(s)"
+        if "planned" in r:
+            text += f", simulation: {sum(r['planned'].values())} action(s)"
+        merged = r.get("merge") or {}
+        if merged:
+            text += f", merge +{merged.get('appended', 0)} / maj {merged.get('updated', 0)}"
+        return text
+
+    def open_job_queue(self):
+        """Queue window: add manifests folders as jobs and run them concurrently."""
+        if self.job_window is not None and self.job_window.winfo_exists():
+            self.job_window.lift()
+            return
+        win = tk.Toplevel(self.root)
+        win.title("File de traitement")
+        win.geometry("950x420")
+        self.job_window = win
+
+        opts = ttk.Frame(win, padding="5")
+        opts.pack(fill=tk.X)
+        priority_var = tk.IntVar(value=0)
+        workers_var = tk.IntVar(value=4)
+        share_limit_var = tk.IntVar(value=1)
+        ttk.Label(opts, text="Priorité:").grid(row=0, column=0, sticky=tk.W, padx=5)
+        ttk.Spinbox(opts, from_=-10, to=10, textvariable=priority_var, width=5).grid(row=0, column=1, padx=5)
+        ttk.Label(opts, text="Jobs simultanés:").grid(row=0, column=2, sticky=tk.W, padx=5)
+        ttk.Spinbox(opts, from_=1, to=16, textvariable=workers_var, width=5).grid(row=0, column=3, padx=5)
+        ttk.Label(opts, text="Max par partage réseau:").grid(row=0, column=4, sticky=tk.W, padx=5)
+        ttk.Spinbox(opts, from_=1, to=8, textvariable=share_limit_var, width=5).grid(row=0, column=5, padx=5)
+
+        columns = ("Priorité", "Dossier", "Partage", "Statut", "Progression")
+        tree = ttk.Treeview(win, columns=columns, show="headings", height=12)
+        for col, width in zip(columns, (70, 300, 120, 90, 340)):
+            tree.heading(col, text=col)
+            tree.column(col, width=width)
+        tree.pack(fill=tk.BOTH, expand=True, padx=5)
+        summary_var = tk.StringVar(value="Aucun job")
+        ttk.Label(win, textvariable=summary_var, relief="sunken").pack(fill=tk.X, padx=5, pady=5)
+        rows: Dict[int, str] = {}
+
+        def _add(manifests_dir: str):
+            if not manifests_dir:
+                return
+            if not self.cruise_list_path.get():
+                messagebox.showerror("Erreur", "Veuillez sélectionner la liste des croisières (étape 1)")
+                return
+            try:
+                priority = int(priority_var.get())
+            except Exception:
+                priority = 0
+            job = self._new_job(manifests_dir, priority)
+            job.share = share_key(manifests_dir)
+            self.queued_jobs.append(job)
+            rows[id(job)] = tree.insert("", "end", values=(priority, manifests_dir, job.share, job.state, ""))
+            if self.job_scheduler is not None and not self.job_scheduler.is_idle():
+                self.job_scheduler.submit(job)
+            _refresh()
+
+        def _start():
+            waiting = [j for j in self.queued_jobs if j.seq < 0]
+            if not waiting:
+                return
+            if self.job_scheduler is None or self.job_scheduler.is_idle():
+                if self.job_scheduler is not None:
+                    self.job_scheduler.shutdown()
+                self.job_scheduler = JobScheduler(self._run_job, workers_var.get(), share_limit_var.get())
+            for job in waiting:
+                self.job_scheduler.submit(job)
+            _refresh()
+
+        def _refresh():
+            if not win.winfo_exists():
+                return
+            counts = {"en attente": 0, "en cours": 0, "terminé": 0, "échec": 0}
+            for job in self.queued_jobs:
+                counts[job.state] = counts.get(job.state, 0) + 1
+                iid = rows.get(id(job))
+                if iid is not None:
+                    tree.item(iid, values=(job.priority, job.manifests_dir, job.share, job.state, self._job_summary(job)))
+            done = counts["terminé"] + counts["échec"]
+            summary_var.set(
+                f"Jobs: {done}/{len(self.queued_jobs)} terminés • en cours: {counts['en cours']} • "
+                f"en attente: {counts['en attente']} • échecs: {counts['échec']}"
+            )
+            if counts["en cours"] or (self.job_scheduler is not None and not self.job_scheduler.is_idle()):
+                self.status_var.set(f"File de traitement: {done}/{len(self.queued_jobs)} jobs terminés")
+                win.after(500, _refresh)
+
+        buttons = ttk.Frame(win, padding="5")
+        buttons.pack(fill=tk.X)
+        ttk.Button(buttons, text="➕ Dossier actuel", command=lambda: _add(self.manifests_dir_path.get())).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="➕ Ajouter un dossier...", command=lambda: _add(filedialog.askdirectory(title="Dossier des manifestes"))).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="▶ Lancer", command=_start).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="Fermer", command=win.destroy).pack(side=tk.RIGHT, padx=5)
+
+        for job in self.queued_jobs:
+            rows[id(job)] = tree.insert("", "end", values=(job.priority, job.manifests_dir, job.share, job.state, ""))
+        _refresh()
+
+    def _hash_file(self, path: Path, size: int, mtime_ns: int) -> str:
+        """Content hash of a file read in 1 MB chunks, cached by (path, size, mtime)."""
+        key = (str(path), size, mtime_ns)
+        cached = self._file_hash_cache.get(key)
+        if cached is not None:
+            return cached
+        h = hashlib.blake2b(digest_size=20)
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._file_hash_cache[key] = digest
+        return digest
+
+    def _find_duplicate_files(self, paths: List[Path]) -> Dict[Path, Path]:
+        """Return {duplicate: original} for byte-identical files among paths.
+        Only files sharing a size with another candidate are hashed (in a thread pool).
+        The kept original is the one with the shortest name (e.g. '123-Ship.xlsx' over '123_Ship (1).xlsx').
+        """
+        by_size: Dict[int, List[Tuple[Path, int]]] = {}
+        for p in paths:
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            by_size.setdefault(st.st_size, []).append((p, st.st_mtime_ns))
+        candidates = [(p, size, mtime) for size, group in by_size.items() if len(group) > 1 for p, mtime in group]
+        if not candidates:
+            return {}
+
+        def _safe_hash(item):
+            p, size, mtime = item
+            try:
+                return self._hash_file(p, size, mtime)
+            except OSError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(8, len(candidates))) as pool:
+            digests = list(pool.map(_safe_hash, candidates))
+        by_hash: Dict[Tuple[int, str], List[Path]] = {}
+        for (p, size, _), digest in zip(candidates, digests):
+            if digest is not None:
+                by_hash.setdefault((size, digest), []).append(p)
+        duplicates: Dict[Path, Path] = {}
+        for group in by_hash.values():
+            if len(group) < 2:
+                continue
+            group.sort(key=lambda p: (len(p.name), p.name))
+            for p in group[1:]:
+                duplicates[p] = group[0]
+        return duplicates
+
+    # --------- Operation journal ---------
+    @contextmanager
+    def _journal_run(self, kind: str, **fields):
+        """Journal the file operations made inside the block as one run."""
+        if self._journal_run_id is not None:
+            yield self._journal_run_id
+            return
+        manifests_dir = (self.manifests_dir_path.get() or "").strip() or str(self.last_manifests_dir or "")
+        run_id = self.journal.begin_run(kind, manifests_dir, **fields)
+        self._journal_run_id = run_id
+        try:
+            yield run_id
+        finally:
+            self._journal_run_id = None
+            self.journal.end_run(run_id)
+
+    def _journal_record(self, op: str, **fields):
+        self.journal.record(op, self._journal_run_id, **fields)
+
+    def _journaled_move(self, src: Path, dst: Path):
+        try:
+            shutil.move(str(src), str(dst))
+        except Exception:
+            # Moves across volumes copy then delete: drop the copy when the source stayed (locked)
+            if src.exists() and dst.exists():
+                try:
+                    dst.unlink()
+                except Exception:
+                    pass
+            raise
+        self._journal_record("move", src=str(src), dst=str(dst))
+
+    def _locked_counts_text(self, counts: Dict[str, int]) -> str:
+        """Popup line for files that were open elsewhere (empty when there were none)."""
+        if not any(counts.get(k) for k in ("locked_retried_ok", "locked_still", "locked_pending")):
+            return ""
+        pending = (f", {counts['locked_pending']} en attente (nouvel essai en arrière-plan)"
+                   if counts.get("locked_pending") else "")
+        return (f"Verrouillés (ouverts ailleurs): {counts.get('locked_retried_ok', 0)} déplacés après attente, "
+                f"{counts.get('locked_still', 0)} toujours ouverts{pending}\n")
+
+    def _drain_retry_queue(self, retry: LockedFileRetryQueue, handler, done):
+        """After a batch, hand parked files to handler(payload, attempt) as they become free,
+        for at most LOCK_RETRY_MAX_WAIT seconds, then call done(payloads still locked, late).
+        Polling is scheduled with root.after() so the batch returns to the event loop instead of
+        re-entering it; late is True when done runs after this method returned (always with a
+        window, never on headless instances, whose after() runs callbacks immediately)."""
+        deadline = time.monotonic() + LOCK_RETRY_MAX_WAIT
+        run_id = self._journal_run_id
+        returned = False
+
+        def step():
+            # Files handled after the batch returned still belong to its journal run
+            outer, self._journal_run_id = self._journal_run_id, run_id
+            try:
+                for payload, attempt in retry.take_ready(0):
+                    handler(payload, attempt)
+            finally:
+                self._journal_run_id = outer
+            if retry.pending() and time.monotonic() < deadline:
+                self.status_var.set(f"Fichiers verrouillés en attente: {retry.pending()}...")
+                self.root.after(LOCK_RETRY_POLL_MS, step)
+            else:
+                done(retry.close(), returned)
+
+        if retry.pending():
+            self.root.after(LOCK_RETRY_POLL_MS, step)
+        else:
+            done(retry.close(), False)
+        returned = True
+
+    def _report_late_locked(self, what: str):
+        """on_done of a manual move: status line once the files it parked are settled."""
+        return lambda counts: self.status_var.set(f"{what} - {self._locked_counts_text(counts).strip()}")
+
+    def _move_files(self, files: List[Path], folder: str, on_done=None) -> Dict[str, int]:
+        """Move files into their output folder named folder (see _output_dest). Locked files are parked while the others keep moving, then
+        moved once free. Returns moved (including retried), failed, locked_retried_ok, locked_still
+        and locked_pending (still parked when the batch returns; on_done(counts) is called once
+        they are settled)."""
+        counts = {"moved": 0, "failed": 0, "locked_retried_ok": 0, "locked_still": 0, "locked_pending": 0}
+        retry = LockedFileRetryQueue()
+
+        def _try(p: Path, attempt: int = 0):
+            try:
+                self._journaled_move(p, self._unique_dest(self._output_dir(p, folder), p.name))
+                # Clean up if an original lingering handle remains
+                if p.exists():
+                    try:
+                        p.unlink()
+                    except Exception:
+                        pass
+                counts["moved"] += 1
+                if attempt:
+                    counts["locked_retried_ok"] += 1
+            except Exception as e:
+                if not is_lock_error(e, p):
+                    counts["failed"] += 1
+                elif not retry.park(p, p, attempt):
+                    counts["locked_still"] += 1
+
+        def _finish(left: List, late: bool):
+            counts["locked_still"] += len(left)
+            counts["locked_pending"] = 0
+            if late and on_done is not None:
+                on_done(counts)
+
+        for p in files:
+            _try(p)
+        counts["locked_pending"] = retry.pending()
+        self._drain_retry_queue(retry, _try, _finish)
+        return counts
+
+    def _journaled_edit(self, excel_path: Path, op: str, sheets: List[str], edit) -> bool:
+        """Run an in-place workbook edit, keeping a backup of the original for undo.
+        dst is the edited file (the converted .xlsx when an .xls is rewritten)."""
+        backup = self.journal.backup(self._journal_run_id, excel_path)
+        ok = edit()
+        if ok:
+            result = self.converted_xls_files.get(excel_path, excel_path)
+            self._journal_record(op, src=str(excel_path), dst=str(result), sheets=list(sheets),
+                                 backup=(str(backup) if backup else None))
+        elif backup:
+            backup.unlink(missing_ok=True)
+        return ok
+
+    def undo_last_run(self, silent: bool = False) -> Optional[dict]:
+        """Revert the last journaled run that has not been undone yet, replaying its operations
+        in reverse: moved files go back, created copies are deleted and edited workbooks are
+        restored from their backup. The undo is itself journaled as an 'undo' run."""
+        try:
+            run = self.journal.last_undoable_run()
+            if run is None:
+                if not silent:
+                    messagebox.showinfo("Info", "Aucune exécution à annuler.")
+                return {"restored": 0, "skipped": 0, "failed": 0}
+            if not silent and not messagebox.askyesno(
+                "Annuler la dernière exécution",
+                f"Annuler {run['ops']} opération(s) de l'exécution '{run['kind']}' du {run['started']} ?\n"
+                f"Dossier: {run['dir']}",
+            ):
+                return None
+            restored, skipped = 0, 0
+            failures: List[str] = []
+            with self._journal_run("undo", target=run["run"]):
+                for e in reversed(self.journal.query(run=run["run"])):
+                    src = Path(e["src"]) if e.get("src") else None
+                    dst = Path(e["dst"])
+                    try:
+                        if e["op"] == "move":
+                            if not dst.exists():
+                                skipped += 1
+                                continue
+                            if src.exists():
+                                failures.append(f"{src.name}: un fichier du même nom existe déjà")
+                                continue
+                            src.parent.mkdir(parents=True, exist_ok=True)
+                            self._journaled_move(dst, src)
+                        elif e["op"] == "create":
+                            if not dst.exists():
+                                skipped += 1
+                                continue
+                            dst.unlink()
+                            self._journal_record("delete", dst=str(dst))
+                        elif e["op"] in ("hide_sheets", "remove_sheets"):
+                            backup = Path(e["backup"]) if e.get("backup") else None
+                            if backup is None or not backup.exists():
+                                failures.append(f"{src.name}: copie de sauvegarde introuvable")
+                                continue
+                            if dst != src and dst.exists():
+                                dst.unlink()
+                            shutil.copy2(str(backup), str(src))
+                            self._journal_record("restore", src=str(backup), dst=str(src))
+                        else:
+                            continue
+                        restored += 1
+                    except Exception as ex:
+                        failures.append(f"{dst.name}: {ex}")
+            self.status_var.set(f"Annulation: {restored} opération(s) annulée(s), échecs: {len(failures)}")
+            result = {"run": run["run"], "restored": restored, "skipped": skipped, "failed": len(failures)}
+            if silent:
+                return result
+            details = (
+                f"Exécution: {run['kind']} du {run['started']}\n"
+                f"Opérations annulées: {restored}\n"
+                f"Déjà absentes: {skipped}\n"
+                f"Échecs: {len(failures)}\n\n"
+                "Relancez la détection pour mettre à jour les résultats."
+            )
+            if failures:
+                details += "\n\nÉchecs:\n- " + "\n- ".join(failures[:20])
+            messagebox.showinfo("Annulation terminée", details)
+            return None
+        except Exception as e:
+            return self._report_error(f"Erreur lors de l'annulation:\n{str(e)}", silent)
+
+    def open_journal_history(self):
+        """Window listing past runs, with a search over the journaled operations."""
+        win = tk.Toplevel(self.root)
+        win.title("Journal des opérations")
+        win.geometry("900x500")
+        search_var = tk.StringVar()
+        bar = ttk.Frame(win)
+        bar.pack(fill="x", padx=5, pady=5)
+        ttk.Label(bar, text="Fichier / dossier:").pack(side="left", padx=5)
+        entry = ttk.Entry(bar, textvariable=search_var, width=50)
+        entry.pack(side="left", padx=5)
+        text = tk.Text(win, wrap="none")
+        text.pack(fill="both", expand=True, padx=5, pady=5)
+
+        def _show(lines: List[str]):
+            text.config(state="normal")
+            text.delete("1.0", "end")
+            text.insert("1.0", "\n".join(lines))
+            text.config(state="disabled")
+
+        def _show_runs():
+            runs = self.journal.runs()[-50:]
+            lines = [f"{len(runs)} dernière(s) exécution(s):", ""]
+            for r in reversed(runs):
+                flag = " [annulée]" if r["undone"] else ""
+                lines.append(f"{r['started']}  {r['kind']:<14} {r['ops']:>5} opération(s){flag}  {r['dir']}")
+            _show(lines)
+
+        def _search(*_):
+            needle = search_var.get().strip()
+            if not needle:
+                _show_runs()
+                return
+            ops = self.journal.query(text=needle)
+            lines = [f"{len(ops)} opération(s) pour '{needle}':", ""]
+            for e in ops[-500:]:
+                arrow = f"{e['src']} -> {e['dst']}" if e.get("src") else e.get("dst", "")
+                lines.append(f"{e['ts']}  {e['op']:<13} {arrow}")
+            _show(lines)
+
+        def _undo():
+            self.undo_last_run()
+            _search()
+
+        entry.bind("<Return>", _search)
+        ttk.Button(bar, text="🔎 Rechercher", command=_search).pack(side="left", padx=5)
+        ttk.Button(bar, text="↩ Annuler la dernière exécution", command=_undo).pack(side="right", padx=5)
+        _show_runs()
+
     def _unique_dest(self, dest_dir: Path, name: str) -> Path:
         base = Path(name)
         stem, suffix = base.stem, base.suffix
@@ -600,18 +2713,18 @@ class CruiseDetectorGUI:
             i += 1
         return candidate
 
-    def _refresh_manifests_dir(self) -> Tuple[bool, bool]:
+    def _refresh_manifests_dir(self, silent: bool = False) -> Tuple[bool, bool]:
         """Ensure self.last_manifests_dir matches the UI entry.
-        Returns (ok, changed). If ok is False, an error was displayed.
+        Returns (ok, changed). If ok is False, an error was displayed (unless silent).
         """
         try:
             path_str = (self.manifests_dir_path.get() or "").strip()
             if not path_str:
-                messagebox.showerror("Erreur", "Veuillez sélectionner le dossier des manifestes")
+                self._report_error("Veuillez sélectionner le dossier des manifestes", silent)
                 return False, False
             p = Path(path_str)
             if not p.exists():
-                messagebox.showerror("Erreur", "Le dossier des manifestes n'existe pas")
+                self._report_error("Le dossier des manifestes n'existe pas", silent)
                 return False, False
             prev = self.last_manifests_dir.resolve() if self.last_manifests_dir else None
             cur = p.resolve()
@@ -619,18 +2732,45 @@ class CruiseDetectorGUI:
             self.last_manifests_dir = p
             return True, changed
         except Exception as e:
-            messagebox.showerror("Erreur", f"Chemin invalide: {e}")
+            self._report_error(f"Chemin invalide: {e}", silent)
             return False, False
 
+    def _output_base(self, src: Path) -> Path:
+        """Folder whose output subfolders ('excel correct', 'pdf'...) receive src: its own folder
+        when it lies in the scanned manifests tree, else the manifests folder itself."""
+        base = self.last_manifests_dir
+        parent = src.parent
+        if parent.name.lower() not in OUTPUT_FOLDER_NAMES and (parent == base or base in parent.parents):
+            return parent
+        return base
+
+    def _output_dest(self, src: Path, folder: str) -> str:
+        """Output folder of src relative to the manifests folder (dest_dir of planned actions)."""
+        rel = self._output_base(src).relative_to(self.last_manifests_dir).as_posix()
+        return folder if rel == "." else f"{rel}/{folder}"
+
+    def _output_dir(self, src: Path, folder: str) -> Path:
+        """Output folder of src for moves made outside a plan (created if needed)."""
+        d = self.last_manifests_dir / self._output_dest(src, folder)
+        d.mkdir(exist_ok=True)
+        return d
+
+    def _output_dirs_text(self, files: List[Path], folder: str) -> str:
+        """Popup line naming where files go: the folder, or how many folders receive them."""
+        dests = {self._output_dest(p, folder) for p in files}
+        if len(dests) == 1:
+            return f"Dossier: {self.last_manifests_dir / dests.pop()}"
+        return f"Dossiers: '{folder}' dans {len(dests)} dossiers"
+
     def _move_to_failed_folder(self, src: Path) -> Optional[Path]:
         """Déplacer un fichier Excel échoué vers 'excel echoues' et supprimer l'original s'il reste."""
         try:
             if not self.last_manifests_dir:
                 return None
-            failed_dir = self.last_manifests_dir / "excel echoues"
+            failed_dir = self._output_base(src) / "excel echoues"
             failed_dir.mkdir(exist_ok=True)
             dst = self._unique_dest(failed_dir, src.name)
-            shutil.move(str(src), str(dst))
+            self._journaled_move(src, dst)
             # Vérifier si le fichier d'origine existe toujours → supprimer
             if src.exists():
                 try:
@@ -642,6 +2782,7 @@ class CruiseDetectorGUI:
             return None
 
 
+    @journaled_run("deja traite")
     def move_ignored_manifests(self, silent: bool = False):
         """Move manifests corresponding to ignored (green) cruises into 'deja traite' folder."""
         try:
@@ -656,19 +2797,13 @@ class CruiseDetectorGUI:
                 if not silent:
                     messagebox.showinfo("Info", "Aucun fichier à déplacer pour 'déjà traités'.")
                 return {"moved": 0, "failed": 0}
-            target = self.last_manifests_dir / "deja traite"
-            target.mkdir(exist_ok=True)
-            moved, failed = 0, 0
-            for p in self.ignored_files:
-                try:
-                    dst = self._unique_dest(target, p.name)
-                    shutil.move(str(p), str(dst))
-                    moved += 1
-                except Exception:
-                    failed += 1
+            target = self._output_dirs_text(self.ignored_files, "deja traite")
+            counts = self._move_files(self.ignored_files, "deja traite", self._report_late_locked("'Déjà traités'"))
+            moved, failed = counts["moved"], counts["failed"]
             self.status_var.set(f"Déplacés 'déjà traités': {moved} fichier(s). Échecs: {failed}")
             if not silent:
-                messagebox.showinfo("Déplacement terminé", f"'Déjà traités' déplacés: {moved}\nÉchecs: {failed}\nDossier: {target}")
+                messagebox.showinfo("Déplacement terminé", f"'Déjà traités' déplacés: {moved}\nÉchecs: {failed}\n"
+                                    f"{self._locked_counts_text(counts)}{target}")
             # Refresh buttons (files are moved now)
             self.btn_move_processed.config(state="disabled", text="📦 Déplacer 'déjà traités' (0)")
             
@@ -678,12 +2813,13 @@ class CruiseDetectorGUI:
                 self.all_pdfs = [p for p in self.all_pdfs if p.name not in moved_names]
                 # Update the PDF action button
                 self.update_pdf_action_button()
-            return {"moved": moved, "failed": failed}
+            return counts
         except Exception as e:
             if not silent:
                 messagebox.showerror("Erreur", f"Impossible de déplacer: {e}")
             return {"moved": 0, "failed": 1}
 
+    @journaled_run("pdf")
     def move_unmatched_pdfs(self, silent: bool = False):
         """Move PDF files into 'pdf' folder.
         If the 'Inclure tous les PDF' option is enabled, move all PDFs; otherwise only unmatched PDFs.
@@ -693,10 +2829,9 @@ class CruiseDetectorGUI:
             if not ok:
                 return {"moved": 0, "failed": 0, "mode": ("tous" if self.include_all_pdfs_var.get() else "non traités")}
             if changed:
-                # Re-scan PDFs from the new folder
-                exts = {".xlsx", ".xls", ".pdf"}
-                all_files = [p for p in self.last_manifests_dir.iterdir() if p.is_file() and p.suffix.lower() in exts]
-                self.all_pdfs = [p for p in all_files if p.suffix.lower() == ".pdf"]
+                # Re-scan PDFs from the new folder (its subfolders too in recursive mode)
+                scanned, _ = self._scan_manifest_tree(self.last_manifests_dir, bool(self.recursive_scan_var.get()))
+                self.all_pdfs = [self.last_manifests_dir / rel for rel in scanned if rel.lower().endswith(".pdf")]
                 # Unmatched requires detection context; enforce 'all PDFs' mode or ask to detect
                 if not self.include_all_pdfs_var.get():
                     if not silent:
@@ -711,33 +2846,27 @@ class CruiseDetectorGUI:
                     msg = "Aucun PDF à déplacer." if self.include_all_pdfs_var.get() else "Aucun PDF non traité à déplacer."
                     messagebox.showinfo("Info", msg)
                 return {"moved": 0, "failed": 0, "mode": ("tous" if self.include_all_pdfs_var.get() else "non traités")}
-            target = self.last_manifests_dir / "pdf"
-            target.mkdir(exist_ok=True)
-            moved, failed = 0, 0
-            for p in pdf_list:
-                try:
-                    dst = self._unique_dest(target, p.name)
-                    shutil.move(str(p), str(dst))
-                    moved += 1
-                except Exception:
-                    failed += 1
+            target = self._output_dirs_text(pdf_list, "pdf")
+            counts = self._move_files(pdf_list, "pdf", self._report_late_locked("PDF"))
+            moved, failed = counts["moved"], counts["failed"]
+            locked_text = self._locked_counts_text(counts)
             if self.include_all_pdfs_var.get():
                 self.status_var.set(f"PDF déplacés: {moved} fichier(s). Échecs: {failed}")
                 if not silent:
-                    messagebox.showinfo("Déplacement PDF terminé", f"PDF déplacés: {moved}\nÉchecs: {failed}\nDossier: {target}")
+                    messagebox.showinfo("Déplacement PDF terminé", f"PDF déplacés: {moved}\nÉchecs: {failed}\n{locked_text}{target}")
                 # After moving all PDFs, clear lists
                 self.all_pdfs = []
                 self.unmatched_pdfs = []
             else:
                 self.status_var.set(f"PDF non traités déplacés: {moved} fichier(s). Échecs: {failed}")
                 if not silent:
-                    messagebox.showinfo("Déplacement PDF terminé", f"PDF non traités déplacés: {moved}\nÉchecs: {failed}\nDossier: {target}")
-                # Remove moved files from unmatched list
-                moved_names = {p.name for p in pdf_list}
-                self.unmatched_pdfs = [p for p in self.unmatched_pdfs if p.name not in moved_names]
+                    messagebox.showinfo("Déplacement PDF terminé", f"PDF non traités déplacés: {moved}\nÉchecs: {failed}\n{locked_text}{target}")
+                # Remove moved files from unmatched list (by path: subfolders may reuse a name)
+                moved_paths = set(pdf_list)
+                self.unmatched_pdfs = [p for p in self.unmatched_pdfs if p not in moved_paths]
             # Refresh button state
             self.update_pdf_action_button()
-            return {"moved": moved, "failed": failed, "mode": ("tous" if self.include_all_pdfs_var.get() else "non traités")}
+            return {**counts, "mode": ("tous" if self.include_all_pdfs_var.get() else "non traités")}
         except Exception as e:
             if not silent:
                 messagebox.showerror("Erreur", f"Impossible de déplacer: {e}")
@@ -761,53 +2890,194 @@ class CruiseDetectorGUI:
     
     def _sheet_indicator_count(self, headers_or_row: List[str]) -> int:
         """Helper: count detailed indicators in a list of header-like strings."""
-        detailed_indicators = [
-            'last name', 'first name', 'name', 'firstname', 'surname',
-            'passport', 'passport #', 'passport number', 'document', 'document type',
-            'nationality', 'nationality code', 'nationality 3-letter code',
-            'date of birth', 'dob', 'd.o.b', 'gender', 'sex', 'expiry', 'expires',
-            'issue date', 'embark', 'debark', 'cabin', 'function'
-        ]
-        lower_vals = [str(x).strip().lower() for x in headers_or_row if str(x).strip()]
-        return sum(1 for indicator in detailed_indicators if any(indicator in v for v in lower_vals))
+        return len(SHEET_RULES.scan(headers_or_row)[0])
 
     def _is_summary_header(self, headers_or_row: List[str]) -> bool:
-        """Heuristic: classify as summary if any header contains 'Female' or 'Male'."""
-        vals = [str(x).strip().lower() for x in headers_or_row if str(x).strip()]
-        if not vals:
-            return False
-        # If a column header mentions female or male, treat as summary (even if nationality exists)
-        if any('female' in v for v in vals) or any('male' in v for v in vals):
-            return True
-        return False
+        """Heuristic: classify as summary if any header contains a summary keyword ('Female'/'Male')."""
+        return bool(SHEET_RULES.scan(headers_or_row)[1])
+
+    def _sheet_rule_diagnostics(self, headers_or_row: List[str]) -> str:
+        """Matched keywords of a row, for error messages."""
+        detailed, summary = SHEET_RULES.scan(headers_or_row)
+        parts = []
+        if summary:
+            parts.append("résumé: " + ", ".join(sorted(summary)))
+        if detailed:
+            parts.append("détaillé: " + ", ".join(sorted(detailed)))
+        return "; ".join(parts) or "aucun mot-clé"
 
-    def _detect_sheet_type(self, excel_path: Path, sheet_name: str) -> str:
-        """Return 'detailed' or 'summary' for a given sheet by heuristics, scanning top rows for headers."""
+    # --------- Legacy .xls (BIFF) backend ---------
+    def _is_legacy_xls(self, excel_path: Path) -> bool:
+        """True when the file is an .xls workbook and xlrd is available to read it on demand."""
+        return xlrd is not None and excel_path.suffix.lower() == '.xls'
+
+    @contextmanager
+    def _open_xls_book(self, excel_path: Path):
+        """Open an .xls workbook once with on-demand sheet loading; release everything on exit."""
+        book = xlrd.open_workbook(str(excel_path), on_demand=True)
         try:
-            # Try with header=0 first
-            df = pd.read_excel(excel_path, sheet_name=sheet_name, nrows=10)
-            if not df.empty:
-                headers = [str(c).lower() for c in df.columns]
-                # Summary pattern takes precedence
-                if self._is_summary_header(headers):
-                    return 'summary'
-                if self._sheet_indicator_count(headers) >= 3:
-                    return 'detailed'
-            # Scan first 15 rows without header to find a header-like row
-            df2 = pd.read_excel(excel_path, sheet_name=sheet_name, header=None, nrows=15, dtype=str)
-            for _, row in df2.iterrows():
-                row_vals = [str(v) for v in row.tolist()]
-                if self._is_summary_header(row_vals):
-                    return 'summary'
-                if self._sheet_indicator_count(row_vals) >= 3:
-                    return 'detailed'
-            return 'summary'
+            yield book
+        finally:
+            try:
+                book.release_resources()
+            except Exception:
+                pass
+
+    def _xls_cell_value(self, book, cell):
+        """Convert an xlrd cell to a Python value (dates as datetime, blanks as None)."""
+        ctype = cell.ctype
+        if ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+            return None
+        if ctype == xlrd.XL_CELL_DATE:
+            try:
+                return xlrd.xldate.xldate_as_datetime(cell.value, book.datemode)
+            except Exception:
+                return cell.value
+        if ctype == xlrd.XL_CELL_BOOLEAN:
+            return bool(cell.value)
+        if ctype == xlrd.XL_CELL_NUMBER and float(cell.value).is_integer():
+            # Same as pandas: whole numbers come back as int (passport/cruise numbers)
+            return int(cell.value)
+        return cell.value
+
+    def _xls_sheet_rows(self, book, sheet_name: str, nrows: Optional[int] = None) -> List[list]:
+        """Return at most nrows rows of a sheet as Python values, then unload the sheet."""
+        sheet = book.sheet_by_name(sheet_name)
+        try:
+            limit = sheet.nrows if nrows is None else min(nrows, sheet.nrows)
+            return [[self._xls_cell_value(book, c) for c in sheet.row(r)] for r in range(limit)]
+        finally:
+            try:
+                book.unload_sheet(sheet_name)
+            except Exception:
+                pass
+
+    def _xls_sheet_dataframe(self, book, sheet_name: str) -> pd.DataFrame:
+        """Read a whole .xls sheet into a DataFrame using its first row as header."""
+        rows = self._xls_sheet_rows(book, sheet_name)
+        if not rows:
+            return pd.DataFrame()
+        width = max(len(r) for r in rows)
+        rows = [r + [None] * (width - len(r)) for r in rows]
+        headers = [
+            str(h) if h is not None else f"Unnamed: {i}"
+            for i, h in enumerate(rows[0])
+        ]
+        return pd.DataFrame(rows[1:], columns=headers)
+
+    def _sheet_type_from_rows(self, rows: List[list]) -> str:
+        """Classify a sheet from its top rows: the first header-like row decides."""
+        for row in rows:
+            kind = SHEET_RULES.classify(str(v) for v in row if v is not None)
+            if kind is not None:
+                return kind
+        return 'summary'
+
+    def _convert_xls_to_xlsx(self, excel_path: Path, hide: Optional[List[str]] = None,
+                             remove: Optional[List[str]] = None) -> Optional[Path]:
+        """Rewrite an .xls workbook as .xlsx next to it, hiding/removing the given sheets.
+        The original .xls is deleted once the .xlsx is written. Returns the new path or None.
+        """
+        if not self._is_legacy_xls(excel_path) or Workbook is None:
+            return None
+        hide_set = set(hide or [])
+        remove_set = set(remove or [])
+        out_path = None
+        try:
+            with self._open_xls_book(excel_path) as book:
+                kept = [s for s in book.sheet_names() if s not in remove_set]
+                # Keep at least one visible sheet, as Excel refuses workbooks without one
+                if not kept or all(s in hide_set for s in kept):
+                    return None
+                wb = Workbook(write_only=True)
+                for name in kept:
+                    ws = wb.create_sheet(title=name)
+                    if name in hide_set:
+                        ws.sheet_state = 'veryHidden'
+                    for row in self._xls_sheet_rows(book, name):
+                        ws.append(row)
+            out_path = self._unique_dest(excel_path.parent, excel_path.stem + ".xlsx")
+            wb.save(out_path)
+            excel_path.unlink()
+            self.converted_xls_files[excel_path] = out_path
+            return out_path
+        except Exception:
+            try:
+                if out_path and out_path.exists() and excel_path.exists():
+                    out_path.unlink()
+            except Exception:
+                pass
+            return None
+
+    @contextmanager
+    def _open_xlsx_book(self, excel_path: Path):
+        """Open an .xlsx workbook read-only: sheet rows are parsed lazily as they are iterated."""
+        book = load_workbook(str(excel_path), read_only=True, data_only=True)
+        try:
+            yield book
+        finally:
+            try:
+                book.close()
+            except Exception:
+                pass
+
+    def _xlsx_iter_rows(self, book, sheet_name: str, nrows: int):
+        """Yield the values of the first nrows rows of a sheet, one row at a time."""
+        for row in book[sheet_name].iter_rows(max_row=nrows, values_only=True):
+            yield row
+
+    def _detect_sheet_type(self, excel_path: Path, sheet_name: str, book=None) -> str:
+        """Return 'detailed' or 'summary' for a given sheet by heuristics, scanning top rows for headers.
+        The top rows are read once and lazily: the first header-like row decides, so parsing
+        stops there. Pass an already opened book (xlrd for .xls, read-only openpyxl for .xlsx)
+        to avoid re-opening the workbook per sheet.
+        """
+        if self._is_legacy_xls(excel_path):
+            try:
+                if book is None:
+                    with self._open_xls_book(excel_path) as opened:
+                        return self._sheet_type_from_rows(self._xls_sheet_rows(opened, sheet_name, 15))
+                return self._sheet_type_from_rows(self._xls_sheet_rows(book, sheet_name, 15))
+            except Exception:
+                return 'summary'
+        try:
+            if load_workbook is not None:
+                if book is None:
+                    with self._open_xlsx_book(excel_path) as opened:
+                        return self._sheet_type_from_rows(self._xlsx_iter_rows(opened, sheet_name, 15))
+                return self._sheet_type_from_rows(self._xlsx_iter_rows(book, sheet_name, 15))
+            df = pd.read_excel(excel_path, sheet_name=sheet_name, header=None, nrows=15, dtype=str)
+            return self._sheet_type_from_rows(df.itertuples(index=False))
         except Exception:
             # If unreadable, assume summary (safer to move/review)
             return 'summary'
 
-    def classify_excel_files(self):
-        """Classify Excel files: summary-only, detailed-only, or mixed (per sheet)."""
+    def _classify_sheets(self, excel_path: Path) -> Tuple[List[str], List[str]]:
+        """(detailed, summary) sheet names of a workbook, opened once for all its sheets.
+        Raises if the workbook itself cannot be opened."""
+        detailed: List[str] = []
+        summary: List[str] = []
+
+        def _add(name: str, kind: str):
+            (detailed if kind == 'detailed' else summary).append(name)
+
+        if self._is_legacy_xls(excel_path):
+            # Sheets are loaded on demand and released after probing
+            with self._open_xls_book(excel_path) as book:
+                for s in book.sheet_names():
+                    _add(s, self._detect_sheet_type(excel_path, s, book=book))
+        elif load_workbook is not None:
+            with self._open_xlsx_book(excel_path) as book:
+                for s in book.sheetnames:
+                    _add(s, self._detect_sheet_type(excel_path, s, book=book))
+        else:
+            for s in pd.ExcelFile(excel_path).sheet_names:
+                _add(s, self._detect_sheet_type(excel_path, s))
+        return detailed, summary
+
+    def classify_excel_files(self, excel_files: Optional[List[Path]] = None):
+        """Classify Excel files: summary-only, detailed-only, or mixed (per sheet).
+        Defaults to the Excel files at the top of the manifests folder."""
         if not self.last_manifests_dir:
             return
 
@@ -815,33 +3085,24 @@ class CruiseDetectorGUI:
         self.detailed_excel_files = []
         self.mixed_excel_files = {}
 
-        excel_files = [p for p in self.last_manifests_dir.iterdir()
-                       if p.is_file() and p.suffix.lower() in ['.xlsx', '.xls']]
+        if excel_files is None:
+            excel_files = [p for p in self.last_manifests_dir.iterdir()
+                           if p.is_file() and p.suffix.lower() in ['.xlsx', '.xls']]
 
         for excel_path in excel_files:
             try:
                 if excel_path.resolve() in {f.resolve() for f in self.ignored_files}:
                     continue
+                if excel_path in self.duplicate_files:
+                    continue
 
-                # List sheet names
-                sheet_names: List[str] = []
                 try:
-                    xls = pd.ExcelFile(excel_path)
-                    sheet_names = xls.sheet_names
+                    detailed_sheets, summary_sheets = self._classify_sheets(excel_path)
                 except Exception:
                     # If we cannot list sheets, fallback: treat file as summary
                     self.summary_excel_files.append(excel_path)
                     continue
 
-                detailed_sheets: List[str] = []
-                summary_sheets: List[str] = []
-                for s in sheet_names:
-                    t = self._detect_sheet_type(excel_path, s)
-                    if t == 'detailed':
-                        detailed_sheets.append(s)
-                    else:
-                        summary_sheets.append(s)
-
                 if summary_sheets and detailed_sheets:
                     self.mixed_excel_files[excel_path] = {
                         'summary': summary_sheets,
@@ -855,10 +3116,229 @@ class CruiseDetectorGUI:
                     # No readable sheets -> treat as summary
                     self.summary_excel_files.append(excel_path)
             except Exception:
-                self.summary_excel_files.append(excel_path)
-
-    def _write_sheets_to_excel(self, excel_path: Path, out_path: Path, sheet_names: List[str]):
-        """Write selected sheets (by name) from excel_path to out_path using pandas."""
+                self.summary_excel_files.append(excel_path)
+
+    # --------- Package-level (.xlsx zip/XML) sheet editing ---------
+    def _xml_attrs(self, tag: str) -> Dict[str, str]:
+        """Parse the attributes of a single XML start tag into a dict (values unescaped)."""
+        return {k: xml_unescape(v, {"&quot;": '"', "&apos;": "'"})
+                for k, v in re.findall(r'([\w:.-]+)\s*=\s*"([^"]*)"', tag)}
+
+    def _xml_set_attr(self, tag: str, name: str, value: str) -> str:
+        """Set (or add) an attribute on a single XML start tag, leaving the rest untouched."""
+        pattern = r'(\s' + re.escape(name) + r'\s*=\s*)"[^"]*"'
+        if re.search(pattern, tag):
+            return re.sub(pattern, lambda m: m.group(1) + '"' + value + '"', tag, count=1)
+        return re.sub(r'\s*(/?>)$', lambda m: f' {name}="{value}"' + m.group(1), tag, count=1)
+
+    def _zip_rels_path(self, part: str) -> str:
+        """Return the relationships part name for a package part (xl/workbook.xml -> xl/_rels/workbook.xml.rels)."""
+        base, name = posixpath.split(part)
+        return posixpath.join(base, "_rels", name + ".rels")
+
+    def _zip_rel_targets(self, rels_xml: str, part: str) -> Dict[str, Tuple[str, str]]:
+        """Map relationship Id -> (resolved part name, type) for internal targets of a .rels part."""
+        base = posixpath.dirname(part)
+        out: Dict[str, Tuple[str, str]] = {}
+        for tag in re.findall(r'<Relationship\b[^>]*>', rels_xml):
+            a = self._xml_attrs(tag)
+            if a.get("TargetMode") == "External" or "Id" not in a or "Target" not in a:
+                continue
+            target = a["Target"]
+            resolved = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(base, target))
+            out[a["Id"]] = (resolved, a.get("Type", ""))
+        return out
+
+    def _xlsx_filter_package(self, src: Path, dst: Path, drop: Optional[List[str]] = None,
+                             hide: Optional[List[str]] = None, keep: Optional[List[str]] = None) -> bool:
+        """Copy an .xlsx package to dst, dropping and/or hiding sheets by editing workbook.xml.
+        With keep, every sheet not listed is dropped.
+
+        Only the workbook part, its rels and [Content_Types].xml are rewritten; every other
+        part is streamed through unchanged. Parts of dropped sheets (and parts only they
+        reference, e.g. drawings/comments) are not copied at all, and calcChain.xml is left
+        out so Excel rebuilds it. Returns False (dst not written) if no listed sheet exists
+        or the result would have no visible sheet; raises if the package is not readable.
+        """
+        drop_set = set(drop or [])
+        hide_set = set(hide or [])
+        with zipfile.ZipFile(src) as zin:
+            names = set(zin.namelist())
+            root_rels = zin.read("_rels/.rels").decode("utf-8")
+            wb_part = next((t for t, typ in self._zip_rel_targets(root_rels, "").values()
+                            if typ.endswith("/officeDocument")), "xl/workbook.xml")
+            wb_rels_part = self._zip_rels_path(wb_part)
+            wb_xml = zin.read(wb_part).decode("utf-8")
+            wb_rels = zin.read(wb_rels_part).decode("utf-8")
+            ct_xml = zin.read("[Content_Types].xml").decode("utf-8")
+            rel_targets = self._zip_rel_targets(wb_rels, wb_part)
+
+            sheets_block = re.search(r'<(?:\w+:)?sheets\b[^>]*>(.*?)</(?:\w+:)?sheets>', wb_xml, re.S)
+            if not sheets_block:
+                return False
+            sheet_tags = re.findall(r'<(?:\w+:)?sheet\b[^>]*/>', sheets_block.group(1))
+            sheets = []
+            for tag in sheet_tags:
+                a = self._xml_attrs(tag)
+                rid = next((v for k, v in a.items() if k.endswith(":id")), None)
+                sheets.append({"tag": tag, "name": a.get("name", ""), "rid": rid,
+                               "state": a.get("state", "visible")})
+            if keep is not None:
+                keep_set = set(keep)
+                if not any(sh["name"] in keep_set for sh in sheets):
+                    return False
+                drop_set = {sh["name"] for sh in sheets if sh["name"] not in keep_set}
+            if not any(sh["name"] in drop_set or sh["name"] in hide_set for sh in sheets):
+                return False
+            kept = [sh for sh in sheets if sh["name"] not in drop_set]
+            for sh in kept:
+                if sh["name"] in hide_set:
+                    sh["state"] = "veryHidden"
+            visible = [i for i, sh in enumerate(kept) if sh["state"] == "visible"]
+            if not kept or not visible:
+                return False
+            dropped = [sh for sh in sheets if sh["name"] in drop_set]
+
+            # Parts to skip: dropped sheets, their rels, and what only they reference
+            skip_parts = set()
+            drop_rids = set()
+            kept_refs = set()
+            for sh in kept:
+                target = rel_targets.get(sh["rid"], (None, ""))[0]
+                if target and self._zip_rels_path(target) in names:
+                    rels = zin.read(self._zip_rels_path(target)).decode("utf-8")
+                    kept_refs.update(t for t, _ in self._zip_rel_targets(rels, target).values())
+            for sh in dropped:
+                target = rel_targets.get(sh["rid"], (None, ""))[0]
+                if not target:
+                    continue
+                drop_rids.add(sh["rid"])
+                skip_parts.add(target)
+                sheet_rels = self._zip_rels_path(target)
+                if sheet_rels in names:
+                    skip_parts.add(sheet_rels)
+                    rels = zin.read(sheet_rels).decode("utf-8")
+                    for t, _ in self._zip_rel_targets(rels, target).values():
+                        if t not in kept_refs:
+                            skip_parts.add(t)
+                            skip_parts.add(self._zip_rels_path(t))
+            for rid, (t, typ) in rel_targets.items():
+                if dropped and typ.endswith("/calcChain"):
+                    drop_rids.add(rid)
+                    skip_parts.add(t)
+
+            # workbook.xml: sheets, defined names and book views
+            new_tags = {id(sh): sh["tag"] for sh in kept}
+            for sh in kept:
+                if sh["name"] in hide_set:
+                    new_tags[id(sh)] = self._xml_set_attr(sh["tag"], "state", "veryHidden")
+            block = sheets_block.group(1)
+            for sh in sheets:
+                block = block.replace(sh["tag"], new_tags.get(id(sh), ""), 1)
+            wb_xml = wb_xml[:sheets_block.start(1)] + block + wb_xml[sheets_block.end(1):]
+
+            if dropped:
+                old_index = {id(sh): i for i, sh in enumerate(sheets)}
+                index_map = {old_index[id(sh)]: i for i, sh in enumerate(kept)}
+                dropped_refs = []
+                for sh in dropped:
+                    n = sh["name"]
+                    dropped_refs.append(xml_escape("'" + n.replace("'", "''") + "'!"))
+                    dropped_refs.append(xml_escape(n + "!"))
+
+                def _fix_defined_name(m):
+                    tag, body = m.group(1), m.group(2)
+                    a = self._xml_attrs(tag)
+                    if "localSheetId" in a:
+                        try:
+                            new_idx = index_map.get(int(a["localSheetId"]))
+                        except ValueError:
+                            new_idx = None
+                        if new_idx is None:
+                            return ""
+                        tag = self._xml_set_attr(tag, "localSheetId", str(new_idx))
+                    if any(ref in body for ref in dropped_refs):
+                        return ""
+                    return tag + body + m.group(3)
+
+                wb_xml = re.sub(r'(<(?:\w+:)?definedName\b[^>]*>)(.*?)(</(?:\w+:)?definedName>)',
+                                _fix_defined_name, wb_xml, flags=re.S)
+                wb_xml = re.sub(r'<(?:\w+:)?definedNames\b[^>]*>\s*</(?:\w+:)?definedNames>', "", wb_xml)
+
+            def _fix_view(m):
+                tag = m.group(0)
+                a = self._xml_attrs(tag)
+                try:
+                    active = int(a.get("activeTab", "0"))
+                except ValueError:
+                    active = 0
+                # Map the old active index onto the kept sheets, falling back to the first visible one
+                old_active = sheets[active] if 0 <= active < len(sheets) else None
+                new_active = next((i for i, sh in enumerate(kept) if sh is old_active), None)
+                if new_active is None or new_active not in visible:
+                    new_active = visible[0]
+                if "activeTab" in a or new_active != 0:
+                    tag = self._xml_set_attr(tag, "activeTab", str(new_active))
+                if "firstSheet" in a:
+                    tag = self._xml_set_attr(tag, "firstSheet", str(min(new_active, int(a["firstSheet"] or 0))))
+                return tag
+
+            wb_xml = re.sub(r'<(?:\w+:)?workbookView\b[^>]*>', _fix_view, wb_xml)
+
+            # Relationships and content types of skipped parts
+            def _drop_rel(m):
+                return "" if self._xml_attrs(m.group(0)).get("Id") in drop_rids else m.group(0)
+
+            wb_rels = re.sub(r'<Relationship\b[^>]*/>', _drop_rel, wb_rels)
+
+            def _drop_override(m):
+                part = self._xml_attrs(m.group(0)).get("PartName", "").lstrip("/")
+                return "" if part in skip_parts else m.group(0)
+
+            ct_xml = re.sub(r'<Override\b[^>]*/>', _drop_override, ct_xml)
+
+            replaced = {
+                wb_part: wb_xml.encode("utf-8"),
+                wb_rels_part: wb_rels.encode("utf-8"),
+                "[Content_Types].xml": ct_xml.encode("utf-8"),
+            }
+            with zipfile.ZipFile(dst, "w") as zout:
+                for info in zin.infolist():
+                    if info.filename in skip_parts:
+                        continue
+                    if info.filename in replaced:
+                        zout.writestr(info, replaced[info.filename])
+                        continue
+                    with zin.open(info) as fin, zout.open(info, "w") as fout:
+                        shutil.copyfileobj(fin, fout, 1024 * 1024)
+        return True
+
+    def _write_sheets_to_excel(self, excel_path: Path, out_path: Path, sheet_names: List[str]):
+        """Write selected sheets (by name) from excel_path to out_path.
+        .xlsx sources are copied at package level (formatting, merged cells and formulas kept);
+        other formats go through pandas.
+        """
+        if excel_path.suffix.lower() == '.xlsx' and out_path.suffix.lower() == '.xlsx':
+            try:
+                if self._xlsx_filter_package(excel_path, out_path, keep=sheet_names):
+                    return
+            except Exception:
+                pass
+            try:
+                if out_path.exists():
+                    out_path.unlink()
+            except Exception:
+                pass
+        if self._is_legacy_xls(excel_path):
+            with self._open_xls_book(excel_path) as book, \
+                    pd.ExcelWriter(out_path, engine='openpyxl') as writer:
+                for name in sheet_names:
+                    try:
+                        df = self._xls_sheet_dataframe(book, name)
+                        df.to_excel(writer, sheet_name=name, index=False)
+                    except Exception:
+                        continue
+            return
         with pd.ExcelWriter(out_path, engine='openpyxl') as writer:
             for name in sheet_names:
                 try:
@@ -868,8 +3348,53 @@ class CruiseDetectorGUI:
                     # Skip sheets that fail to read
                     continue
 
+    def _xlsx_patch_in_place(self, excel_path: Path, drop: Optional[List[str]] = None,
+                             hide: Optional[List[str]] = None) -> Optional[bool]:
+        """Drop/hide sheets of an .xlsx by patching its package, then atomically replace the file.
+        Returns True if patched, False if there was nothing (valid) to change, and None if the
+        package could not be handled at zip level (caller may fall back to openpyxl).
+        """
+        fd, tmp_name = tempfile.mkstemp(prefix=".~" + excel_path.stem, suffix=".xlsx", dir=str(excel_path.parent))
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        try:
+            if not self._xlsx_filter_package(excel_path, tmp_path, drop=drop, hide=hide):
+                return False
+            try:
+                shutil.copymode(str(excel_path), str(tmp_path))
+            except Exception:
+                pass
+            os.replace(str(tmp_path), str(excel_path))
+            return True
+        except Exception:
+            return None
+        finally:
+            try:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+            except Exception:
+                pass
+
     def _remove_sheets_in_place(self, excel_path: Path, sheets_to_remove: List[str]) -> bool:
-        """Remove given sheets from the workbook in place. Returns True on success."""
+        """Remove given sheets from the workbook in place (journaled, with an undo backup)."""
+        return self._journaled_edit(excel_path, "remove_sheets", sheets_to_remove,
+                                    lambda: self._remove_sheets(excel_path, sheets_to_remove))
+
+    def _hide_sheets_in_place(self, excel_path: Path, sheets_to_hide: List[str]) -> bool:
+        """Hide given sheets in the workbook in place (journaled, with an undo backup)."""
+        return self._journaled_edit(excel_path, "hide_sheets", sheets_to_hide,
+                                    lambda: self._hide_sheets(excel_path, sheets_to_hide))
+
+    def _remove_sheets(self, excel_path: Path, sheets_to_remove: List[str]) -> bool:
+        """Remove given sheets from the workbook in place. Returns True on success.
+        .xls workbooks are rewritten as .xlsx (the .xls is replaced by the converted copy).
+        """
+        if self._is_legacy_xls(excel_path):
+            return self._convert_xls_to_xlsx(excel_path, remove=sheets_to_remove) is not None
+        if excel_path.suffix.lower() == '.xlsx':
+            patched = self._xlsx_patch_in_place(excel_path, drop=sheets_to_remove)
+            if patched is not None:
+                return patched
         if load_workbook is None or excel_path.suffix.lower() != '.xlsx':
             return False
         try:
@@ -886,8 +3411,17 @@ class CruiseDetectorGUI:
         except Exception:
             return False
 
-    def _hide_sheets_in_place(self, excel_path: Path, sheets_to_hide: List[str]) -> bool:
-        """Hide given sheets (veryHidden) in the workbook in place. Returns True on success."""
+    def _hide_sheets(self, excel_path: Path, sheets_to_hide: List[str]) -> bool:
+        """Hide given sheets (veryHidden) in the workbook in place. Returns True on success.
+        .xls workbooks are rewritten as .xlsx (the .xls is replaced by the converted copy).
+        """
+        if self._is_legacy_xls(excel_path):
+            return self._convert_xls_to_xlsx(excel_path, hide=sheets_to_hide) is not None
+        if excel_path.suffix.lower() == '.xlsx':
+            # Only workbook.xml changes; all other parts are streamed through untouched
+            patched = self._xlsx_patch_in_place(excel_path, hide=sheets_to_hide)
+            if patched is not None:
+                return patched
         if load_workbook is None or excel_path.suffix.lower() != '.xlsx':
             return False
         try:
@@ -913,6 +3447,7 @@ class CruiseDetectorGUI:
         except Exception:
             return False
 
+    @journaled_run("excel resume")
     def move_summary_excel_files(self, silent: bool = False):
         """Process Excel files:
         - Files with only summary sheets: move whole file to 'excel resume'
@@ -929,9 +3464,6 @@ class CruiseDetectorGUI:
                 # Refresh classification for the new folder
                 self.classify_excel_files()
 
-            resume_dir = self.last_manifests_dir / "excel resume"
-            resume_dir.mkdir(exist_ok=True)
-
             moved_whole, copied_mixed, modified_original, failed = 0, 0, 0, 0
             moved_to_failed = 0
             warnings: List[str] = []
@@ -939,31 +3471,48 @@ class CruiseDetectorGUI:
             failed_files_reasons: List[str] = []
             failed_files_sheets: List[str] = []
 
+            # Locked files (open elsewhere) are parked and handled once the others are done
+            retry = LockedFileRetryQueue()
+            locked_retried_ok, locked_still = 0, 0
+
             # 1) Move summary-only files
-            for p in self.summary_excel_files:
+            def _move_whole(p: Path, attempt: int = 0):
+                nonlocal moved_whole, failed, moved_to_failed, locked_retried_ok, locked_still
                 try:
-                    dst = self._unique_dest(resume_dir, p.name)
-                    shutil.move(str(p), str(dst))
+                    dst = self._unique_dest(self._output_dir(p, "excel resume"), p.name)
+                    self._journaled_move(p, dst)
                     moved_whole += 1
-                except Exception:
+                    if attempt:
+                        locked_retried_ok += 1
+                except Exception as e:
+                    if is_lock_error(e, p):
+                        if not retry.park(p, ("move", p), attempt):
+                            locked_still += 1
+                        return
                     failed += 1
                     failed_files.append(p.name)
                     # Try to get the header and sheet breakdown for explanation
                     try:
                         xls = pd.ExcelFile(p)
                         headers = []
+                        keywords = []
                         resume_sheets = []
                         detailed_sheets = []
                         for sheet in xls.sheet_names:
                             df = pd.read_excel(p, sheet_name=sheet, nrows=1)
                             headers += [str(c) for c in df.columns]
+                            keywords.append(f"{sheet} ({self._sheet_rule_diagnostics(df.columns)})")
                             # Use the same logic as _detect_sheet_type
-                            if self._is_summary_header(df.columns):
+                            kind = SHEET_RULES.classify(df.columns)
+                            if kind == 'summary':
                                 resume_sheets.append(sheet)
-                            elif self._sheet_indicator_count(df.columns) >= 3:
+                            elif kind == 'detailed':
                                 detailed_sheets.append(sheet)
                         headers_str = ', '.join(headers)
-                        failed_files_reasons.append(f"{p.name}: contient {headers_str} dans l'en-tête donc il est résumé")
+                        failed_files_reasons.append(
+                            f"{p.name}: contient {headers_str} dans l'en-tête donc il est résumé"
+                            f" [mots-clés: {' | '.join(keywords)}]"
+                        )
                         failed_files_sheets.append(f"{p.name}:\n  Feuilles résumés: {', '.join(resume_sheets) if resume_sheets else 'Aucune'}\n  Feuilles détaillées: {', '.join(detailed_sheets) if detailed_sheets else 'Aucune'}")
                     except Exception:
                         failed_files_reasons.append(f"{p.name}: impossible de lire l'en-tête")
@@ -977,7 +3526,14 @@ class CruiseDetectorGUI:
                         pass
 
             # 2) Handle mixed files
-            for p, groups in self.mixed_excel_files.items():
+            def _split(p: Path, groups: Dict, attempt: int = 0):
+                nonlocal copied_mixed, modified_original, failed, moved_to_failed, locked_retried_ok, locked_still
+                # Sheets cannot be hidden in a workbook open elsewhere: wait for it
+                if file_is_locked(p):
+                    if not retry.park(p, ("split", p, groups), attempt):
+                        locked_still += 1
+                    return
+                modified_before = modified_original
                 summary_sheets = groups.get('summary', [])
                 detailed_sheets = groups.get('detailed', [])
                 copy_path = None
@@ -986,8 +3542,9 @@ class CruiseDetectorGUI:
                     # Always write resume copy as .xlsx for compatibility
                     copy_ext = ".xlsx"
                     copy_name = p.stem + "_resume" + copy_ext
-                    copy_path = self._unique_dest(resume_dir, copy_name)
+                    copy_path = self._unique_dest(self._output_dir(p, "excel resume"), copy_name)
                     self._write_sheets_to_excel(p, copy_path, summary_sheets)
+                    self._journal_record("create", dst=str(copy_path), src=str(p))
                     copied_mixed += 1
 
                     # Prefer: hide summary sheets so only detailed remain visible
@@ -1019,17 +3576,23 @@ class CruiseDetectorGUI:
                     try:
                         xls = pd.ExcelFile(p)
                         headers = []
+                        keywords = []
                         resume_sheets = []
                         detailed_sheets_list = []
                         for sheet in xls.sheet_names:
                             df = pd.read_excel(p, sheet_name=sheet, nrows=1)
                             headers += [str(c) for c in df.columns]
-                            if self._is_summary_header(df.columns):
+                            keywords.append(f"{sheet} ({self._sheet_rule_diagnostics(df.columns)})")
+                            kind = SHEET_RULES.classify(df.columns)
+                            if kind == 'summary':
                                 resume_sheets.append(sheet)
-                            elif self._sheet_indicator_count(df.columns) >= 3:
+                            elif kind == 'detailed':
                                 detailed_sheets_list.append(sheet)
                         headers_str = ', '.join(headers)
-                        failed_files_reasons.append(f"{p.name}: contient {headers_str} dans l'en-tête donc il est résumé")
+                        failed_files_reasons.append(
+                            f"{p.name}: contient {headers_str} dans l'en-tête donc il est résumé"
+                            f" [mots-clés: {' | '.join(keywords)}]"
+                        )
                         failed_files_sheets.append(f"{p.name}:\n  Feuilles résumés: {', '.join(resume_sheets) if resume_sheets else 'Aucune'}\n  Feuilles détaillées: {', '.join(detailed_sheets_list) if detailed_sheets_list else 'Aucune'}")
                     except Exception:
                         failed_files_reasons.append(f"{p.name}: impossible de lire l'en-tête")
@@ -1048,20 +3611,50 @@ class CruiseDetectorGUI:
                             Path(copy_path).unlink(missing_ok=True)
                     except Exception:
                         pass
+                if attempt and modified_original > modified_before:
+                    locked_retried_ok += 1
 
-            # Refresh classification and button state
-            self.classify_excel_files()
-            resume_count = len(self.summary_excel_files) + len(self.mixed_excel_files)
-            self.btn_move_summary_excel.config(
-                state=("normal" if resume_count > 0 else "disabled"),
-                text=f"📊 Séparer Excel résumés ({resume_count})"
-            )
-            # Update correct Excel button after reclassification
-            correct_count = len(self.detailed_excel_files)
-            self.btn_move_correct_excel.config(
-                state=("normal" if correct_count > 0 else "disabled"),
-                text=f"📁 Déplacer Excel corrects ({correct_count})"
-            )
+            for p in self.summary_excel_files:
+                _move_whole(p)
+            for p, groups in self.mixed_excel_files.items():
+                _split(p, groups)
+
+            def _refresh_buttons():
+                # Refresh classification and button state
+                self.classify_excel_files()
+                resume_count = len(self.summary_excel_files) + len(self.mixed_excel_files)
+                self.btn_move_summary_excel.config(
+                    state=("normal" if resume_count > 0 else "disabled"),
+                    text=f"📊 Séparer Excel résumés ({resume_count})"
+                )
+                # Update correct Excel button after reclassification
+                correct_count = len(self.detailed_excel_files)
+                self.btn_move_correct_excel.config(
+                    state=("normal" if correct_count > 0 else "disabled"),
+                    text=f"📁 Déplacer Excel corrects ({correct_count})"
+                )
+
+            def _retry(item, attempt: int):
+                if item[0] == "move":
+                    _move_whole(item[1], attempt)
+                else:
+                    _split(item[1], item[2], attempt)
+
+            def _settled(left: List, late: bool):
+                nonlocal locked_still, locked_pending
+                locked_still += len(left)
+                locked_pending = 0
+                if late:
+                    # The popup has already been shown: update buttons and status now
+                    _refresh_buttons()
+                    self.status_var.set(
+                        f"Excel résumés - verrouillés: {locked_retried_ok} traités après attente, "
+                        f"{locked_still} toujours ouverts"
+                    )
+
+            locked_pending = retry.pending()
+            self._drain_retry_queue(retry, _retry, _settled)
+            _refresh_buttons()
 
             # Status and popup
             self.status_var.set(
@@ -1074,6 +3667,11 @@ class CruiseDetectorGUI:
                 f"• Échecs: {failed}\n"
                 f"• Déplacés vers 'excel echoues': {moved_to_failed}"
             )
+            if locked_retried_ok or locked_still or locked_pending:
+                details += (f"\n• Verrouillés (ouverts ailleurs): {locked_retried_ok} traités après attente, "
+                            f"{locked_still} toujours ouverts")
+                if locked_pending:
+                    details += f", {locked_pending} en attente (nouvel essai en arrière-plan)"
             if warnings or failed_files:
                 details += "\n\nAvertissements:\n"
                 if warnings:
@@ -1093,6 +3691,9 @@ class CruiseDetectorGUI:
                 "modified_original": modified_original,
                 "failed": failed,
                 "moved_to_failed": moved_to_failed,
+                "locked_retried_ok": locked_retried_ok,
+                "locked_still": locked_still,
+                "locked_pending": locked_pending,
             }
 
         except Exception as e:
@@ -1107,6 +3708,7 @@ class CruiseDetectorGUI:
         """Run the GUI"""
         self.root.mainloop()
 
+    @journaled_run("excel correct")
     def move_correct_excel_files(self, silent: bool = False):
         """Move detailed Excel files into 'excel correct' folder.
 
@@ -1129,32 +3731,14 @@ class CruiseDetectorGUI:
                 if p not in files_to_move:
                     files_to_move.append(p)
 
-            # Always ensure the target folder exists
-            target = self.last_manifests_dir / "excel correct"
-            try:
-                target.mkdir(exist_ok=True)
-            except Exception:
-                pass
-
             if not files_to_move:
                 if not silent:
                     messagebox.showinfo("Info", "Aucun fichier Excel correct à déplacer.")
                 return {"moved": 0, "failed": 0}
 
-            moved, failed = 0, 0
-            for p in files_to_move:
-                try:
-                    dst = self._unique_dest(target, p.name)
-                    shutil.move(str(p), str(dst))
-                    # Clean up if an original lingering handle remains
-                    if p.exists():
-                        try:
-                            p.unlink()
-                        except Exception:
-                            pass
-                    moved += 1
-                except Exception:
-                    failed += 1
+            target = self._output_dirs_text(files_to_move, "excel correct")
+            counts = self._move_files(files_to_move, "excel correct", self._report_late_locked("Excel corrects"))
+            moved, failed = counts["moved"], counts["failed"]
 
             # Reclassify after moving
             self.classify_excel_files()
@@ -1169,9 +3753,9 @@ class CruiseDetectorGUI:
             if not silent:
                 messagebox.showinfo(
                     "Déplacement terminé",
-                    f"Excel corrects déplacés: {moved}\nÉchecs: {failed}\nDossier: {target}"
+                    f"Excel corrects déplacés: {moved}\nÉchecs: {failed}\n{self._locked_counts_text(counts)}{target}"
                 )
-            return {"moved": moved, "failed": failed}
+            return counts
         except Exception as e:
             if not silent:
                 messagebox.showerror("Erreur", f"Impossible de déplacer les Excel corrects: {e}")
@@ -1179,42 +3763,281 @@ class CruiseDetectorGUI:
 
 
     def _auto_post_detection(self) -> dict:
-        """Run automatic separation steps after detection, silently, and return a summary dict."""
-        summary: dict = {}
+        """Run automatic separation steps after detection, silently, and return a summary dict.
+        Builds the full action plan from the current detection results, then executes it in one pass.
+        """
         # Always include all PDFs in automatic mode
         try:
             self.include_all_pdfs_var.set(True)
         except Exception:
             pass
-        # 1) Move ignored (déjà traités)
-        res_processed = self.move_ignored_manifests(silent=True)
-        summary["processed_moved"] = res_processed.get("moved", 0)
-        summary["processed_failed"] = res_processed.get("failed", 0)
-
-        # Capture PDFs count before move for reporting
-        summary["pdf_before"] = len(self.all_pdfs)
-
-        # 2) Move PDFs (respect user's 'Inclure tous les PDF' option)
-        res_pdfs = self.move_unmatched_pdfs(silent=True)
-        summary["pdf_moved"] = res_pdfs.get("moved", 0)
-        summary["pdf_failed"] = res_pdfs.get("failed", 0)
-        summary["pdf_mode"] = res_pdfs.get("mode", "non traités")
-
-        # 3) Separate Excel résumés and move échoués
-        res_resume = self.move_summary_excel_files(silent=True)
-        summary["resume_moved_whole"] = res_resume.get("moved_whole", 0)
-        summary["resume_copied_mixed"] = res_resume.get("copied_mixed", 0)
-        summary["resume_modified_original"] = res_resume.get("modified_original", 0)
-        summary["resume_failed"] = res_resume.get("failed", 0)
-        summary["resume_moved_to_failed"] = res_resume.get("moved_to_failed", 0)
-
-        # 4) Move Excel corrects
-        res_correct = self.move_correct_excel_files(silent=True)
-        summary["correct_moved"] = res_correct.get("moved", 0)
-        summary["correct_failed"] = res_correct.get("failed", 0)
+        plan = self._build_post_detection_plan()
+        return self._execute_post_detection_plan(plan)
+
+    def _build_post_detection_plan(self) -> PostDetectionPlan:
+        """Build every post-detection action from the last detection pass (no file is touched).
+        Order matches the manual buttons: 'déjà traités', PDFs, Excel résumés (whole and mixed),
+        then Excel corrects. Each file is planned at most once.
+        """
+        base = self.last_manifests_dir
+        include_all = bool(self.include_all_pdfs_var.get())
+        plan = PostDetectionPlan(
+            manifests_dir=str(base) if base else "",
+            pdf_mode=("tous" if include_all else "non traités"),
+            created_at=datetime.now().isoformat(timespec="seconds"),
+        )
+        if not base:
+            return plan
+        claimed = set()
 
+        def _add(kind: str, category: str, p: Path, dest_dir: str, **extra):
+            key = p.resolve()
+            if key in claimed:
+                return
+            claimed.add(key)
+            if not p.exists():
+                plan.actions.append(PlannedAction(
+                    kind="fail", category=category, src=str(p), dest_dir="",
+                    reason="Fichier introuvable au moment de la planification",
+                ))
+                return
+            plan.actions.append(PlannedAction(kind=kind, category=category, src=str(p), dest_dir=dest_dir, **extra))
+
+        # Output folders sit next to each file, so subfolders of a recursive scan keep their own
+        _out = self._output_dest
+        for p in self.ignored_files:
+            _add("move", "processed", p, _out(p, "deja traite"))
+        for p, original in self.duplicate_files.items():
+            _add("move", "duplicate", p, _out(p, "doublons"), reason=f"Copie identique de {original.name}")
+        for p in (self.all_pdfs if include_all else self.unmatched_pdfs):
+            _add("move", "pdf", p, _out(p, "pdf"))
+        for p in self.summary_excel_files:
+            _add("move", "resume", p, _out(p, "excel resume"))
+        for p, groups in self.mixed_excel_files.items():
+            summary_sheets = list(groups.get('summary', []))
+            detailed_sheets = list(groups.get('detailed', []))
+            if p.suffix.lower() == '.xls' and not self._is_legacy_xls(p):
+                _add("fail", "failed", p, _out(p, "excel echoues"),
+                     summary_sheets=summary_sheets, detailed_sheets=detailed_sheets,
+                     reason="Lecture .xls indisponible (xlrd manquant): feuilles résumés non masquables")
+                continue
+            _add("split_mixed", "resume", p, _out(p, "excel correct"),
+                 summary_sheets=summary_sheets, detailed_sheets=detailed_sheets)
+        for p in self.detailed_excel_files:
+            _add("move", "correct", p, _out(p, "excel correct"))
+        return plan
+
+    @journaled_run("plan")
+    def _execute_post_detection_plan(self, plan: PostDetectionPlan) -> dict:
+        """Execute a plan in a single pass and return the same summary keys as the step-by-step flow."""
+        summary = {
+            "processed_moved": 0, "processed_failed": 0,
+            "pdf_before": sum(1 for a in plan.actions if a.category == "pdf"),
+            "pdf_moved": 0, "pdf_failed": 0, "pdf_mode": plan.pdf_mode,
+            "resume_moved_whole": 0, "resume_copied_mixed": 0, "resume_modified_original": 0,
+            "resume_failed": 0, "resume_moved_to_failed": 0,
+            "correct_moved": 0, "correct_failed": 0,
+            "duplicate_moved": 0, "duplicate_failed": 0,
+            # Files open elsewhere: moved after waiting, still locked at the end of the batch,
+            # or still parked when the summary is returned (settled later from the event loop)
+            "locked_retried_ok": 0, "locked_still": 0, "locked_pending": 0,
+        }
+        base = Path(plan.manifests_dir) if plan.manifests_dir else self.last_manifests_dir
+        if not base:
+            return summary
+        self.last_manifests_dir = base
+        counters = {
+            "processed": ("processed_moved", "processed_failed"),
+            "pdf": ("pdf_moved", "pdf_failed"),
+            "resume": ("resume_moved_whole", "resume_failed"),
+            "correct": ("correct_moved", "correct_failed"),
+            "duplicate": ("duplicate_moved", "duplicate_failed"),
+        }
+        dest_dirs: Dict[str, Path] = {}
+
+        def _dest(name: str) -> Path:
+            d = dest_dirs.get(name)
+            if d is None:
+                d = base / name
+                d.mkdir(exist_ok=True)
+                dest_dirs[name] = d
+            return d
+
+        def _move(src: Path, dest_name: str) -> str:
+            """'ok', 'failed', or 'locked' (file open elsewhere: worth retrying)."""
+            try:
+                dst = self._unique_dest(_dest(dest_name), src.name)
+                self._journaled_move(src, dst)
+                if src.exists():
+                    try:
+                        src.unlink()
+                    except Exception:
+                        pass
+                return "ok"
+            except Exception as e:
+                return "locked" if is_lock_error(e, src) else "failed"
+
+        retry = LockedFileRetryQueue()
+
+        def _run(action: PlannedAction, attempt: int = 0) -> str:
+            """Execute one action: 'ok', 'failed', or 'parked' when its file is locked."""
+            src = Path(action.src)
+            if action.kind == "fail":
+                if action.category in counters:
+                    summary[counters[action.category][1]] += 1
+                else:
+                    summary["resume_failed"] += 1
+                if src.exists() and src.suffix.lower() in ('.xlsx', '.xls') and self._move_to_failed_folder(src):
+                    summary["resume_moved_to_failed"] += 1
+                return "failed"
+
+            if action.kind == "move":
+                ok_key, fail_key = counters[action.category]
+                outcome = _move(src, action.dest_dir)
+                if outcome == "locked":
+                    return _park(src, action, attempt)
+                if outcome == "ok":
+                    summary[ok_key] += 1
+                    return "ok"
+                summary[fail_key] += 1
+                # Summary-only files that cannot be moved are set aside, as in the manual flow
+                if action.category == "resume" and self._move_to_failed_folder(src):
+                    summary["resume_moved_to_failed"] += 1
+                return "failed"
+
+            if action.kind == "split_mixed":
+                # Sheets cannot be hidden in a workbook open elsewhere: wait for it instead of
+                # sending a valid file to 'excel echoues'
+                if file_is_locked(src):
+                    return _park(src, action, attempt)
+                copy_path = None
+                try:
+                    resume_dir = posixpath.join(posixpath.dirname(action.dest_dir), "excel resume")
+                    copy_path = self._unique_dest(_dest(resume_dir), src.stem + "_resume.xlsx")
+                    self._write_sheets_to_excel(src, copy_path, action.summary_sheets)
+                    self._journal_record("create", dst=str(copy_path), src=str(src))
+                    summary["resume_copied_mixed"] += 1
+                    if self._hide_sheets_in_place(src, action.summary_sheets) or \
+                            self._remove_sheets_in_place(src, action.summary_sheets):
+                        summary["resume_modified_original"] += 1
+                        # .xls originals are replaced by their converted .xlsx
+                        current = self.converted_xls_files.get(src, src)
+                        outcome = _move(current, action.dest_dir)
+                        if outcome == "locked":
+                            # Opened again after the split: only the move is left to retry
+                            return _park(current, PlannedAction(kind="move", category="correct", src=str(current),
+                                                                dest_dir=action.dest_dir), attempt)
+                        summary["correct_moved" if outcome == "ok" else "correct_failed"] += 1
+                        return outcome
+                    if self._move_to_failed_folder(src):
+                        summary["resume_moved_to_failed"] += 1
+                    if copy_path and copy_path.exists():
+                        copy_path.unlink(missing_ok=True)
+                    return "failed"
+                except Exception:
+                    summary["resume_failed"] += 1
+                    if src.exists() and self._move_to_failed_folder(src):
+                        summary["resume_moved_to_failed"] += 1
+                    try:
+                        if copy_path and copy_path.exists():
+                            copy_path.unlink(missing_ok=True)
+                    except Exception:
+                        pass
+                    return "failed"
+            return "failed"
+
+        def _park(path: Path, action: PlannedAction, attempt: int) -> str:
+            if retry.park(path, action, attempt):
+                return "parked"
+            summary["locked_still"] += 1
+            return "failed"
+
+        def _retry(action: PlannedAction, attempt: int):
+            if _run(action, attempt) == "ok":
+                summary["locked_retried_ok"] += 1
+
+        def _settled(left: List, late: bool):
+            summary["locked_still"] += len(left)
+            summary["locked_pending"] = 0
+            if late:
+                self.status_var.set(
+                    f"Fichiers verrouillés: {summary['locked_retried_ok']} traités après attente, "
+                    f"{summary['locked_still']} toujours ouverts"
+                )
+
+        for action in plan.actions:
+            _run(action)
+        summary["locked_pending"] = retry.pending()
+        self._drain_retry_queue(retry, _retry, _settled)
+
+        # Everything planned has been handled: reset post-detection lists and buttons
+        self.ignored_files = []
+        self.all_pdfs = []
+        self.unmatched_pdfs = []
+        self.summary_excel_files = []
+        self.detailed_excel_files = []
+        self.mixed_excel_files = {}
+        self.duplicate_files = {}
+        self.last_plan = plan
+        try:
+            self.btn_move_processed.config(state="disabled", text="📦 Déplacer 'déjà traités' (0)")
+            self.update_pdf_action_button()
+            self.btn_move_summary_excel.config(state="disabled", text="📊 Séparer Excel résumés (0)")
+            self.btn_move_correct_excel.config(state="disabled", text="📁 Déplacer Excel corrects (0)")
+        except Exception:
+            pass
         return summary
 
+    def _show_plan_preview(self, plan: PostDetectionPlan):
+        """Dry-run view: list the planned actions and let the user execute or export them."""
+        self.last_plan = plan
+        labels = {
+            "processed": "Déjà traités", "pdf": "PDF", "resume": "Excel résumés",
+            "correct": "Excel corrects", "failed": "Échecs", "duplicate": "Doublons",
+        }
+        win = tk.Toplevel(self.root)
+        win.title("Simulation - plan des actions")
+        win.geometry("800x500")
+        text = tk.Text(win, wrap="none")
+        text.pack(fill="both", expand=True, padx=5, pady=5)
+        lines = [f"Dossier: {plan.manifests_dir}", f"Actions: {len(plan.actions)}", ""]
+        for a in plan.actions:
+            name = Path(a.src).name
+            if a.kind == "split_mixed":
+                line = (f"[{labels.get(a.category, a.category)}] {name}: copie '{', '.join(a.summary_sheets)}' "
+                        f"-> excel resume, masquer, puis -> {a.dest_dir}")
+            elif a.kind == "fail":
+                line = f"[{labels['failed']}] {name}: {a.reason}"
+            elif a.category == "duplicate":
+                line = f"[{labels['duplicate']}] {name} -> {a.dest_dir} ({a.reason})"
+            else:
+                line = f"[{labels.get(a.category, a.category)}] {name} -> {a.dest_dir}"
+            lines.append(line)
+        text.insert("1.0", "\n".join(lines))
+        text.config(state="disabled")
+
+        def _execute():
+            win.destroy()
+            res = self._execute_post_detection_plan(plan)
+            self.status_var.set(
+                f"Plan exécuté: déjà traités {res['processed_moved']}, PDF {res['pdf_moved']}, "
+                f"résumés {res['resume_moved_whole']} (+{res['resume_copied_mixed']} mixtes), corrects {res['correct_moved']}"
+            )
+
+        def _export():
+            filename = filedialog.asksaveasfilename(
+                title="Enregistrer le plan", defaultextension=".json",
+                filetypes=[("JSON", "*.json")],
+            )
+            if filename:
+                Path(filename).write_text(plan.to_json(), encoding="utf-8")
+
+        buttons = ttk.Frame(win)
+        buttons.pack(fill="x", padx=5, pady=5)
+        ttk.Button(buttons, text="▶ Exécuter le plan", command=_execute).pack(side="left", padx=5)
+        ttk.Button(buttons, text="💾 Exporter JSON", command=_export).pack(side="left", padx=5)
+        ttk.Button(buttons, text="Fermer", command=win.destroy).pack(side="right", padx=5)
+
     # --------- Dashboard merge helpers ---------
     def _strip_accents(self, s: str) -> str:
         try:
@@ -1250,13 +4073,34 @@ class CruiseDetectorGUI:
         # Not used directly; kept for potential extension
         return 0
 
-    def _read_with_best_header(self, excel_path: Path, sheet_name: str) -> pd.DataFrame:
+    def _projection_for_header(self, header: List[str]) -> Tuple[List[int], List[int]]:
+        """Positions of the header cells mapped by _detect_column_map, and the positions among
+        them read as text: the non-date ones (date columns keep Excel's native cell types)."""
+        column_map = self._detect_column_map(header)
+        positions: List[int] = []
+        text_positions: List[int] = []
+        for field_name, col in column_map.items():
+            if col is None:
+                continue
+            pos = header.index(col)
+            if pos not in positions:
+                positions.append(pos)
+            if field_name not in DASHBOARD_DATE_COLUMNS and pos not in text_positions:
+                text_positions.append(pos)
+        return sorted(positions), sorted(text_positions)
+
+    def _read_with_best_header(self, excel_path: Path, sheet_name: str, project: bool = False) -> pd.DataFrame:
+        """Read a passenger sheet using the best-scoring header row of its first 25 rows.
+        With project=True only the columns the dashboard mapping uses are parsed.
+        The index is the row number in the sheet (1-based, as Excel shows it), for reports."""
         # Probe first 25 rows to locate a header row
         try:
             probe = pd.read_excel(excel_path, sheet_name=sheet_name, header=None, nrows=25, dtype=str)
         except Exception:
             try:
-                return pd.read_excel(excel_path, sheet_name=sheet_name)
+                df = pd.read_excel(excel_path, sheet_name=sheet_name)
+                df.index = df.index + 2
+                return df
             except Exception:
                 return pd.DataFrame()
         # Candidates tokens across fields
@@ -1278,18 +4122,32 @@ class CruiseDetectorGUI:
             if score > best_score:
                 best_score = score
                 best_row = i
+        usecols, text_positions = None, []
+        if project and len(probe):
+            header = ["" if pd.isna(x) else str(x) for x in probe.iloc[best_row].tolist()]
+            positions, text_positions = self._projection_for_header(header)
+            usecols = positions or None
         try:
-            df = pd.read_excel(excel_path, sheet_name=sheet_name, header=best_row)
+            df = pd.read_excel(excel_path, sheet_name=sheet_name, header=best_row, usecols=usecols)
+            # Text columns are converted by position after the read: read_excel renames
+            # duplicate headers ('Name.1'), so a dtype dict keyed by header text could hit the wrong one
+            for pos in text_positions:
+                i = usecols.index(pos)
+                df.isetitem(i, df.iloc[:, i].astype("string"))
+            # Data starts on the row after the header (blank rows are kept by read_excel)
+            df.index = df.index + best_row + 2
         except Exception:
             try:
                 df = pd.read_excel(excel_path, sheet_name=sheet_name)
+                df.index = df.index + 2
             except Exception:
                 return pd.DataFrame()
         # Drop fully-empty rows
         if not df.empty:
             df = df.dropna(how='all')
             # Remove repeated header rows (if any)
-            df = df[df.apply(lambda r: not any(isinstance(x, str) and self._normalize_header(str(x)) in [self._normalize_header(c) for c in df.columns] for x in r.values), axis=1)]
+            header_keys = {self._normalize_header(str(c)) for c in df.columns}
+            df = df[df.apply(lambda r: not any(isinstance(x, str) and self._normalize_header(x) in header_keys for x in r.values), axis=1)]
         return df
 
     def _detect_column_map(self, columns: List[str]) -> Dict[str, Optional[str]]:
@@ -1385,53 +4243,647 @@ class CruiseDetectorGUI:
             cols,
             ["nationality", "nationality code", "nationalite", "citizenship", "pays", "country"],
         )
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-import pandas as pd
-from pathlib import Path
-from datetime import datetime, date
-import re
-from typing import List, Dict, Optional, Tuple
-import unicodedata
-from dataclasses import dataclass
-import shutil
+        col_dob = self._find_col(
+            cols,
+            [
+                "date of birth", "dob", "birth date", "d.o.b", "date naissance",
+                "date de naissance", "date naiss",
+            ],
+        )
+        col_gender = self._find_col(cols, ["gender", "sex", "sexe", "genre"])
+        col_in = self._find_col(
+            cols,
+            [
+                "embark", "embarkation", "arrival", "arrival date", "date arrivee",
+                "date d'arrivee", "date entree", "entry date", "date d'entree", "eta",
+            ],
+        )
+        col_out = self._find_col(
+            cols,
+            [
+                "debark", "disembark", "departure", "departure date", "date sortie",
+                "date depart", "exit date", "date de depart", "etd",
+            ],
+        )
+        # 'nom' also matches 'prénom' / 'nom et prénom': never reuse the first/full name column
+        if col_last is not None and col_last in (col_first, col_full):
+            col_last = None
 
-try:
-    from openpyxl import load_workbook  # for reading cell fill colors
-except Exception:
-    load_workbook = None
+        def _col(name: Optional[str]) -> pd.Series:
+            if name is None:
+                return pd.Series([None] * len(df), index=df.index, dtype=object)
+            return df[name]
 
+        def _text(series: pd.Series) -> pd.Series:
+            return series.astype("string").str.strip().replace("", pd.NA)
 
-@dataclass
-class CruiseMatch:
-    """Represents a cruise with its Excel row and found manifests"""
-    excel_row: int
-    cruise_number: str
-    cruise_name: str
-    manifests: List[str]
-    excel_data: Dict
+        out = pd.DataFrame(index=df.index)
+        out["CruiseNumber"] = self._cruise_number_for_file(source_file)
+        if col_first is None and col_last is None and col_full is not None:
+            out["LastName"], out["FirstName"] = self._split_full_names(_text(_col(col_full)))
+        else:
+            out["LastName"] = _text(_col(col_last))
+            out["FirstName"] = _text(_col(col_first))
+        out["Passport"] = _text(_col(col_passport))
+        out["Nationality"] = self._normalize_nationality(_text(_col(col_nat)), source_file.name)
+        # Same headers mean the same layout, hence the same date formats
+        layout = tuple(self._normalize_header(str(c)) for c in cols)
+        out["DateOfBirth"] = self._parse_date_column(_col(col_dob), (layout, col_dob))
+        out["Gender"] = _text(_col(col_gender))
+        out["DateEntree"] = self._parse_date_column(_col(col_in), (layout, col_in))
+        out["DateSortie"] = self._parse_date_column(_col(col_out), (layout, col_out))
+        out["SourceFile"] = source_file.name
+        out["SourceSheet"] = sheet_name
+        # Rows without any identity field are layout noise (totals, blank separators).
+        # The sheet row numbers of the index are kept for the validation report.
+        identity = out[["LastName", "FirstName", "Passport"]].notna().any(axis=1)
+        return out[identity]
 
+    def _infer_date_format(self, sample: pd.Series) -> Optional[str]:
+        """Pick the text date format that parses most of a sample of a column."""
+        best, best_hits = None, 0
+        for fmt in MANIFEST_DATE_FORMATS:
+            hits = int(pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum())
+            if hits > best_hits:
+                best, best_hits = fmt, hits
+                if hits == len(sample):
+                    break
+        return best
 
-class CruiseDetectorGUI:
-    def _init_(self):
-        self.root = tk.Tk()
-        self.root.title("Détecteur de Manifestes - Croisières")
-        self.root.geometry("900x750")
+    @staticmethod
+    def _as_ns(parsed: pd.Series) -> pd.Series:
+        """Parsed dates as datetime64[ns], NaT for the ones out of its range (e.g. year 2990)."""
+        parsed = parsed.astype("datetime64[us]")
+        in_range = parsed.between(pd.Timestamp.min, pd.Timestamp.max)
+        return parsed.where(in_range).astype("datetime64[ns]")
 
-        # Variables
-        self.cruise_list_path = tk.StringVar()
-        self.manifests_dir_path = tk.StringVar()
-        self.cruise_df = None
-        self.matches = []
-        # Ignore rows with green background in N
-        self.ignore_green_var = tk.BooleanVar(value=True)
-        self.ignored_row_idxs = set()  # indexes in DataFrame to ignore
+    def _parse_date_column(self, series: pd.Series, cache_key) -> pd.Series:
+        """Normalize a whole date column to datetime64 (dates only).
+        Cells already read as dates are kept, plausible numbers are taken as Excel serials, and
+        text is parsed in one call with the format inferred once per layout from a sample.
+        Dates outside the datetime64[ns] range (typos such as 2990) become NaT.
+        """
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return self._as_ns(series.dt.normalize())
+        obj = series.astype(object)
+        result = pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+        present = obj.notna()
+        if not present.any():
+            return result
 
-        # Post-detection state
-        self.last_manifests_dir = None
-        self.matched_files = []
-        self.ignored_cruise_numbers = []
-        self.ignored_files = []
-        self.unmatched_pdfs = []
-        self.all_pdfs = []
-        # Excel classification: su
\ No newline at end of file
+        is_date = obj.map(lambda v: isinstance(v, (datetime, date))) & present
+        if is_date.any():
+            result[is_date] = self._as_ns(pd.to_datetime(obj[is_date], errors="coerce"))
+
+        # Excel serials (numbers or short numeric text): fast path without any format guessing.
+        # Capped below EXCEL_SERIAL_MAX so 8-digit text (ddmmyyyy, yyyymmdd) goes to format inference
+        numbers = pd.to_numeric(obj.where(present & ~is_date), errors="coerce")
+        is_serial = numbers.between(1, EXCEL_SERIAL_MAX, inclusive="left")
+        if is_serial.any():
+            result[is_serial] = self._as_ns(pd.to_datetime(numbers[is_serial], unit="D", origin="1899-12-30", errors="coerce"))
+
+        text_mask = present & ~is_date & ~is_serial
+        if text_mask.any():
+            text = obj[text_mask].astype(str).str.strip()
+            fmt = self._date_format_cache.get(cache_key)
+            if fmt is None:
+                fmt = self._infer_date_format(text.head(50))
+                if fmt is not None:
+                    self._date_format_cache[cache_key] = fmt
+            if fmt is not None:
+                result[text_mask] = self._as_ns(pd.to_datetime(text, format=fmt, errors="coerce"))
+        return result.dt.normalize()
+
+    # Leading run of upper-case words (the surname) followed by the given names
+    _UPPER_SURNAME_RE = r"^(?P<last>[A-ZÀ-ÖØ-Þ'\-]+(?:\s+[A-ZÀ-ÖØ-Þ'\-]+)*)\s+(?P<first>.*[a-zß-öø-ÿ].*)$"
+
+    def _detect_name_convention(self, names: pd.Series) -> str:
+        """Dominant full-name layout of a column, from a sample:
+        'comma' (LAST, First), 'upper_first' (LAST First) or 'first_last' (First Last).
+        """
+        sample = names.dropna().head(50)
+        if sample.empty:
+            return "first_last"
+        if sample.str.contains(",", regex=False).mean() >= 0.5:
+            return "comma"
+        if sample.str.match(self._UPPER_SURNAME_RE).mean() >= 0.5:
+            return "upper_first"
+        return "first_last"
+
+    def _split_full_names(self, names: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        """Split a FullName column into (LastName, FirstName) with whole-column string ops."""
+        names = names.astype("string").str.replace(r"\s+", " ", regex=True).str.strip()
+        convention = self._detect_name_convention(names)
+        last = pd.Series(pd.NA, index=names.index, dtype="string")
+        first = pd.Series(pd.NA, index=names.index, dtype="string")
+        pending = names.notna()
+        if convention == "comma":
+            has_comma = names.str.contains(",", regex=False).fillna(False)
+            parts = names[has_comma].str.split(",", n=1, expand=True)
+            if not parts.empty:
+                last[has_comma] = parts[0].str.strip()
+                first[has_comma] = parts[1].str.strip()
+            pending &= ~has_comma
+        elif convention == "upper_first":
+            parts = names.str.extract(self._UPPER_SURNAME_RE)
+            matched = parts["last"].notna()
+            last[matched] = parts.loc[matched, "last"]
+            first[matched] = parts.loc[matched, "first"].str.strip()
+            pending &= ~matched
+        # First Last (also the fallback for rows that do not follow the dominant layout)
+        if pending.any():
+            parts = names[pending].str.rsplit(" ", n=1, expand=True)
+            if parts.shape[1] == 1:
+                parts[1] = pd.NA
+            single = parts[1].isna()
+            last[pending] = parts[1].where(~single, parts[0])
+            first[pending] = parts[0].where(~single, pd.NA)
+        return last.replace("", pd.NA), first.replace("", pd.NA)
+
+    def _normalize_nationality(self, series: pd.Series, source_name: str) -> pd.Series:
+        """Map a nationality column (names in several languages, ISO-2, ISO-3) to ISO-3 codes.
+        Only the distinct values are normalized, then the column is mapped in one call through
+        a categorical. Unknown values are kept as-is and recorded for the file.
+        """
+        cat = series.astype("category")
+        categories = pd.Series(cat.cat.categories, dtype="string")
+        # Same key function as the lookup table, so both sides always fold alike
+        codes = categories.map(_nationality_key).map(NATIONALITY_LOOKUP)
+        unknown = categories[codes.isna()].tolist()
+        if unknown:
+            self.unknown_nationalities.setdefault(source_name, set()).update(unknown)
+        mapping = dict(zip(categories.tolist(), codes.fillna(categories).tolist()))
+        return cat.map(mapping).astype("category")
+
+    def _validate_passenger_rows(self, mapped: pd.DataFrame) -> pd.DataFrame:
+        """Check mapped passenger rows column by column and return one line per issue
+        (VALIDATION_COLUMNS). Row is the passenger's row in its sheet, from the index
+        _read_with_best_header sets (1-based, as Excel shows it).
+        """
+        if mapped.empty:
+            return pd.DataFrame(columns=VALIDATION_COLUMNS)
+        today = pd.Timestamp(date.today())
+        passport = mapped["Passport"].astype("string").str.upper().str.replace(r"[\s\-]", "", regex=True)
+        dob = pd.to_datetime(mapped["DateOfBirth"], errors="coerce")
+        date_in = pd.to_datetime(mapped["DateEntree"], errors="coerce")
+        date_out = pd.to_datetime(mapped["DateSortie"], errors="coerce")
+        checks = [
+            ("LastName", "Nom manquant", mapped["LastName"].isna()),
+            ("FirstName", "Prénom manquant", mapped["FirstName"].isna()),
+            ("Passport", "Passeport manquant", passport.isna()),
+            ("Passport", "Passeport invalide", passport.notna() & ~passport.str.match(r"^[A-Z0-9]{5,12}$").fillna(False)),
+            ("DateOfBirth", "Date de naissance manquante ou illisible", dob.isna()),
+            ("DateOfBirth", "Date de naissance impossible",
+             dob.notna() & ((dob > today) | (dob < today - pd.DateOffset(years=120)))),
+            ("DateSortie", "Date de sortie avant la date d'entrée",
+             date_in.notna() & date_out.notna() & (date_out < date_in)),
+        ]
+        parts = []
+        for field_name, issue, mask in checks:
+            mask = mask.fillna(False).astype(bool)
+            if not mask.any():
+                continue
+            hit = mapped.loc[mask]
+            parts.append(pd.DataFrame({
+                "SourceFile": hit["SourceFile"].values,
+                "SourceSheet": hit["SourceSheet"].values,
+                "Row": hit.index.values,
+                "CruiseNumber": hit["CruiseNumber"].values,
+                "Field": field_name,
+                "Issue": issue,
+                "Value": hit[field_name].astype("string").values,
+            }))
+        if not parts:
+            return pd.DataFrame(columns=VALIDATION_COLUMNS)
+        return pd.concat(parts, ignore_index=True)
+
+    def _write_validation_report(self, issues: pd.DataFrame, dashboard: Path) -> Optional[Path]:
+        """Write the issue table (and per-file counts) next to the dashboard as <dashboard>_validation.xlsx."""
+        out_path = dashboard.with_name(dashboard.stem + "_validation.xlsx")
+        try:
+            if issues.empty:
+                per_file = pd.DataFrame(columns=["SourceFile"])
+            else:
+                per_file = issues.pivot_table(index="SourceFile", columns="Issue", values="Row",
+                                              aggfunc="count", fill_value=0).reset_index()
+            with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
+                issues.to_excel(writer, sheet_name="Anomalies", index=False)
+                per_file.to_excel(writer, sheet_name="Par fichier", index=False)
+            return out_path
+        except Exception:
+            return None
+
+    @staticmethod
+    def _file_key(path: Path) -> str:
+        """Key of file_cruise_numbers: the resolved path (same-named manifests of different
+        folders or agents may belong to different cruises)."""
+        return str(Path(path).resolve())
+
+    def _cruise_number_for_file(self, source_file: Path) -> str:
+        """Cruise number of a manifest: from the last detection, else the leading token of its name."""
+        known = self.file_cruise_numbers.get(self._file_key(source_file))
+        if known:
+            return known
+        m = re.match(r"\s*([A-Za-z0-9]+)", source_file.stem)
+        return self.normalize_cruise_number(m.group(1)) if m else ""
+
+    def _passenger_keys(self, df: pd.DataFrame) -> pd.Series:
+        """Dedup key per row: normalized passport + date of birth + cruise number (NA without passport)."""
+        passport = df["Passport"].astype("string").str.upper().str.replace(r"[^A-Z0-9]", "", regex=True)
+        dob = pd.to_datetime(df["DateOfBirth"], errors="coerce", dayfirst=True)
+        dob_txt = dob.dt.strftime("%Y-%m-%d").astype("string").fillna(
+            df["DateOfBirth"].astype("string").str.strip().fillna("")
+        )
+        cruise = df["CruiseNumber"].astype("string").fillna("")
+        keys = passport + "|" + dob_txt + "|" + cruise
+        return keys.where(passport.fillna("") != "", pd.NA)
+
+    def _dashboard_file(self) -> Path:
+        """Dashboard chosen in the UI, or 'dashboard.xlsx' in the manifests folder."""
+        chosen = (self.dashboard_path.get() or "").strip()
+        if chosen:
+            return Path(chosen)
+        dashboard = self.last_manifests_dir / "dashboard.xlsx"
+        self.dashboard_path.set(str(dashboard))
+        return dashboard
+
+    def _detailed_sheet_names(self, excel_path: Path) -> List[str]:
+        """Names of the sheets classified as detailed (passenger lists) in a workbook."""
+        return self._classify_sheets(excel_path)[0]
+
+    def _merge_file(self, f: Path) -> Dict:
+        """Mapped rows, validation issues and unknown nationalities of one manifest."""
+        result = {"frames": [], "issues": [], "unknown": {}, "error": ""}
+        try:
+            for sheet in self._detailed_sheet_names(f):
+                mapped = self._map_source_to_dashboard(self._read_with_best_header(f, sheet, project=True), f, sheet)
+                if not mapped.empty:
+                    result["frames"].append(mapped)
+                    result["issues"].append(self._validate_passenger_rows(mapped))
+        except Exception as e:
+            result["error"] = str(e)[:200]
+        if f.name in self.unknown_nationalities:
+            result["unknown"] = {f.name: set(self.unknown_nationalities[f.name])}
+        return result
+
+    def _merge_files(self, files: List[Path]) -> List[Dict]:
+        """Run _merge_file over files, in a process pool when there are enough of them.
+        Results come back in the order of files so the dashboard does not depend on scheduling."""
+        results: List[Optional[Dict]] = [None] * len(files)
+        workers = min(len(files), os.cpu_count() or 1)
+        if len(files) >= MERGE_PARALLEL_MIN_FILES and workers > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    date_formats = dict(self._date_format_cache)
+                    futures = {
+                        pool.submit(_merge_file_worker, str(f), self.file_cruise_numbers.get(self._file_key(f)),
+                                    date_formats): i
+                        for i, f in enumerate(files)
+                    }
+                    done = 0
+                    for fut in as_completed(futures):
+                        i = futures[fut]
+                        try:
+                            results[i] = fut.result()
+                            # Formats inferred by the workers serve the next merges of the same layouts
+                            self._date_format_cache.update(results[i].pop("date_formats", {}))
+                        except Exception as e:
+                            results[i] = {"frames": [], "issues": [], "unknown": {}, "error": str(e)[:200]}
+                        done += 1
+                        # Posted as an idle callback and flushed with the redraws: user events
+                        # stay queued, so no other handler runs in the middle of the merge
+                        self.root.after_idle(self.status_var.set, f"Merge en cours: {done}/{len(files)} fichier(s)...")
+                        self.root.update_idletasks()
+            except Exception:
+                # Pool unavailable (frozen build, broken worker...): finish in this process
+                pass
+        for i, f in enumerate(files):
+            if results[i] is None:
+                results[i] = self._merge_file(f)
+        return results
+
+    def _merge_rows_into_dashboard(self, new_rows: pd.DataFrame, dashboard: Path, update_existing: bool) -> Dict[str, int]:
+        """Append new passengers to the dashboard store, skipping/updating those already present.
+        Existing passengers are found through the key index (one lookup per row); the Excel
+        dashboard itself is not rewritten (see export_dashboard).
+        """
+        store = DashboardStore(dashboard)
+        committed = False
+        try:
+            if store.count() == 0 and dashboard.exists():
+                # First use of the store: import the existing Excel dashboard once
+                existing = pd.read_excel(dashboard, dtype=object)
+                for c in DASHBOARD_COLUMNS:
+                    if c not in existing.columns:
+                        existing[c] = pd.NA
+                if len(existing):
+                    ids = list(range(1, len(existing) + 1))
+                    store.append(ids, existing)
+                    store.index.rebuild(list(zip(self._passenger_keys(existing).tolist(), ids)))
+            appended: List[int] = []
+            appended_ids: List[int] = []
+            # Keyed rows appended by this batch, not in the store yet: key -> slot in appended
+            pending: Dict[str, int] = {}
+            updated, skipped = 0, 0
+            next_id = store.next_id()
+            keys = self._passenger_keys(new_rows) if len(new_rows) else pd.Series(dtype="string")
+            for pos, key in enumerate(keys.tolist()):
+                if key is pd.NA or key is None:
+                    key, row_id = None, None
+                elif key in pending:
+                    # Same passenger twice in one batch: the later row replaces the pending one
+                    if update_existing:
+                        appended[pending[key]] = pos
+                        updated += 1
+                    else:
+                        skipped += 1
+                    continue
+                else:
+                    row_id = store.index.get(key)
+                if row_id is None:
+                    if key is not None:
+                        store.index.put(key, next_id)
+                        pending[key] = len(appended)
+                    appended.append(pos)
+                    appended_ids.append(next_id)
+                    next_id += 1
+                elif update_existing:
+                    store.update(row_id, new_rows.iloc[pos])
+                    updated += 1
+                else:
+                    skipped += 1
+            if appended:
+                store.append(appended_ids, new_rows.iloc[appended])
+            total = store.count()
+            committed = True
+            return {"appended": len(appended), "updated": updated, "skipped": skipped, "total": total}
+        finally:
+            store.close(commit=committed)
+
+    def export_dashboard(self):
+        """Generate the Excel dashboard from the store (on demand)."""
+        try:
+            ok, _ = self._refresh_manifests_dir()
+            if not ok:
+                return
+            dashboard = self._dashboard_file()
+            store = DashboardStore(dashboard)
+            try:
+                if store.count() == 0:
+                    messagebox.showinfo("Info", "Aucun passager dans le dashboard. Lancez d'abord un merge.")
+                    return
+                self.status_var.set("Export du dashboard en cours...")
+                self.root.update()
+                n = store.export_excel(dashboard)
+            finally:
+                store.close(commit=False)
+            self.status_var.set(f"Dashboard exporté: {n} passager(s)")
+            messagebox.showinfo("Export dashboard", f"Passagers exportés: {n}\nFichier: {dashboard}")
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Erreur lors de l'export du dashboard:\n{str(e)}")
+
+    # --------- Summary sheets: statistics and reconciliation ---------
+    def _gender_codes(self, series: pd.Series) -> pd.Series:
+        """'F'/'M' from gender values (Female, F, W, Femme / Male, M, H, Homme), else missing."""
+        initials = series.astype("string").str.strip().str.upper().str[:1]
+        return initials.map({"F": "F", "W": "F", "M": "M", "H": "M"}).astype("string")
+
+    def _extract_summary_counts(self, excel_path: Path, sheet_name: str) -> pd.DataFrame:
+        """Per-nationality, per-gender counts of one summary sheet (STATS_COLUMNS).
+        The header is the first top row with a summary keyword; gender columns are recognised by
+        their header words, the label column is the nationality column (else the first other
+        column), and total lines are dropped. The sheet is read once and reshaped column-wise.
+        """
+        empty = pd.DataFrame(columns=STATS_COLUMNS)
+        raw = pd.read_excel(excel_path, sheet_name=sheet_name, header=None)
+        header_row = next(
+            (i for i, row in enumerate(raw.head(25).itertuples(index=False)) if SHEET_RULES.scan(row)[1]),
+            None,
+        )
+        if header_row is None:
+            return empty
+        headers = ["" if pd.isna(v) else str(v) for v in raw.iloc[header_row].tolist()]
+        gender_cols: Dict[int, str] = {}
+        for pos, h in enumerate(headers):
+            tokens = self._normalize_header(h).split()
+            for code, words in SUMMARY_GENDER_COLUMNS:
+                if any(t.startswith(w) for t in tokens for w in words):
+                    gender_cols[pos] = code
+                    break
+        if not gender_cols:
+            return empty
+
+        data = raw.iloc[header_row + 1:]
+        nat_col = self._find_col(
+            [h for pos, h in enumerate(headers) if pos not in gender_cols and h],
+            ["nationality", "nationality code", "nationalite", "citizenship", "pays", "country"],
+        )
+        label_pos = headers.index(nat_col) if nat_col else next(
+            (pos for pos, h in enumerate(headers) if pos not in gender_cols and h), None
+        )
+        if label_pos is None:
+            labels = pd.Series("", index=data.index, dtype="string")
+        else:
+            labels = data.iloc[:, label_pos].astype("string").str.strip()
+            keep = labels.notna() & (labels != "") & ~labels.str.upper().isin(SUMMARY_TOTAL_LABELS)
+            data, labels = data[keep], labels[keep]
+        long = pd.concat(
+            [
+                pd.DataFrame({"Nationality": labels, "Gender": code,
+                              "Count": pd.to_numeric(data.iloc[:, pos], errors="coerce")})
+                for pos, code in gender_cols.items()
+            ],
+            ignore_index=True,
+        ).dropna(subset=["Count"])
+        if long.empty:
+            return empty
+        long["Nationality"] = self._normalize_nationality(long["Nationality"], excel_path.name).astype("string").fillna("")
+        out = long.groupby(["Nationality", "Gender"], as_index=False)["Count"].sum()
+        out.insert(0, "CruiseNumber", self._cruise_number_for_file(excel_path))
+        out["Count"] = out["Count"].round().astype("int64")
+        out["SourceFile"] = excel_path.name
+        out["SourceSheet"] = sheet_name
+        return out[STATS_COLUMNS]
+
+    def _reconcile_counts(self, stats: pd.DataFrame, detailed: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Compare summary counts with merged passenger rows, per cruise and gender, and per
+        cruise, nationality and gender (summaries without a nationality column only take part
+        in the first). Only cruises that have a summary are compared."""
+        rows = detailed.assign(Gender=self._gender_codes(detailed["Gender"]),
+                               Nationality=detailed["Nationality"].astype("string").fillna(""))
+        rows = rows[rows["CruiseNumber"].isin(set(stats["CruiseNumber"]))]
+
+        def _compare(keys: List[str], expected: pd.DataFrame) -> pd.DataFrame:
+            exp = expected.groupby(keys, as_index=False)["Count"].sum().rename(columns={"Count": "Attendu"})
+            found = rows.dropna(subset=["Gender"]).groupby(keys).size().rename("Trouvé").reset_index()
+            found = found[found["CruiseNumber"].isin(set(exp["CruiseNumber"]))]
+            both = exp.merge(found, on=keys, how="outer")
+            both[["Attendu", "Trouvé"]] = both[["Attendu", "Trouvé"]].fillna(0).astype("int64")
+            both["Écart"] = both["Trouvé"] - both["Attendu"]
+            return both.sort_values(keys).reset_index(drop=True)
+
+        by_cruise = _compare(["CruiseNumber", "Gender"], stats)
+        by_nat = _compare(["CruiseNumber", "Nationality", "Gender"], stats[stats["Nationality"] != ""])
+        return by_cruise, by_nat
+
+    def _summary_source_files(self) -> List[Path]:
+        """Workbooks holding summary sheets: every 'excel resume' folder (whole tree in recursive
+        mode), else the summary and mixed files of the last detection."""
+        if self.recursive_scan_var.get():
+            _, folders = self._scan_manifest_tree(self.last_manifests_dir, recursive=True)
+        else:
+            folders = [self.last_manifests_dir]
+        files = sorted(
+            p for d in folders if (d / "excel resume").is_dir() for p in (d / "excel resume").iterdir()
+            if p.is_file() and p.suffix.lower() in ('.xlsx', '.xls') and not p.name.startswith("~$")
+        )
+        if not files:
+            files = [p for p in list(self.summary_excel_files) + list(self.mixed_excel_files) if p.exists()]
+        return files
+
+    def reconcile_summaries(self, silent: bool = False) -> Optional[dict]:
+        """Extract summary sheets into a counts table and reconcile it with the dashboard rows.
+        Writes '<dashboard>_stats.xlsx' (Résumés, Par croisière, Par nationalité, Écarts)."""
+        try:
+            ok, _ = self._refresh_manifests_dir(silent)
+            if not ok:
+                return {"error": "Dossier des manifestes invalide"} if silent else None
+            dashboard = self._dashboard_file()
+            files = self._summary_source_files()
+            self.status_var.set(f"Lecture des résumés: {len(files)} fichier(s)...")
+            self.root.update()
+
+            frames: List[pd.DataFrame] = []
+            failed: List[str] = []
+            for f in files:
+                try:
+                    for sheet in self._classify_sheets(f)[1]:
+                        counts = self._extract_summary_counts(f, sheet)
+                        if not counts.empty:
+                            frames.append(counts)
+                except Exception:
+                    failed.append(f.name)
+            stats = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=STATS_COLUMNS)
+
+            store_path = dashboard.with_name(dashboard.stem + ".store.sqlite")
+            detailed = pd.DataFrame(columns=["CruiseNumber", "Nationality", "Gender"])
+            if store_path.exists():
+                store = DashboardStore(dashboard)
+                try:
+                    detailed = store.frame(["CruiseNumber", "Nationality", "Gender"])
+                finally:
+                    store.close(commit=False)
+            by_cruise, by_nat = self._reconcile_counts(stats, detailed)
+            mismatches = pd.concat(
+                [by_cruise[by_cruise["Écart"] != 0].assign(Niveau="croisière"),
+                 by_nat[by_nat["Écart"] != 0].assign(Niveau="nationalité")],
+                ignore_index=True,
+            ).reindex(columns=["Niveau", "CruiseNumber", "Nationality", "Gender", "Attendu", "Trouvé", "Écart"])
+
+            out_path = dashboard.with_name(dashboard.stem + "_stats.xlsx")
+            with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
+                stats.to_excel(writer, sheet_name="Résumés", index=False)
+                by_cruise.to_excel(writer, sheet_name="Par croisière", index=False)
+                by_nat.to_excel(writer, sheet_name="Par nationalité", index=False)
+                mismatches.to_excel(writer, sheet_name="Écarts", index=False)
+
+            cruises = stats["CruiseNumber"].nunique()
+            bad_cruises = by_cruise.loc[by_cruise["Écart"] != 0, "CruiseNumber"].nunique()
+            self.status_var.set(f"Rapprochement: {cruises} croisière(s), {bad_cruises} avec écarts")
+            result = {"files": len(files) - len(failed), "failed": len(failed), "cruises": cruises,
+                      "cruises_with_gaps": bad_cruises, "gaps": len(mismatches), "report": str(out_path)}
+            if silent:
+                return result
+            details = (
+                f"Fichiers résumés lus: {result['files']} (échecs: {len(failed)})\n"
+                f"Croisières avec résumé: {cruises}\n"
+                f"Croisières avec écarts: {bad_cruises}\n"
+                f"Lignes en écart: {len(mismatches)}\n"
+                f"Rapport: {out_path}"
+            )
+            if bad_cruises:
+                worst = by_cruise[by_cruise["Écart"] != 0].head(15)
+                details += "\n\nÉcarts (croisière / sexe: trouvé vs attendu):\n- " + "\n- ".join(
+                    f"{r.CruiseNumber} / {r.Gender}: {r.Trouvé} vs {r.Attendu}" for r in worst.itertuples(index=False)
+                )
+            if failed:
+                details += "\n\nÉchecs:\n- " + "\n- ".join(failed)
+            messagebox.showinfo("Rapprochement des résumés", details)
+            return None
+        except Exception as e:
+            return self._report_error(f"Erreur lors du rapprochement:\n{str(e)}", silent)
+
+    def merge_to_dashboard(self, silent: bool = False) -> Optional[dict]:
+        """Merge detailed sheets of the 'excel correct' manifests into the dashboard file.
+        With silent=True no dialog is shown and the counts are returned instead."""
+        try:
+            ok, _ = self._refresh_manifests_dir(silent)
+            if not ok:
+                return {"error": "Dossier des manifestes invalide"} if silent else None
+            # Every 'excel correct' folder of the tree in recursive mode, else the top one
+            if self.recursive_scan_var.get():
+                _, folders = self._scan_manifest_tree(self.last_manifests_dir, recursive=True)
+            else:
+                folders = [self.last_manifests_dir]
+            source_dirs = [d / "excel correct" for d in folders if (d / "excel correct").is_dir()]
+            if not source_dirs:
+                source_dirs = [self.last_manifests_dir]
+            dashboard = self._dashboard_file()
+            files = sorted(
+                p for source_dir in source_dirs for p in source_dir.iterdir()
+                if p.is_file() and p.suffix.lower() in ('.xlsx', '.xls')
+                and not p.name.startswith("~$") and p.resolve() != dashboard.resolve()
+            )
+            self.status_var.set(f"Merge en cours: {len(files)} fichier(s)...")
+            self.root.update()
+
+            frames: List[pd.DataFrame] = []
+            issue_frames: List[pd.DataFrame] = []
+            failed: List[str] = []
+            self.unknown_nationalities = {}
+            for f, result in zip(files, self._merge_files(files)):
+                if result["error"]:
+                    failed.append(f.name)
+                    continue
+                frames.extend(result["frames"])
+                issue_frames.extend(result["issues"])
+                for name, values in result["unknown"].items():
+                    self.unknown_nationalities.setdefault(name, set()).update(values)
+            new_rows = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=DASHBOARD_COLUMNS)
+            # concat drops categoricals whose categories differ between files
+            for c in ("Nationality", "Gender"):
+                new_rows[c] = new_rows[c].astype("category")
+            res = self._merge_rows_into_dashboard(new_rows, dashboard, bool(self.merge_update_existing_var.get()))
+            issues = pd.concat(issue_frames, ignore_index=True) if issue_frames else pd.DataFrame(columns=VALIDATION_COLUMNS)
+            validation_path = self._write_validation_report(issues, dashboard)
+
+            self.status_var.set(
+                f"Merge terminé: {res['appended']} ajouté(s), {res['updated']} mis à jour, {res['skipped']} déjà présent(s)"
+            )
+            if silent:
+                return dict(res, files=len(files) - len(failed), failed=len(failed), issues=len(issues))
+            details = (
+                f"Fichiers lus: {len(files) - len(failed)} (échecs: {len(failed)})\n"
+                f"Passagers ajoutés: {res['appended']}\n"
+                f"Passagers mis à jour: {res['updated']}\n"
+                f"Déjà présents (ignorés): {res['skipped']}\n"
+                f"Total dashboard: {res['total']}\n"
+                f"Anomalies détectées: {len(issues)} (rapport: {validation_path.name if validation_path else 'non écrit'})\n"
+                f"Base: {dashboard.with_name(dashboard.stem + '.store.sqlite')}\n\n"
+                f"Utilisez '📤 Exporter dashboard' pour générer le fichier Excel."
+            )
+            if failed:
+                details += "\n\nÉchecs:\n- " + "\n- ".join(failed)
+            if self.unknown_nationalities:
+                details += "\n\nNationalités non reconnues:\n- " + "\n- ".join(
+                    f"{name}: {', '.join(sorted(values))}"
+                    for name, values in sorted(self.unknown_nationalities.items())
+                )
+            messagebox.showinfo("Merge dashboard", details)
+            return None
+        except Exception as e:
+            return self._report_error(f"Erreur lors du merge:\n{str(e)}", silent)
+
+
+if __name__ == "__main__":
+    CruiseDetectorGUI().run()
@@ -0,0 +1,98 @@
+"""Memory benchmark for detection results kept by tt.CruiseDetectorGUI.
+
+Compares the former layout (CruiseMatch dataclass holding row.to_dict() and its own
+list of file names, plus one Path per matched file) with the compact one (row index
+into cruise_df, interned file-name ids, one shared Path per name).
+
+Usage: python tt_bench_matches.py [rows] [manifests_per_cruise] [columns]
+"""
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+
+import pandas as pd
+
+from tt import CruiseMatch, FileNameTable
+
+
+@dataclass
+class LegacyCruiseMatch:
+    """Layout used before the compact CruiseMatch."""
+    excel_row: int
+    cruise_number: str
+    cruise_name: str
+    manifests: List[str]
+    excel_data: Dict
+
+
+def build_cruise_df(rows: int, columns: int) -> pd.DataFrame:
+    data = {"N": list(range(1, rows + 1)), "Nom": [f"Ship {i % 40}" for i in range(rows)]}
+    for c in range(columns - 2):
+        data[f"Col{c}"] = [f"value {c}-{i}" for i in range(rows)]
+    return pd.DataFrame(data)
+
+
+def file_names_for(number: int, per_cruise: int) -> List[str]:
+    # Fresh strings each time, as returned by iterdir() on every lookup
+    return ["".join([str(number), f"-Manifest-{k}.xlsx"]) for k in range(per_cruise)]
+
+
+def legacy(df: pd.DataFrame, base: Path, per_cruise: int):
+    matches, matched_files = [], []
+    for index, row in df.iterrows():
+        names = file_names_for(int(row["N"]), per_cruise)
+        matched_files.extend(base / n for n in names)
+        matches.append(LegacyCruiseMatch(
+            excel_row=index + 2,
+            cruise_number=str(row["N"]),
+            cruise_name=str(row["Nom"]),
+            manifests=names,
+            excel_data=row.to_dict(),
+        ))
+    return matches, matched_files
+
+
+def compact(df: pd.DataFrame, base: Path, per_cruise: int):
+    table = FileNameTable(base)
+    matches, matched_files = [], []
+    for index, row in df.iterrows():
+        ids = tuple(table.intern(n) for n in file_names_for(int(row["N"]), per_cruise))
+        matched_files.extend(table.path(i) for i in ids)
+        matches.append(CruiseMatch(
+            row_index=index,
+            cruise_number=str(row["N"]),
+            cruise_name=str(row["Nom"]),
+            manifest_ids=ids,
+            names=table,
+            df=df,
+        ))
+    return matches, matched_files, table
+
+
+def measure(fn, *args) -> int:
+    tracemalloc.start()
+    result = fn(*args)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def main(argv: List[str]):
+    rows = int(argv[1]) if len(argv) > 1 else 5000
+    per_cruise = int(argv[2]) if len(argv) > 2 else 2
+    columns = int(argv[3]) if len(argv) > 3 else 20
+    df = build_cruise_df(rows, columns)
+    base = Path("/manifests")
+    before = measure(legacy, df, base, per_cruise)
+    after = measure(compact, df, base, per_cruise)
+    print(f"Croisières: {rows}, manifestes/croisière: {per_cruise}, colonnes: {columns}")
+    print(f"Ancien format : {before / 1024 / 1024:8.2f} MB")
+    print(f"Format compact: {after / 1024 / 1024:8.2f} MB")
+    print(f"Réduction     : {100 * (1 - after / before):8.1f} %")
+
+
+if __name__ == "__main__":
+    main(sys.argv)